@@ -1,4 +1,5 @@
 from django.contrib import admin
+from . import search
 from .models import Post, Group, Comment
 
 
@@ -8,6 +9,12 @@ class PostAdmin(admin.ModelAdmin):
     search_fields = ("text",)
     list_filter = ("pub_date",)
 
+    def get_search_results(self, request, queryset, search_term):
+        # тот же полнотекстовый индекс, что и на сайте, вместо LIKE '%...%'
+        if not search_term:
+            return queryset, False
+        return search.get_backend().filter(queryset, search_term), False
+
 
 class GroupAdmin(admin.ModelAdmin):
     empty_value_display = 'Нетимени'
@@ -0,0 +1,203 @@
+"""
+JSON API лент и поста.
+
+Страницы те же, что у HTML-лент: общий кеш id и курсоры того же вида.
+ETag считается только по версиям в кеше - пространств ленты и
+'post:<id>' каждого поста страницы (её меняют правка, картинка и
+комментарии), поэтому на повторный запрос с If-None-Match ответ 304
+уходит без обращения к базе и без сериализации. Last-Modified не
+отдаётся: с точностью до секунды две правки подряд дали бы устаревший
+304 на If-Modified-Since. Версии поста создаются, только когда пост
+есть, иначе любой мог бы забить кеш ключами несуществующих постов. ?fields=id,text,... оставляет в постах только нужные поля.
+Комментарии отдаются страницами по тем же курсорам, что и на странице поста.
+Популярное версий не имеет и просто кешируется на TRENDING_CACHE_TIMEOUT.
+"""
+import hashlib
+
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET
+
+from yatube.db_router import replica_reads
+from . import cache as feed_cache, identity, timeline, trending
+from .models import Post
+from .pagination import KeysetPaginator
+
+FIELDS = {
+    'id': lambda post: post.id,
+    'text': lambda post: post.text,
+    'author': lambda post: post.author.username,
+    'group': lambda post: post.group.slug if post.group_id else None,
+    'pub_date': lambda post: post.pub_date.isoformat(),
+    'updated': lambda post: post.updated.isoformat(),
+    'comments_count': lambda post: post.comments_count,
+    'image': lambda post: post.renditions.get('card') or None,
+    'url': lambda post: reverse('post', args=(post.author.username, post.id)),
+}
+
+
+def _error(status, detail):
+    return JsonResponse({'detail': detail}, status=status)
+
+
+def _fields(request):
+    requested = request.GET.get('fields')
+    if not requested:
+        return list(FIELDS)
+    fields = [field for field in requested.split(',') if field]
+    unknown = [field for field in fields if field not in FIELDS]
+    if unknown:
+        raise ValueError('Неизвестные поля: %s' % ', '.join(unknown))
+    return fields
+
+
+def _serialize(post, fields):
+    return {field: FIELDS[field](post) for field in fields}
+
+
+def _conditional(request, namespaces, *extra):
+    """(ответ 304/412 или None, etag) по версиям из кеша."""
+    tokens = feed_cache.version_tokens(*namespaces)
+    etag = quote_etag(hashlib.md5('|'.join(tokens + [str(part) for part in extra]).encode()).hexdigest())
+    return get_conditional_response(request, etag=etag), etag
+
+
+def _respond(data, etag, private=False):
+    response = JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+    response['ETag'] = etag
+    # клиент каждый раз переспрашивает, а сервер отвечает 304, если ничего не изменилось
+    patch_cache_control(response, no_cache=True, private=private, public=not private)
+    return response
+
+
+def _feed(request, namespaces, build, private=False):
+    try:
+        fields = _fields(request)
+    except ValueError as error:
+        return _error(400, str(error))
+    cursor = request.GET.get('cursor')
+    ids, next_cursor, previous_cursor = feed_cache.feed_ids(namespaces, cursor, build)
+    not_modified, etag = _conditional(
+        request, list(namespaces) + ['post:%s' % post_id for post_id in ids], cursor, ','.join(fields)
+    )
+    if not_modified is not None:
+        return not_modified
+    return _respond({
+        'results': [_serialize(post, fields) for post in feed_cache.get_posts(ids)],
+        'next_cursor': next_cursor,
+        'previous_cursor': previous_cursor,
+    }, etag, private)
+
+
+def _ids_page(paginator):
+    return lambda cursor: feed_cache.post_ids_page(paginator, cursor)
+
+
+@replica_reads
+@require_GET
+def index(request):
+    paginator = KeysetPaginator(Post.objects.only('id', 'pub_date'), 10)
+    return _feed(request, ['index'], _ids_page(paginator))
+
+
+@replica_reads
+@require_GET
+def group_posts(request, slug):
+    group = identity.get_group(request, slug)
+    paginator = KeysetPaginator(Post.objects.filter(group=group).only('id', 'pub_date'), 10)
+    return _feed(request, ['group:%s' % group.id], _ids_page(paginator))
+
+
+@replica_reads
+@require_GET
+def profile(request, username):
+    user = identity.get_user(request, username)
+    paginator = KeysetPaginator(Post.objects.filter(author=user).only('id', 'pub_date'), 10)
+    return _feed(request, ['author:%s' % user.id], _ids_page(paginator))
+
+
+@replica_reads
+@require_GET
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return _error(401, 'Нужно войти')
+    namespaces, build = timeline.follow_feed(request.user, 5)
+    return _feed(request, namespaces, build, private=True)
+
+
+def _comments(page):
+    return {
+        'results': [
+            {'id': comment.id, 'author': comment.author.username, 'text': comment.text,
+             'created': comment.created.isoformat()}
+            for comment in page
+        ],
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+    }
+
+
+@replica_reads
+@require_GET
+def post_view(request, post_id):
+    """Пост и первая страница комментариев, дальше - post_comments."""
+    try:
+        fields = _fields(request)
+    except ValueError as error:
+        return _error(400, str(error))
+    posts = feed_cache.get_posts([post_id])
+    if not posts:
+        return _error(404, 'Пост не найден')
+    not_modified, etag = _conditional(
+        request, ['post:%s' % post_id, 'comments:%s' % post_id], ','.join(fields)
+    )
+    if not_modified is not None:
+        return not_modified
+    data = _serialize(posts[0], fields)
+    data['comments'] = _comments(feed_cache.comments_page(post_id))
+    return _respond(data, etag)
+
+
+@replica_reads
+@require_GET
+def post_comments(request, post_id):
+    """?cursor=... - следующая страница, ?order=new - сначала новые."""
+    cursor = request.GET.get('cursor')
+    newest_first = request.GET.get('order') == 'new'
+    if not feed_cache.get_posts([post_id]):
+        return _error(404, 'Пост не найден')
+    not_modified, etag = _conditional(
+        request, ['post:%s' % post_id, 'comments:%s' % post_id], cursor, newest_first
+    )
+    if not_modified is not None:
+        return not_modified
+    return _respond(_comments(feed_cache.comments_page(post_id, cursor, newest_first)), etag)
+
+
+@replica_reads
+@require_GET
+def trending_view(request):
+    """?window=1h|24h|7d - популярные группы и посты за окно."""
+    window = request.GET.get('window', trending.DEFAULT_WINDOW)
+    if window not in trending.WINDOWS:
+        return _error(400, 'Окно должно быть одним из: %s' % ', '.join(trending.WINDOWS))
+    try:
+        fields = _fields(request)
+    except ValueError as error:
+        return _error(400, str(error))
+    response = JsonResponse({
+        'window': window,
+        'groups': [
+            {'slug': row['group'].slug, 'title': row['group'].title, 'posts': row['posts'],
+             'comments': row['comments']}
+            for row in trending.hot_groups(window)
+        ],
+        'posts': [
+            dict(_serialize(post, fields), window_comments=comments)
+            for post, comments in trending.hot_posts(window)
+        ],
+    }, json_dumps_params={'ensure_ascii': False})
+    patch_cache_control(response, public=True, max_age=trending.cache_timeout())
+    return response
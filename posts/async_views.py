@@ -0,0 +1,166 @@
+"""
+Асинхронные версии лент для ASGI (yatube/asgi.py включает их через ASYNC_VIEWS).
+
+В Django 3.2 нет асинхронного ORM, а синхронные view под ASGI все идут
+через один общий поток: один медленный запрос к базе держит остальных.
+Здесь каждое обращение к базе и кешу уходит в общий пул потоков
+(sync_to_async(thread_sensitive=False)), а ожидание чужого пересчёта
+страницы в single-flight - через asyncio.sleep, не занимая поток.
+Контекст шаблонов тот же, что у синхронных view в views.py.
+"""
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import cache
+from django.db import connections
+from django.http import Http404
+from django.shortcuts import render
+
+from users import graph
+from yatube.db_router import replica_reads
+from . import cache as feed_cache, identity, timeline
+from .forms import CommentForm
+from .models import Post
+from .pagination import KeysetPage, KeysetPaginator
+from .views import comments_order
+
+
+def _in_thread(func):
+    def call(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # соединения потоков пула живут дольше запроса, сломанные закрываем сразу
+            for connection in connections.all():
+                if connection.errors_occurred:
+                    connection.close_if_unusable_or_obsolete()
+
+    return sync_to_async(call, thread_sensitive=False)
+
+
+_render = _in_thread(render)
+
+
+async def _single_flight(key, build, timeout=None):
+    value = await _in_thread(cache.get)(key)
+    if value is not None:
+        return value
+    lock = 'lock:%s' % key
+    if await _in_thread(cache.add)(lock, 1, feed_cache.lock_timeout()):
+        try:
+            value = await _in_thread(build)()
+            await _in_thread(cache.set)(key, value, timeout)
+        finally:
+            await _in_thread(cache.delete)(lock)
+        return value
+    deadline = time.monotonic() + feed_cache.lock_timeout()
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.02)
+        value = await _in_thread(cache.get)(key)
+        if value is not None:
+            return value
+    return await _in_thread(build)()
+
+
+async def _feed_page(namespaces, cursor, build):
+    """Асинхронный двойник feed_cache.feed_page с тем же ключом и содержимым кеша."""
+    versions = await _in_thread(feed_cache.versions)(*namespaces)
+    key = 'feed:%s:%s:%s' % (namespaces[0], versions, cursor or '')
+
+    def _build():
+        page = build(cursor)
+        return list(page.object_list), page.next_cursor, page.previous_cursor
+
+    ids, next_cursor, previous_cursor = await _single_flight(key, _build, feed_cache.timeout())
+    posts = await _in_thread(feed_cache.get_posts)(ids)
+    return KeysetPage(posts, None, next_cursor, previous_cursor)
+
+
+def _ids_page(paginator):
+    return lambda cursor: feed_cache.post_ids_page(paginator, cursor)
+
+
+@replica_reads
+async def index(request):
+    paginator = KeysetPaginator(Post.objects.only('id', 'pub_date'), 10)
+    page = await _feed_page(['index'], request.GET.get('cursor'), _ids_page(paginator))
+    return await _render(request, "index.html", {"page": page, 'paginator': paginator, "index": True})
+
+
+@replica_reads
+async def group_posts(request, slug):
+    group = await _in_thread(identity.get_group)(request, slug)
+    paginator = KeysetPaginator(Post.objects.filter(group=group).only('id', 'pub_date'), 10)
+    page = await _feed_page(['group:%s' % group.id], request.GET.get('cursor'), _ids_page(paginator))
+    return await _render(request, "group.html", {"group": group, "page": page, "paginator": paginator})
+
+
+def _profile_owner(request, username):
+    user = identity.get_user(request, username)
+    user.profile  # подгрузить здесь, в потоке, а не в шаблоне
+    return user, graph.is_following(request.user, user.id)
+
+
+@replica_reads
+async def profile(request, username):
+    user, following = await _in_thread(_profile_owner)(request, username)
+    name = user.first_name + ' ' + user.last_name
+    paginator = KeysetPaginator(Post.objects.filter(author=user).only('id', 'pub_date'), 10)
+    page = await _feed_page(['author:%s' % user.id], request.GET.get('cursor'), _ids_page(paginator))
+    if not page.object_list:
+        return await _render(request, 'profile.html', {'name': name, 'username': username, 'number_of_user_posts': 0,
+                                                       'following': following, 'profile': user.profile})
+    last_post = page[0]
+    return await _render(
+        request,
+        'profile.html',
+        {"following": following, 'name': name, 'username': username,
+         'number_of_user_posts': user.profile.posts_count, 'page': page, "paginator": paginator,
+         'last_post': last_post, 'last_post.pub_date': last_post.pub_date, 'profile': user.profile}
+    )
+
+
+def _post_with_comments(request, username, post_id):
+    user = identity.get_user(request, username)
+    user.profile
+    posts = feed_cache.get_posts([post_id])
+    if not posts or posts[0].author_id != user.id:
+        raise Http404
+    order = comments_order(request)
+    return user, posts[0], feed_cache.comments_page(post_id, request.GET.get('comments'), order == 'new'), order
+
+
+@replica_reads
+async def post_view(request, username, post_id):
+    user, post, items, order = await _in_thread(_post_with_comments)(request, username, post_id)
+    name = user.first_name + ' ' + user.last_name
+    return await _render(
+        request,
+        'post.html',
+        {'name': name, 'username': username, 'post': post, 'last_post.pub_date': post.pub_date,
+         'last_post.id': post.id, 'number_of_user_posts': user.profile.posts_count,
+         'form': CommentForm(), 'items': items, 'order': order, 'profile': user.profile})
+
+
+def _current_user(request):
+    # SimpleLazyObject ходит в сессию и базу - вычисляем его в потоке
+    return request.user if request.user.is_authenticated else None
+
+
+def _follow_feed(user):
+    # лента и подсказки одним заходом в пул
+    namespaces, build = timeline.follow_feed(user, 5)
+    return namespaces, build, graph.suggestions(user)
+
+
+@replica_reads
+async def follow_index(request):
+    user = await _in_thread(_current_user)(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+    namespaces, build, suggestions = await _in_thread(_follow_feed)(user)
+    page = await _feed_page(namespaces, request.GET.get('cursor'), build)
+    return await _render(request, "follow.html", {"index": False, "follow_index": True, "page": page,
+                                                  "paginator": page.paginator, "suggestions": suggestions})
@@ -0,0 +1,130 @@
+"""
+Групповая запись комментариев.
+
+По умолчанию save() просто сохраняет комментарий одной короткой
+транзакцией: INSERT и всё, что делают сигналы (счётчик, популярное,
+задача письма), уходит одним коммитом, а не пятью. С
+COMMENT_BATCH_WAIT_MS > 0 комментарий отдаётся потоку-писателю: тот
+собирает всё, что пришло за это время (не больше COMMENT_BATCH_SIZE), и
+сохраняет одной транзакцией, каждый комментарий в своей точке сохранения,
+так что ошибка одного не откатывает остальные. Запрос ждёт коммита своей
+пачки, поэтому после редиректа автор видит комментарий, как и без пачек.
+Под всплеском комментариев блокировка на запись берётся раз на пачку, а
+не на каждый комментарий.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from yatube import db_router
+
+logger = logging.getLogger(__name__)
+
+# дольше запрос не ждёт свою пачку
+RESULT_TIMEOUT = 30
+
+_lock = threading.Lock()
+_writer = None
+
+
+class Writer:
+    def __init__(self, wait, size):
+        self.wait = wait
+        self.size = size
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.thread = threading.Thread(target=self.run, name='comment-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, comment):
+        future = Future()
+        self.queue.put((comment, future))
+        return future
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.wait
+            while len(batch) < self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception as error:
+                # поток должен жить, а запросы - узнать об ошибке, а не ждать RESULT_TIMEOUT
+                logger.exception('Пачка из %s комментариев не записана', len(batch))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    def write(self, batch):
+        close_old_connections()
+        saved = []
+        try:
+            with transaction.atomic():
+                for comment, future in batch:
+                    try:
+                        with transaction.atomic():
+                            comment.save()
+                    except Exception as error:
+                        future.set_exception(error)
+                    else:
+                        saved.append((comment, future))
+        except Exception:
+            # не начался BEGIN (database is locked) или не прошёл COMMIT: внешние
+            # ключи SQLite проверяет только на нём, и один плохой комментарий
+            # откатил бы всю пачку - пишем по одному всё, что ещё без ответа
+            logger.warning('Пачка из %s комментариев не записана, пишем по одному', len(batch), exc_info=True)
+            for comment, future in batch:
+                if not future.done():
+                    self.write_one(comment, future)
+            return
+        self.batches += 1
+        for comment, future in saved:
+            future.set_result(comment)
+
+    def write_one(self, comment, future):
+        comment.pk = None
+        comment._state.adding = True
+        try:
+            with transaction.atomic():
+                comment.save()
+        except Exception as error:
+            future.set_exception(error)
+        else:
+            future.set_result(comment)
+
+
+def batch_settings():
+    return getattr(settings, 'COMMENT_BATCH_WAIT_MS', 0) / 1000, getattr(settings, 'COMMENT_BATCH_SIZE', 50)
+
+
+def get_writer():
+    global _writer
+    wait, size = batch_settings()
+    with _lock:
+        if _writer is None or (_writer.wait, _writer.size) != (wait, size) or not _writer.thread.is_alive():
+            _writer = Writer(wait, size)
+        return _writer
+
+
+def save(comment):
+    wait, _ = batch_settings()
+    if wait <= 0:
+        with transaction.atomic():
+            comment.save()
+        return comment
+    comment = get_writer().submit(comment).result(RESULT_TIMEOUT)
+    # записал другой поток, но для реплик это запись этого запроса
+    db_router.mark_written()
+    return comment
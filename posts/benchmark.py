@@ -0,0 +1,561 @@
+"""
+Нагрузочный прогон: наполнение базы и воспроизведение трафика.
+
+seed() создаёт пользователей, группы, посты, подписки и комментарии пачками
+(популярность авторов - по закону Ципфа, как в жизни), после чего
+пересчитывает счётчики, поисковый индекс и ленты подписок. run() гоняет
+запросы через тестовый клиент Django или через настоящий WSGI-сервер в
+соседнем потоке и собирает по каждой точке входа задержки, статусы и число
+SQL-запросов; run_asgi() - то же через AsyncClient в одном цикле событий.
+Команды - manage.py bench и manage.py bench_concurrency.
+"""
+import asyncio
+import itertools
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from http.cookiejar import Cookie, CookieJar
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import close_old_connections, connection, connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from users.models import Follow
+from . import counters, search, timeline, trending
+from .models import Comment, Group, Post, User
+
+DEFAULT_MIX = {'index': 30, 'group': 15, 'profile': 15, 'post': 20, 'follow': 15, 'comment': 5}
+# адрес не из INTERNAL_IPS, чтобы debug_toolbar не попадал в замеры
+REMOTE_ADDR = '10.0.0.1'
+BATCH_SIZE = 1000
+
+_WORDS = (
+    'утро вечер город море лес река горы дорога поезд книга кофе чай музыка кино друзья семья '
+    'работа отпуск погода дождь снег солнце ветер парк кошка собака фото прогулка выставка '
+    'концерт рецепт ужин завтрак спорт бег велосипед python django код релиз баг тесты'
+).split()
+
+
+@contextmanager
+def isolated(debug=False):
+    """
+    Своя тестовая база и свой префикс ключей кеша: рабочие данные и общий
+    кеш прогон не трогает. Без debug выключает DEBUG и debug_toolbar.
+    """
+    caches = {alias: dict(config, KEY_PREFIX='%s:bench-%s' % (config.get('KEY_PREFIX', ''), uuid.uuid4().hex))
+              for alias, config in settings.CACHES.items()}
+    # трассировки медленных запросов в прогоне - только шум
+    overrides = {'CACHES': caches, 'METRICS_TRACE_SAMPLE_RATE': 0}
+    if not debug:
+        # toolbar ещё и только синхронный: под ASGI он превратил бы всю цепочку в синхронную
+        overrides.update(DEBUG=False, MIDDLEWARE=[name for name in settings.MIDDLEWARE if 'debug_toolbar' not in name])
+    if connection.vendor == 'sqlite':
+        # общая in-memory база SQLite не ждёт блокировок, а сразу падает - берём файл
+        connection.settings_dict['TEST']['NAME'] = os.path.join(
+            tempfile.gettempdir(), 'yatube-bench-%s.sqlite3' % uuid.uuid4().hex
+        )
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    # реплики смотрят в ту же тестовую базу, как в тестах (TEST MIRROR)
+    replicas = {alias: dict(connections[alias].settings_dict) for alias in settings.DB_REPLICAS}
+    for alias in replicas:
+        connections[alias].close()
+        connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+    try:
+        with override_settings(**overrides):
+            yield
+    finally:
+        for alias, settings_dict in replicas.items():
+            connections[alias].close()
+            connections[alias].settings_dict = settings_dict
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def parse_mix(value):
+    """'index=30,post=20' -> {'index': 30, 'post': 20}."""
+    mix = {}
+    for part in filter(None, (part.strip() for part in value.split(','))):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise ValueError('неизвестная точка входа: %s' % name)
+        mix[name] = int(weight or 1)
+    if not any(mix.values()):
+        raise ValueError('пустая смесь запросов')
+    return mix
+
+
+def _zipf_weights(count):
+    return [1 / rank for rank in range(1, count + 1)]
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(_WORDS) for _ in range(words)).capitalize()
+
+
+def seed(users=100, posts=2000, groups=10, follows=2000, comments=4000, rng=None):
+    """Наполняет пустую базу; возвращает то, что нужно для генерации трафика."""
+    rng = rng or random.Random(0)
+    password = make_password(None)
+    User.objects.bulk_create(
+        (User(username='bench_%s' % i, password=password) for i in range(users)), batch_size=BATCH_SIZE
+    )
+    Group.objects.bulk_create(
+        (Group(title='Группа %s' % i, slug='bench-%s' % i, description=_text(rng, 10)) for i in range(groups)),
+        batch_size=BATCH_SIZE,
+    )
+    user_ids = list(User.objects.filter(username__startswith='bench_').order_by('id').values_list('id', flat=True))
+    group_ids = list(Group.objects.filter(slug__startswith='bench-').order_by('id').values_list('id', flat=True))
+    popularity = _zipf_weights(len(user_ids))
+
+    authors = rng.choices(user_ids, popularity, k=posts)
+    Post.objects.bulk_create(
+        (
+            Post(text=_text(rng, rng.randint(5, 40)), author_id=author_id,
+                 group_id=rng.choice(group_ids) if group_ids and rng.random() < 0.6 else None)
+            for author_id in authors
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+    pairs = set()
+    limit = min(follows, len(user_ids) * (len(user_ids) - 1))
+    while len(pairs) < limit:
+        user_id, author_id = rng.choice(user_ids), rng.choices(user_ids, popularity)[0]
+        if user_id != author_id:
+            pairs.add((user_id, author_id))
+    Follow.objects.bulk_create(
+        (Follow(user_id=user_id, author_id=author_id) for user_id, author_id in pairs),
+        batch_size=BATCH_SIZE, ignore_conflicts=True,
+    )
+
+    post_ids = list(Post.objects.order_by('id').values_list('id', flat=True))
+    if post_ids:
+        # свежие посты комментируют чаще
+        commented = rng.choices(post_ids, _zipf_weights(len(post_ids))[::-1], k=comments)
+        Comment.objects.bulk_create(
+            (Comment(post_id=post_id, author_id=rng.choice(user_ids), text=_text(rng, rng.randint(3, 15)))
+             for post_id in commented),
+            batch_size=BATCH_SIZE,
+        )
+
+    counters.reconcile()
+    trending.rebuild()
+    search.get_backend().rebuild()
+    timeline.rebuild()
+    return Dataset.load()
+
+
+class Dataset:
+    def __init__(self, users, groups, posts):
+        self.users = users
+        self.groups = groups
+        self.posts = posts
+
+    @classmethod
+    def load(cls):
+        users = list(User.objects.order_by('id').values_list('username', flat=True))
+        groups = list(Group.objects.order_by('id').values_list('slug', flat=True))
+        posts = list(Post.objects.order_by('id').values_list('author__username', 'id'))
+        return cls(users, groups, posts)
+
+    def counts(self):
+        return {
+            'users': len(self.users), 'groups': len(self.groups), 'posts': len(self.posts),
+            'follows': Follow.objects.count(), 'comments': Comment.objects.count(),
+        }
+
+
+def synthetic(dataset, mix, count, rng):
+    """Поток запросов по весам mix: словари как строки replay-файла."""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    for _ in range(count):
+        name = rng.choices(names, weights)[0]
+        user = rng.choice(dataset.users)
+        if name == 'index':
+            yield {'name': name, 'path': '/'}
+        elif name == 'group' and dataset.groups:
+            yield {'name': name, 'path': '/group/%s' % rng.choice(dataset.groups)}
+        elif name == 'profile':
+            yield {'name': name, 'path': '/%s/' % user}
+        elif name == 'post' and dataset.posts:
+            yield {'name': name, 'path': '/%s/%s/' % rng.choice(dataset.posts)}
+        elif name == 'follow':
+            yield {'name': name, 'path': '/follow/', 'user': user}
+        elif name == 'trending':
+            yield {'name': name, 'path': '/trending/?window=%s' % rng.choice(list(trending.WINDOWS))}
+        elif name == 'comment' and dataset.posts:
+            yield {'name': name, 'method': 'POST', 'path': '/%s/%s/comment/' % rng.choice(dataset.posts),
+                   'user': user, 'data': {'text': _text(rng, 8)}}
+
+
+def replay(path):
+    """
+    Строки JSONL вида {"method", "path", "user", "data", "name"}; всё,
+    кроме path, необязательно. Строки без path пропускаются и считаются.
+    """
+    entries, skipped = [], 0
+    with open(path, encoding='utf-8') as lines:
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            if not isinstance(entry, dict) or not isinstance(entry.get('path'), str):
+                skipped += 1
+                continue
+            entries.append(entry)
+    return entries, skipped
+
+
+def _route(path):
+    parts = [part for part in urllib.parse.urlsplit(path).path.split('/') if part]
+    if not parts:
+        return 'index'
+    if parts[0] in ('group', 'follow', 'search', 'new', 'trending'):
+        return parts[0]
+    if len(parts) == 1:
+        return 'profile'
+    return 'comment' if parts[-1] == 'comment' else 'post'
+
+
+class ClientSession:
+    def __init__(self, username=None):
+        self.client = Client(REMOTE_ADDR=REMOTE_ADDR)
+        if username:
+            self.client.force_login(User.objects.get(username=username))
+
+    def request(self, method, path, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            if method == 'POST':
+                response = self.client.post(path, data or {})
+            else:
+                response = self.client.get(path, data or {})
+        return response.status_code, len(queries)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+    def __init__(self, base_url, username=None):
+        self.base_url = base_url
+        self.cookies = CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect)
+        if username:
+            client = Client()
+            client.force_login(User.objects.get(username=username))
+            self._set_cookie(settings.SESSION_COOKIE_NAME, client.cookies[settings.SESSION_COOKIE_NAME].value)
+            # форма нового поста выдаёт csrftoken, дальше он уходит в заголовке
+            self.request('GET', '/new/')
+
+    def _set_cookie(self, name, value):
+        host = urllib.parse.urlsplit(self.base_url).hostname
+        self.cookies.set_cookie(Cookie(
+            0, name, value, None, False, host, False, False, '/', True, False, None, False, None, None, {}
+        ))
+
+    def _csrf_token(self):
+        return next((cookie.value for cookie in self.cookies if cookie.name == settings.CSRF_COOKIE_NAME), '')
+
+    def request(self, method, path, data=None):
+        body = None
+        url = self.base_url + path
+        if method == 'POST':
+            body = urllib.parse.urlencode(data or {}).encode()
+        elif data:
+            url += '?' + urllib.parse.urlencode(data)
+        request = urllib.request.Request(url, data=body, method=method, headers={'X-CSRFToken': self._csrf_token()})
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                status, headers = response.status, response.headers
+        except urllib.error.HTTPError as error:
+            error.read()
+            status, headers = error.code, error.headers
+        return status, int(headers.get('X-Bench-Queries', 0))
+
+
+def _counting_app(application):
+    """WSGI-обёртка: число SQL-запросов уходит клиенту в X-Bench-Queries."""
+
+    def app(environ, start_response):
+        environ['REMOTE_ADDR'] = REMOTE_ADDR
+        started = {}
+
+        def _start_response(status, headers, exc_info=None):
+            started.update(status=status, headers=headers, exc_info=exc_info)
+
+        with CaptureQueriesContext(connection) as queries:
+            body = application(environ, _start_response)
+        start_response(started['status'], started['headers'] + [('X-Bench-Queries', str(len(queries)))],
+                       started['exc_info'])
+        return body
+
+    return app
+
+
+class _ThreadingServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class Server:
+    def __init__(self):
+        self.httpd = make_server('127.0.0.1', 0, _counting_app(WSGIHandler()),
+                                 server_class=_ThreadingServer, handler_class=_QuietHandler)
+        self.base_url = 'http://127.0.0.1:%s' % self.httpd.server_port
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+
+def percentile(values, percent):
+    """Ближайший ранг: значение, не меньше которого percent% выборки."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+
+def summarize(samples, elapsed):
+    latencies = [sample['ms'] for sample in samples]
+    queries = [sample['queries'] for sample in samples if sample['queries'] is not None]
+    statuses = Counter(str(sample['status']) for sample in samples)
+    errors = sum(1 for sample in samples if sample['status'] is None or sample['status'] >= 500)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'statuses': dict(sorted(statuses.items())),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies, default=None),
+        },
+        'queries': {
+            'mean': round(sum(queries) / len(queries), 2) if queries else None,
+            'p50': percentile(queries, 50),
+            'max': max(queries, default=None),
+        },
+    }
+
+
+def run(entries, concurrency=1, base_url=None, warmup=0, workers=None):
+    """
+    Прогоняет entries в concurrency потоков, у каждого свои сессии (по одной
+    на пользователя). Первые warmup запросов только прогревают кеши. workers
+    ограничивает число одновременно обслуживаемых запросов, как потоки
+    воркера gunicorn; ожидание своей очереди входит в задержку.
+    """
+    session_class = ClientSession if base_url is None else (lambda user: HttpSession(base_url, user))
+    if workers:
+        session_class = _limited(session_class, threading.BoundedSemaphore(workers))
+    entries = list(entries)
+    if warmup:
+        _worker(iter(entries[:warmup]), session_class, [], threading.Lock())
+        entries = entries[warmup:]
+    source = iter(entries)
+    lock = threading.Lock()
+    samples = []
+    started = time.perf_counter()
+    if concurrency > 1:
+        threads = [threading.Thread(target=_thread_worker, args=(source, session_class, samples, lock))
+                   for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        _worker(source, session_class, samples, lock)
+    return _report(samples, time.perf_counter() - started)
+
+
+def run_asgi(entries, concurrency=1, warmup=0):
+    """
+    То же через AsyncClient: concurrency задач в одном цикле событий, как
+    клиенты одного ASGI-процесса. SQL здесь не считаются.
+    """
+    return asyncio.run(_run_asgi(list(entries), concurrency, warmup))
+
+
+def _report(samples, elapsed):
+    by_endpoint = defaultdict(list)
+    for sample in samples:
+        by_endpoint[sample['name']].append(sample)
+    return {
+        'elapsed_s': round(elapsed, 3),
+        'total': summarize(samples, elapsed),
+        'endpoints': {name: summarize(group, elapsed) for name, group in sorted(by_endpoint.items())},
+    }
+
+
+def _limited(session_class, semaphore):
+    def create(user):
+        session = session_class(user)
+        request = session.request
+
+        def limited_request(*args, **kwargs):
+            with semaphore:
+                return request(*args, **kwargs)
+
+        session.request = limited_request
+        return session
+
+    return create
+
+
+def _thread_worker(*args):
+    try:
+        _worker(*args)
+    finally:
+        close_old_connections()
+
+
+def _worker(source, session_class, samples, lock):
+    sessions = {}
+    while True:
+        with lock:
+            entry = next(source, None)
+        if entry is None:
+            return
+        user = entry.get('user')
+        method = entry.get('method', 'GET').upper()
+        started = time.perf_counter()
+        try:
+            if user not in sessions:
+                sessions[user] = session_class(user)
+                started = time.perf_counter()
+            status, queries = sessions[user].request(method, entry['path'], entry.get('data'))
+        except Exception:
+            status, queries = None, 0
+        sample = {
+            'name': entry.get('name') or _route(entry['path']),
+            'ms': round((time.perf_counter() - started) * 1000, 3),
+            'status': status,
+            'queries': queries,
+        }
+        with lock:
+            samples.append(sample)
+
+
+async def _run_asgi(entries, concurrency, warmup):
+    clients = {}
+
+    async def client_for(user):
+        if user not in clients:
+            client = AsyncClient()
+            if user:
+                account = await sync_to_async(User.objects.get)(username=user)
+                await sync_to_async(client.force_login)(account)
+            clients[user] = client
+        return clients[user]
+
+    async def worker(source, samples):
+        # итератор общий, но задачи в одном цикле событий - без гонок
+        for entry in source:
+            client = await client_for(entry.get('user'))
+            started = time.perf_counter()
+            try:
+                if entry.get('method', 'GET').upper() == 'POST':
+                    response = await client.post(entry['path'], entry.get('data') or {})
+                else:
+                    response = await client.get(entry['path'], entry.get('data') or {})
+                status = response.status_code
+            except Exception:
+                status = None
+            samples.append({
+                'name': entry.get('name') or _route(entry['path']),
+                'ms': round((time.perf_counter() - started) * 1000, 3),
+                'status': status,
+                'queries': None,
+            })
+
+    if warmup:
+        await worker(iter(entries[:warmup]), [])
+    source = iter(entries[warmup:])
+    samples = []
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(source, samples) for _ in range(max(1, concurrency))))
+    return _report(samples, time.perf_counter() - started)
+
+
+@contextmanager
+def db_latency(seconds):
+    """Задержка перед каждым SQL, как у базы за сетью; поток при этом отпускает GIL."""
+    active = [True]
+
+    def delay(execute, sql, params, many, context):
+        # соединения чужих потоков (пула у async-view) так и остаются с обёрткой
+        if active[0]:
+            time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def install(connection, **kwargs):
+        if delay not in connection.execute_wrappers:
+            connection.execute_wrappers.append(delay)
+
+    if not seconds:
+        yield
+        return
+    connection_created.connect(install, weak=False)
+    for alias_connection in connections.all():
+        install(alias_connection)
+    try:
+        yield
+    finally:
+        active[0] = False
+        connection_created.disconnect(install)
+        for alias_connection in connections.all():
+            if delay in alias_connection.execute_wrappers:
+                alias_connection.execute_wrappers.remove(delay)
+
+
+def compare(report, baseline):
+    """Строки 'endpoint: p95 было -> стало (+x%)' для сравнения двух прогонов."""
+    lines = []
+    for name, current in itertools.chain([('total', report['total'])], report['endpoints'].items()):
+        previous = baseline['total'] if name == 'total' else baseline.get('endpoints', {}).get(name)
+        if not previous or not previous['latency_ms']['p95'] or current['latency_ms']['p95'] is None:
+            continue
+        before, after = previous['latency_ms']['p95'], current['latency_ms']['p95']
+        lines.append('%s: p95 %.1f -> %.1f ms (%+.0f%%), запросов к БД %s -> %s' % (
+            name, before, after, (after - before) * 100 / before,
+            previous['queries']['mean'], current['queries']['mean'],
+        ))
+    return lines
@@ -0,0 +1,280 @@
+"""
+Потоковый импорт и экспорт: JSONL и CSV.
+
+Экспорт идёт по values_list().iterator(), импорт - пачками через один
+подготовленный INSERT (insert()), каждая в своей транзакции, так что память ограничена размером пачки и
+картой username/slug -> id. Даты публикации сохраняются как в файле, id
+постов и комментариев тоже, если они есть, - по ним комментарии находят
+свои посты. Повторная загрузка того же файла ничего не дублирует: строки
+с id пропускает конфликт ключа, а строки без id - естественный ключ
+(автор, дата, хеш текста; у комментария ещё пост). Строки без даты
+получают текущее время, поэтому их повтор не узнать - такие файлы стоит
+выгружать с датами. Сигналы при этом не отправляются, поэтому после
+загрузки пересчитываются счётчики, поисковый индекс и ленты
+(finish_import()).
+"""
+import csv
+import hashlib
+import json
+import sys
+from contextlib import contextmanager
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from users.models import Profile
+from . import cache as feed_cache
+from . import counters, search, timeline, trending
+from .models import Group, User
+
+FORMATS = ('jsonl', 'csv')
+
+
+class BadRow(ValueError):
+    pass
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    if path and path.endswith('.csv'):
+        return 'csv'
+    return 'jsonl'
+
+
+@contextmanager
+def open_stream(path, mode, default=None):
+    """'-' или None - default (по умолчанию stdin/stdout), иначе файл в UTF-8."""
+    if path in (None, '-'):
+        yield default or (sys.stdin if mode == 'r' else sys.stdout)
+        return
+    with open(path, mode, encoding='utf-8', newline='') as stream:
+        yield stream
+
+
+def read_rows(stream, fmt):
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            raise CommandError('Строка %s: %s' % (number, error))
+        yield row
+
+
+def write_rows(stream, fmt, fields, rows):
+    """rows - кортежи в порядке fields; возвращает число записанных строк."""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(fields)
+        for row in rows:
+            writer.writerow(['' if value is None else _dump(value) for value in row])
+            count += 1
+        return count
+    for row in rows:
+        stream.write(json.dumps({field: _dump(value) for field, value in zip(fields, row)}, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+def _dump(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_date(value):
+    if not value:
+        return timezone.now()
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise BadRow('неверная дата %r' % value)
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.utc)
+    return parsed
+
+
+def parse_id(value):
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise BadRow('неверный id %r' % value)
+
+
+class NaturalKeys:
+    """username -> id и slug -> id целиком в памяти; недостающих авторов можно создать."""
+
+    def __init__(self, create_users=False):
+        self.create_users = create_users
+        self.users = dict(User.objects.values_list('username', 'id').iterator())
+        self.groups = None
+
+    def user(self, username):
+        if not username:
+            raise BadRow('пустой username')
+        user_id = self.users.get(username)
+        if user_id is None:
+            raise BadRow('нет пользователя %r' % username)
+        return user_id
+
+    def group(self, slug):
+        if not slug:
+            return None
+        if self.groups is None:
+            self.groups = dict(Group.objects.values_list('slug', 'id').iterator())
+        group_id = self.groups.get(slug)
+        if group_id is None:
+            raise BadRow('нет группы %r' % slug)
+        return group_id
+
+    def ensure_users(self, usernames):
+        """Создаёт одним запросом тех, кого ещё нет (без пароля, войти нельзя)."""
+        missing = {name for name in usernames if name and name not in self.users}
+        if not missing or not self.create_users:
+            return
+        password = make_password(None)
+        User.objects.bulk_create((User(username=name, password=password) for name in sorted(missing)),
+                                 ignore_conflicts=True)
+        created = dict(User.objects.filter(username__in=missing).values_list('username', 'id'))
+        Profile.objects.bulk_create((Profile(user_id=user_id) for user_id in created.values()),
+                                    ignore_conflicts=True)
+        self.users.update(created)
+
+
+def insert(model, rows):
+    """
+    rows - словари attname -> значение, недостающие поля получают default
+    модели. Один подготовленный INSERT на всю пачку через executemany: без
+    компиляции ORM на каждую строку и без auto_now, даты берутся как есть.
+    Строки с уже существующим ключом пропускаются.
+    """
+    meta = model._meta
+    # сам объект соединения, а не прокси: на каждое поле каждой строки дешевле
+    db = connections[DEFAULT_DB_ALIAS]
+    ops = db.ops
+    with_pk = list(meta.concrete_fields)
+    without_pk = [field for field in with_pk if field is not meta.pk]
+    batches = {True: [], False: []}
+    for row in rows:
+        has_pk = row.get(meta.pk.attname) is not None
+        batches[has_pk].append([
+            field.get_db_prep_save(row[field.attname] if field.attname in row else field.get_default(), db)
+            for field in (with_pk if has_pk else without_pk)
+        ])
+    suffix = ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)
+    with db.cursor() as cursor:
+        for has_pk, values in batches.items():
+            if not values:
+                continue
+            fields = with_pk if has_pk else without_pk
+            cursor.executemany('%s %s (%s) VALUES (%s) %s' % (
+                ops.insert_statement(ignore_conflicts=True), ops.quote_name(meta.db_table),
+                ', '.join(ops.quote_name(field.column) for field in fields), ', '.join(['%s'] * len(fields)), suffix,
+            ), values)
+
+
+# строк на один запрос проверки: параметров не больше 999, лимита SQLite
+NATURAL_KEY_BATCH = 300
+
+
+def _text_hash(text):
+    return hashlib.sha1(text.encode()).digest()
+
+
+def drop_existing(model, values, natural_key):
+    """
+    Убирает строки без id, уже сохранённые или повторённые в пачке.
+    natural_key - attname полей, последнее - текст, он сравнивается по хешу.
+    """
+    *fields, text = natural_key
+    pk = model._meta.pk.attname
+
+    def key(row):
+        return tuple(row[field] for field in fields) + (_text_hash(row[text]),)
+
+    candidates = [row for row in values if row.get(pk) is None]
+    seen = set()
+    for chunk in chunks(candidates, NATURAL_KEY_BATCH):
+        existing = model.objects.filter(**{
+            '%s__in' % field: {row[field] for row in chunk} for field in fields
+        }).values_list(*fields, text)
+        seen.update(tuple(found[:-1]) + (_text_hash(found[-1]),) for found in existing.iterator())
+    kept = []
+    for row in values:
+        if row.get(pk) is None:
+            row_key = key(row)
+            if row_key in seen:
+                continue
+            seen.add(row_key)
+        kept.append(row)
+    return kept
+
+
+def load(rows, build, model, batch_size, on_error, before_chunk=None, natural_key=None):
+    """
+    build(row) -> словарь для insert() или BadRow. Каждая пачка - одна
+    транзакция, загрузку можно повторить: с natural_key строки без id,
+    которые уже есть в базе, пропускаются (drop_existing()).
+    """
+    loaded = skipped = 0
+    for chunk in chunks(rows, batch_size):
+        if before_chunk is not None:
+            before_chunk(chunk)
+        values = []
+        for row in chunk:
+            try:
+                values.append(build(row))
+            except (BadRow, KeyError, TypeError) as error:
+                skipped += 1
+                on_error(row, error)
+        loaded += len(values)
+        with transaction.atomic():
+            if natural_key:
+                values = drop_existing(model, values, natural_key)
+            insert(model, values)
+    return loaded, skipped
+
+
+def reset_sequences(*models):
+    # после вставки с явными id счётчик PostgreSQL остался бы позади
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+def finish_import(namespaces=(), posts=(), rebuild_search=False, rebuild_timelines=False):
+    """Пересчёт производных данных и сброс кеша того, что задела загрузка."""
+    with transaction.atomic():
+        counters.reconcile()
+        trending.rebuild()
+        if rebuild_search:
+            search.get_backend().rebuild()
+        if rebuild_timelines:
+            timeline.rebuild()
+    for chunk in chunks(namespaces, 1000):
+        feed_cache.bump(*chunk)
+    for chunk in chunks(posts, 1000):
+        feed_cache.forget_posts(*chunk)
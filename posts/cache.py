@@ -0,0 +1,163 @@
+"""
+Версионированный кеш лент и постов.
+
+Страница ленты хранится как список id постов плюс курсоры под ключом,
+в который входят версии её зависимостей ('index', 'group:<id>',
+'author:<id>', 'follow:<user_id>'). Сигналы меняют версию ровно тех
+пространств, которые задела запись, поэтому TTL может быть длинным, а
+свежесть - мгновенной. Сами посты лежат по одному под 'post:<id>' и
+удаляются при правке или новом комментарии, заодно меняется версия
+'post:<id>'. В кеш попадают только общие для всех данные; всё, что
+зависит от пользователя, шаблон дорисовывает при каждом запросе.
+
+Дорогие пересчёты идут через single_flight(): при промахе считает один
+процесс, остальные ждут его результат, а не бьют в базу все сразу.
+"""
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from yatube import db_router
+from .models import Comment, Post
+from .pagination import KeysetPage, KeysetPaginator
+
+COMMENTS_PER_PAGE = 20
+
+
+def timeout():
+    value = getattr(settings, 'FEED_CACHE_TIMEOUT', 60 * 60 * 24)
+    if db_router.reads_from_replica():
+        # реплика могла ещё не догнать запись, которая сменила версию
+        return min(value, getattr(settings, 'DB_REPLICA_STICKY_SECONDS', 10))
+    return value
+
+
+def lock_timeout():
+    return getattr(settings, 'FEED_CACHE_LOCK_TIMEOUT', 5)
+
+
+def single_flight(key, build, timeout=None):
+    value = cache.get(key)
+    if value is not None:
+        return value
+    lock = 'lock:%s' % key
+    if cache.add(lock, 1, lock_timeout()):
+        try:
+            value = build()
+            cache.set(key, value, timeout)
+        finally:
+            cache.delete(lock)
+        return value
+    deadline = time.monotonic() + lock_timeout()
+    while time.monotonic() < deadline:
+        time.sleep(0.02)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    # не дождались - считаем сами, но в кеш не пишем поверх чужого результата
+    return build()
+
+
+def _version_key(namespace):
+    return 'version:%s' % namespace
+
+
+def _new_token():
+    return uuid.uuid4().hex
+
+
+def version_tokens(*namespaces):
+    keys = [_version_key(namespace) for namespace in namespaces]
+    found = cache.get_many(keys)
+    missing = {key: _new_token() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return [found[key] for key in keys]
+
+
+def versions(*namespaces):
+    return hashlib.md5('.'.join(version_tokens(*namespaces)).encode()).hexdigest()
+
+
+def bump(*namespaces):
+    if not namespaces:
+        return
+
+    def _set():
+        cache.set_many({_version_key(namespace): _new_token() for namespace in namespaces}, None)
+
+    # сразу - чтобы тот же запрос увидел изменения, после коммита - чтобы
+    # параллельный читатель не закешировал данные до коммита под новой версией
+    _set()
+    transaction.on_commit(_set)
+
+
+def forget_posts(*post_ids):
+    """Сбрасывает закешированные посты и их версии 'post:<id>' (по ним ETag в API)."""
+    keys = ['post:%s' % post_id for post_id in post_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+    bump(*('post:%s' % post_id for post_id in post_ids))
+
+
+def get_posts(ids):
+    keys = {'post:%s' % post_id: post_id for post_id in ids}
+    found = {keys[key]: post for key, post in cache.get_many(keys).items()}
+    missing = [post_id for post_id in ids if post_id not in found]
+    if missing:
+        loaded = Post.objects.for_feed().in_bulk(missing)
+        cache.set_many({'post:%s' % post_id: post for post_id, post in loaded.items()}, timeout())
+        found.update(loaded)
+    return [found[post_id] for post_id in ids if post_id in found]
+
+
+def post_ids_page(paginator, cursor):
+    page = paginator.get_page(cursor)
+    page.object_list = [post.pk for post in page]
+    return page
+
+
+def feed_ids(namespaces, cursor, build):
+    """
+    id постов страницы ленты и соседние курсоры из кеша. build(cursor) при
+    промахе возвращает KeysetPage с id постов.
+    """
+    key = 'feed:%s:%s:%s' % (namespaces[0], versions(*namespaces), cursor or '')
+
+    def _build():
+        page = build(cursor)
+        return list(page.object_list), page.next_cursor, page.previous_cursor
+
+    return single_flight(key, _build, timeout())
+
+
+def feed_page(namespaces, cursor, build):
+    """Страница ленты из кеша: feed_ids() плюс сами посты."""
+    ids, next_cursor, previous_cursor = feed_ids(namespaces, cursor, build)
+    return KeysetPage(get_posts(ids), None, next_cursor, previous_cursor)
+
+
+def comments_page(post_id, cursor=None, newest_first=False, per_page=COMMENTS_PER_PAGE):
+    """
+    Страница комментариев поста с авторами, по (created, id) в любую
+    сторону. Весь список не грузится никогда: каждая страница - свой ключ
+    кеша под версией 'comments:<post_id>'.
+    """
+    order = 'new' if newest_first else 'old'
+    key = 'comments:%s:%s:%s:%s:%s' % (post_id, versions('comments:%s' % post_id), order, per_page, cursor or '')
+
+    def _build():
+        paginator = KeysetPaginator(
+            Comment.objects.filter(post_id=post_id).select_related('author'), per_page,
+            ('-created', '-id') if newest_first else ('created', 'id'),
+        )
+        page = paginator.get_page(cursor)
+        return list(page.object_list), page.next_cursor, page.previous_cursor
+
+    comments, next_cursor, previous_cursor = single_flight(key, _build, timeout())
+    return KeysetPage(comments, None, next_cursor, previous_cursor)
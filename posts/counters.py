@@ -0,0 +1,60 @@
+"""
+Денормализованные счётчики: Post.comments_count и users.Profile.
+
+Сигналы меняют их атомарным UPDATE ... SET x = x + 1, а reconcile()
+пересчитывает всё пачкой коррелированных подзапросов, например после
+массового импорта или ручной правки базы. Отписка, опустившая автора ниже
+TIMELINE_FANOUT_LIMIT, ставит задачу разложить его посты по лентам.
+Любой переход через порог меняет версию 'celebrities'.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from users.models import Follow, Profile
+from . import cache as feed_cache, tasks, timeline
+from .models import Comment, Post, User
+
+
+def _bump(queryset, field, delta):
+    queryset.update(**{field: F(field) + delta})
+
+
+def post_added(post, delta=1):
+    _bump(Profile.objects.filter(user_id=post.author_id), 'posts_count', delta)
+
+
+def comment_added(comment, delta=1):
+    _bump(Post.objects.filter(pk=comment.post_id), 'comments_count', delta)
+
+
+def follow_added(follow, delta=1):
+    _bump(Profile.objects.filter(user_id=follow.author_id), 'followers_count', delta)
+    _bump(Profile.objects.filter(user_id=follow.user_id), 'following_count', delta)
+    followers = Profile.objects.filter(user_id=follow.author_id).values_list('followers_count', flat=True).first()
+    limit = timeline.fanout_limit()
+    if followers is not None and (followers < limit) != (followers - delta < limit):
+        # списки авторов над порогом (timeline.celebrity_authors) устарели у всех
+        feed_cache.bump('celebrities')
+        if delta < 0:
+            # пока автор был над порогом, его новые посты в ленты не попадали
+            tasks.refan.enqueue(follow.author_id)
+
+
+def _count(queryset, field, outer='pk'):
+    counted = queryset.filter(**{field: OuterRef(outer)}).order_by().values(field) \
+        .annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+
+def reconcile():
+    Profile.objects.bulk_create(
+        (Profile(user_id=user_id) for user_id in
+         User.objects.filter(profile__isnull=True).values_list('pk', flat=True).iterator()),
+        batch_size=500,
+    )
+    Post.objects.update(comments_count=_count(Comment.objects, 'post'))
+    Profile.objects.update(
+        posts_count=_count(Post.objects, 'author', 'user_id'),
+        followers_count=_count(Follow.objects, 'author', 'user_id'),
+        following_count=_count(Follow.objects, 'user', 'user_id'),
+    )
@@ -0,0 +1,37 @@
+"""
+Карта объектов на время одного запроса.
+
+Профиль, пост, правка и комментарий по нескольку раз ищут одного и того же
+пользователя по username; здесь каждый объект загружается не больше одного
+раза за запрос, а текущий пользователь вообще не запрашивается повторно.
+"""
+from django.shortcuts import get_object_or_404
+
+from .models import Group, User
+
+
+def _identity_map(request):
+    try:
+        return request._identity_map
+    except AttributeError:
+        request._identity_map = {}
+        return request._identity_map
+
+
+def get_user(request, username):
+    objects = _identity_map(request)
+    key = ('user', username)
+    if key not in objects:
+        if request.user.is_authenticated and request.user.username == username:
+            objects[key] = request.user
+        else:
+            objects[key] = get_object_or_404(User.objects.select_related('profile'), username=username)
+    return objects[key]
+
+
+def get_group(request, slug):
+    objects = _identity_map(request)
+    key = ('group', slug)
+    if key not in objects:
+        objects[key] = get_object_or_404(Group, slug=slug)
+    return objects[key]
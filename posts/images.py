@@ -0,0 +1,124 @@
+"""
+Фоновая подготовка картинок постов.
+
+Загрузка в new_post/post_edit только сохраняет оригинал; нарезка под
+карточку и превью, снятие метаданных и перекодирование в AVIF/WebP (если
+их умеет Pillow) с JPEG на всякий случай делает задача очереди
+posts.tasks.build_renditions: она переживает перезапуск и повторяется при
+сбое. Готовые адреса ложатся в Post.renditions, до этого шаблон
+показывает заглушку. В имени нарезки - хеш содержимого оригинала, поэтому
+новая картинка получает новые адреса, а старые файлы можно кешировать
+навсегда (immutable) и удалять, когда картинку заменили или пост удалён.
+"""
+import hashlib
+import io
+import logging
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from . import cache as feed_cache
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS = {
+    'card': (960, 339),
+    'thumb': (320, 113),
+}
+# порядок важен: шаблон предлагает браузеру форматы в этом порядке
+FORMATS = (
+    ('avif', 'AVIF', {'quality': 60}),
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+)
+
+def supported_formats():
+    return [fmt for fmt in FORMATS if fmt[0] == 'jpeg' or features.check(fmt[0])]
+
+
+def render(source, size):
+    # exif_transpose поворачивает по EXIF, а новый кадр уже без метаданных
+    image = ImageOps.exif_transpose(source)
+    image = ImageOps.fit(image.convert('RGB'), size, Image.LANCZOS, centering=(0.5, 0.5))
+    clean = Image.new('RGB', image.size)
+    clean.paste(image)
+    return clean
+
+
+def _save(path, image, pil_format, options):
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, **options)
+    # имя с хешем: существующий файл - та же нарезка того же оригинала
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    return default_storage.save(path, ContentFile(buffer.getvalue()))
+
+
+def files(post_id, renditions):
+    """Файлы нарезок поста; до хешей в именах список не хранился, а имена были постоянными."""
+    if not renditions:
+        return []
+    if 'files' in renditions:
+        return renditions['files']
+    return ['renditions/%s/%s.%s' % (post_id, name, ext) for name in RENDITIONS for ext, _, _ in FORMATS]
+
+
+def delete_files(paths):
+    for path in paths:
+        try:
+            default_storage.delete(path)
+        except OSError:
+            logger.warning('Не удалось удалить нарезку %s', path, exc_info=True)
+
+
+def build(post_id, image_name):
+    with default_storage.open(image_name, 'rb') as stored:
+        data = stored.read()
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    source = Image.open(io.BytesIO(data))
+    source.load()
+
+    renditions = {'source': image_name, 'files': []}
+    for name, size in RENDITIONS.items():
+        image = render(source, size)
+        renditions[name] = {}
+        for ext, pil_format, options in supported_formats():
+            path = _save('renditions/%s/%s-%s.%s' % (post_id, name, digest, ext), image, pil_format, options)
+            renditions['files'].append(path)
+            renditions[name][ext] = default_storage.url(path)
+
+    previous = Post.objects.filter(pk=post_id).values_list('renditions', flat=True).first()
+    # пост могли отредактировать, пока мы работали: пишем, только если картинка та же
+    updated = Post.objects.filter(pk=post_id, image=image_name).update(
+        renditions=renditions, updated=timezone.now()
+    )
+    if updated:
+        feed_cache.forget_posts(post_id)
+        delete_files(set(files(post_id, previous)) - set(renditions['files']))
+    else:
+        # картинку уже заменили или пост удалён - наши файлы никому не нужны
+        current = Post.objects.filter(pk=post_id).values_list('renditions', flat=True).first()
+        delete_files(set(renditions['files']) - set(files(post_id, current)))
+    return renditions
+
+
+def needs_build(post):
+    """Нужна ли посту новая нарезка; у убранной картинки сразу сбрасывает старую."""
+    if not post.image:
+        if post.renditions:
+            Post.objects.filter(pk=post.pk).update(renditions={})
+            feed_cache.forget_posts(post.pk)
+            forget(post)
+        return False
+    return post.renditions.get('source') != post.image.name
+
+
+def forget(post):
+    """Удаляет нарезки картинки поста после коммита: её убрали или удалили пост."""
+    paths = files(post.pk, post.renditions)
+    if paths:
+        transaction.on_commit(lambda: delete_files(paths))
@@ -0,0 +1,103 @@
+import json
+import platform
+import random
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный прогон на отдельной тестовой базе: наполняет её данными, "
+        "воспроизводит трафик и печатает p50/p95/p99, пропускную способность и число SQL-запросов"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--posts", type=int, default=2000)
+        parser.add_argument("--groups", type=int, default=10)
+        parser.add_argument("--follows", type=int, default=2000)
+        parser.add_argument("--comments", type=int, default=4000)
+        parser.add_argument("--requests", type=int, default=1000, help="сколько запросов сгенерировать")
+        parser.add_argument("--mix", default=",".join("%s=%s" % item for item in benchmark.DEFAULT_MIX.items()),
+                            help="веса точек входа, например index=30,post=20")
+        parser.add_argument("--replay", metavar="PATH",
+                            help="JSONL с запросами {method, path, user, data}; строки без path пропускаются")
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument("--warmup", type=int, default=0, help="первые N запросов не учитываются")
+        parser.add_argument("--server", action="store_true", help="гонять через WSGI-сервер, а не тестовый клиент")
+        parser.add_argument("--debug", action="store_true", help="не выключать DEBUG на время прогона")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", metavar="PATH", help="куда записать JSON-отчёт")
+        parser.add_argument("--baseline", metavar="PATH", help="JSON-отчёт прошлого прогона для сравнения")
+
+    def handle(self, *args, **options):
+        try:
+            mix = benchmark.parse_mix(options["mix"])
+        except ValueError as error:
+            raise CommandError(error)
+        rng = random.Random(options["seed"])
+
+        with benchmark.isolated(debug=options["debug"]):
+            report = self.bench(options, mix, rng)
+
+        if options["baseline"]:
+            with open(options["baseline"], encoding="utf-8") as baseline:
+                for line in benchmark.compare(report, json.load(baseline)):
+                    self.stdout.write(line)
+        output = json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as target:
+                target.write(output + "\n")
+            self.print_table(report)
+        else:
+            self.stdout.write(output)
+
+    def bench(self, options, mix, rng):
+        dataset = benchmark.seed(
+            users=options["users"], posts=options["posts"], groups=options["groups"],
+            follows=options["follows"], comments=options["comments"], rng=rng,
+        )
+        skipped = 0
+        if options["replay"]:
+            entries, skipped = benchmark.replay(options["replay"])
+            if not entries:
+                raise CommandError("В %s нет строк с path (пропущено %s)" % (options["replay"], skipped))
+        else:
+            entries = benchmark.synthetic(dataset, mix, options["requests"] + options["warmup"], rng)
+
+        if options["server"]:
+            with benchmark.Server() as server:
+                result = benchmark.run(entries, options["concurrency"], server.base_url, options["warmup"])
+        else:
+            result = benchmark.run(entries, options["concurrency"], warmup=options["warmup"])
+
+        result["meta"] = {
+            "dataset": dataset.counts(),
+            "mode": "server" if options["server"] else "client",
+            "source": options["replay"] or {"mix": mix, "seed": options["seed"]},
+            "skipped_lines": skipped,
+            "concurrency": options["concurrency"],
+            "warmup": options["warmup"],
+            "debug": settings.DEBUG,
+            "metrics": getattr(settings, "METRICS_ENABLED", False),
+            "database": connection.vendor,
+            "cache": settings.CACHES["default"]["BACKEND"],
+            "django": django.get_version(),
+            "python": platform.python_version(),
+        }
+        return result
+
+    def print_table(self, report):
+        row = "%-10s %8s %8s %9s %9s %9s %9s"
+        self.stdout.write(row % ("endpoint", "requests", "rps", "p50 ms", "p95 ms", "p99 ms", "queries"))
+        for name, stats in list(report["endpoints"].items()) + [("total", report["total"])]:
+            latency = stats["latency_ms"]
+            self.stdout.write(row % (name, stats["requests"], stats["throughput_rps"], latency["p50"],
+                                     latency["p95"], latency["p99"], stats["queries"]["mean"]))
+        if report["meta"]["skipped_lines"]:
+            self.stdout.write("Пропущено строк без path: %s" % report["meta"]["skipped_lines"])
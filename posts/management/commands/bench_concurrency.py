@@ -0,0 +1,92 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import benchmark
+
+MODES = {
+    # режим: (ASYNC_VIEWS, как гонять)
+    "wsgi": ("0", "wsgi"),
+    "asgi-sync": ("0", "asgi"),
+    "asgi": ("1", "asgi"),
+}
+READ_MIX = {"index": 30, "group": 15, "profile": 15, "post": 25, "follow": 15}
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает поведение лент под нагрузкой: WSGI с ограниченным числом воркеров, "
+        "ASGI с синхронными view и ASGI с асинхронными (posts.async_views)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=sorted(MODES) + ["all"], default="all")
+        parser.add_argument("--clients", default="1,8,32", help="уровни одновременных клиентов через запятую")
+        parser.add_argument("--requests", type=int, default=300, help="запросов на каждый уровень")
+        parser.add_argument("--workers", type=int, default=4, help="потоков WSGI-воркера")
+        parser.add_argument("--db-latency", type=float, default=2.0, help="задержка каждого SQL, мс")
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--posts", type=int, default=500)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", metavar="PATH", help="куда записать JSON-отчёт")
+
+    def handle(self, *args, **options):
+        levels = [int(level) for level in options["clients"].split(",") if level.strip()]
+        if options["mode"] == "all":
+            report = {mode: self.spawn(mode, options) for mode in MODES}
+        else:
+            async_views, _ = MODES[options["mode"]]
+            if settings.ASYNC_VIEWS != (async_views == "1"):
+                raise CommandError("Режим %s запускается с ASYNC_VIEWS=%s" % (options["mode"], async_views))
+            report = {options["mode"]: self.measure(options["mode"], levels, options)}
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as target:
+                json.dump(report, target, ensure_ascii=False, indent=2, sort_keys=True)
+        row = "%-10s %8s %9s %9s %9s %9s %7s"
+        self.stdout.write(row % ("mode", "clients", "rps", "p50 ms", "p95 ms", "p99 ms", "errors"))
+        for mode, results in report.items():
+            for level, result in results.items():
+                stats = result["total"]
+                self.stdout.write(row % (mode, level, stats["throughput_rps"], stats["latency_ms"]["p50"],
+                                         stats["latency_ms"]["p95"], stats["latency_ms"]["p99"], stats["errors"]))
+
+    def spawn(self, mode, options):
+        """Каждый режим - в своём процессе: от ASYNC_VIEWS зависит таблица адресов."""
+        async_views, _ = MODES[mode]
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as output:
+            path = output.name
+        try:
+            subprocess.run(
+                [sys.executable, sys.argv[0], "bench_concurrency", "--mode", mode, "--output", path,
+                 "--clients", options["clients"], "--requests", str(options["requests"]),
+                 "--workers", str(options["workers"]), "--db-latency", str(options["db_latency"]),
+                 "--users", str(options["users"]), "--posts", str(options["posts"]), "--seed", str(options["seed"])],
+                env=dict(os.environ, ASYNC_VIEWS=async_views), check=True, stdout=subprocess.DEVNULL,
+            )
+            with open(path, encoding="utf-8") as result:
+                return json.load(result)[mode]
+        finally:
+            os.unlink(path)
+
+    def measure(self, mode, levels, options):
+        _, runner = MODES[mode]
+        rng = random.Random(options["seed"])
+        results = {}
+        with benchmark.isolated():
+            dataset = benchmark.seed(users=options["users"], posts=options["posts"], groups=5,
+                                     follows=options["users"] * 10, comments=options["posts"], rng=rng)
+            with benchmark.db_latency(options["db_latency"] / 1000):
+                for level in levels:
+                    entries = list(benchmark.synthetic(dataset, READ_MIX, options["requests"], rng))
+                    if runner == "wsgi":
+                        results[str(level)] = benchmark.run(entries, level, warmup=level, workers=options["workers"])
+                    else:
+                        results[str(level)] = benchmark.run_asgi(entries, level, warmup=level)
+        return results
@@ -0,0 +1,96 @@
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from posts import benchmark
+from posts.models import Group, User
+
+ENGINES = ("db", "cached_db", "cache", "signed_cookies")
+AUTH_BACKENDS = {
+    "model": "django.contrib.auth.backends.ModelBackend",
+    "cached": "yatube.auth.CachedModelBackend",
+}
+VISITORS = ("anonymous", "logged-in")
+
+
+class Command(BaseCommand):
+    help = (
+        "Цена сессии и аутентификации на запрос: index и group_posts анонимом и залогиненным "
+        "для каждого хранилища сессий, с пользователем из базы и из кеша. Кеш лент прогрет, "
+        "поэтому разница между строками - это сессия и request.user"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--engines", default=",".join(ENGINES), help="SESSION_BACKEND через запятую")
+        parser.add_argument("--repeat", type=int, default=200, help="запросов на каждую точку")
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--posts", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", metavar="PATH", help="куда записать JSON-отчёт")
+
+    def handle(self, *args, **options):
+        engines = [engine for engine in options["engines"].split(",") if engine.strip()]
+        unknown = set(engines) - set(ENGINES)
+        if unknown:
+            raise CommandError("Неизвестные хранилища сессий: %s" % ", ".join(sorted(unknown)))
+        report = {}
+        with benchmark.isolated():
+            benchmark.seed(users=options["users"], posts=options["posts"], groups=3,
+                           follows=options["users"] * 5, comments=options["posts"],
+                           rng=random.Random(options["seed"]))
+            group = Group.objects.annotate(total=Count("post")).order_by("-total").first()
+            urls = {"index": reverse("index"), "group": reverse("group", args=(group.slug,))}
+            user = User.objects.order_by("id").first()
+            for engine in engines:
+                for backend in AUTH_BACKENDS:
+                    with override_settings(SESSION_ENGINE="django.contrib.sessions.backends." + engine,
+                                           AUTHENTICATION_BACKENDS=[AUTH_BACKENDS[backend]]):
+                        for visitor in VISITORS:
+                            client = self.client(user if visitor == "logged-in" else None)
+                            for name, url in urls.items():
+                                report.setdefault("%s/%s" % (engine, backend), {}).setdefault(visitor, {})[name] = \
+                                    self.measure(client, url, options["repeat"])
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as target:
+                json.dump(report, target, ensure_ascii=False, indent=2, sort_keys=True)
+        row = "%-26s %-10s" + " %10s %8s" * len(urls)
+        self.stdout.write(row % (("sessions/user", "visitor") + sum(((name, "queries") for name in urls), ())))
+        for mode, by_visitor in report.items():
+            for visitor, results in by_visitor.items():
+                self.stdout.write(row % ((mode, visitor) + sum(
+                    (("%.3f ms" % results[name]["ms_per_request"], results[name]["queries"]) for name in urls), ()
+                )))
+
+    def client(self, user):
+        # Client собирает цепочку middleware при первом запросе - уже с нужным SESSION_ENGINE
+        client = Client(REMOTE_ADDR=benchmark.REMOTE_ADDR)
+        if user is not None:
+            client.force_login(user)
+        return client
+
+    def measure(self, client, url, repeat):
+        # первый запрос прогревает ленту, сессию и пользователя в кеше
+        client.get(url)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            client.get(url)
+            timings.append(time.perf_counter() - started)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        return {
+            "status": response.status_code,
+            "ms_per_request": round(statistics.median(timings) * 1000, 3),
+            "queries": len(queries),
+            "session_queries": sum("django_session" in query["sql"] for query in queries.captured_queries),
+            "user_queries": sum('"auth_user"' in query["sql"] for query in queries.captured_queries),
+        }
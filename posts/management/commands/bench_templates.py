@@ -0,0 +1,127 @@
+import json
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.template.backends.django import DjangoTemplates
+from django.test import RequestFactory
+
+from posts import benchmark, cache as feed_cache
+from posts.models import Group, Post, TimelineEntry, User
+from posts.pagination import KeysetPage
+
+TEMPLATES = ("index.html", "group.html", "profile.html", "follow.html")
+LOADERS = {
+    # шаблон разбирается заново при каждой отрисовке, как при DEBUG
+    "plain": lambda loaders: loaders,
+    "cached": lambda loaders: [("django.template.loaders.cached.Loader", loaders)],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Время отрисовки лент (index, group, profile, follow) на странице из 10, 50 и 200 постов: "
+        "загрузчики без кеша и с cached.Loader, с пустым и заполненным кешем карточек. "
+        "Данные загружаются заранее, замеряется только шаблон"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10,50,200", help="постов на странице через запятую")
+        parser.add_argument("--repeat", type=int, default=20, help="отрисовок на каждую точку")
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--posts", type=int, default=3000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", metavar="PATH", help="куда записать JSON-отчёт")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options["sizes"].split(",") if size.strip()]
+        with benchmark.isolated():
+            benchmark.seed(users=options["users"], posts=options["posts"], groups=3,
+                           follows=options["users"] * 10, comments=options["posts"],
+                           rng=random.Random(options["seed"]))
+            request = self.request()
+            report = {}
+            for size in sizes:
+                contexts = self.contexts(request.user, size)
+                for loaders in LOADERS:
+                    backend = self.backend(loaders)
+                    for name in TEMPLATES:
+                        context = contexts[name]
+                        for fragments in ("cold", "warm"):
+                            timings = self.measure(backend, name, context, request, fragments, options["repeat"])
+                            median = statistics.median(timings)
+                            report.setdefault(name, {}).setdefault(str(size), {})["%s/%s" % (loaders, fragments)] = {
+                                "posts": len(context["page"]),
+                                "ms_per_page": round(median * 1000, 3),
+                                "us_per_post": round(median * 1e6 / max(len(context["page"]), 1), 1),
+                            }
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as target:
+                json.dump(report, target, ensure_ascii=False, indent=2, sort_keys=True)
+        modes = ["%s/%s" % (loaders, fragments) for loaders in LOADERS for fragments in ("cold", "warm")]
+        row = "%-13s %6s" + " %13s" * len(modes)
+        self.stdout.write(row % (("template", "posts") + tuple(modes)))
+        self.stdout.write("%21s" % "" + " %13s" * len(modes) % (("ms/page",) * len(modes)))
+        for name, by_size in report.items():
+            for size, results in by_size.items():
+                self.stdout.write(row % ((name, results[modes[0]]["posts"])
+                                         + tuple(results[mode]["ms_per_page"] for mode in modes)))
+
+    def request(self):
+        # читатель с самой длинной лентой подписок
+        viewer = User.objects.annotate(entries=Count("timeline")).order_by("-entries").first()
+        request = RequestFactory().get("/")
+        request.user = viewer
+        return request
+
+    def contexts(self, viewer, size):
+        author = User.objects.annotate(total=Count("posts")).order_by("-total").first()
+        group = Group.objects.annotate(total=Count("post")).order_by("-total").first()
+        newest = Post.objects.order_by("-pub_date", "-id").values_list("id", flat=True)
+
+        def page(ids):
+            # курсоры - чтобы отрисовался и паджинатор
+            return KeysetPage(feed_cache.get_posts(list(ids[:size])), None, "next", "previous")
+
+        timeline = TimelineEntry.objects.filter(user=viewer).order_by("-pub_date", "-post_id")
+        profile_page = page(newest.filter(author=author))
+        return {
+            "index.html": {"page": page(newest), "index": True},
+            "group.html": {"group": group, "page": page(newest.filter(group=group))},
+            "profile.html": {
+                "following": False, "name": "%s %s" % (author.first_name, author.last_name),
+                "username": author.username, "number_of_user_posts": author.profile.posts_count,
+                "page": profile_page, "last_post": profile_page[0], "profile": author.profile,
+            },
+            "follow.html": {"index": False, "follow_index": True,
+                            "page": page(timeline.values_list("post_id", flat=True))},
+        }
+
+    def backend(self, loaders):
+        config = settings.TEMPLATES[0]
+        return DjangoTemplates({
+            "NAME": "bench-%s" % loaders,
+            "DIRS": config["DIRS"],
+            "APP_DIRS": False,
+            "OPTIONS": {
+                "context_processors": config["OPTIONS"]["context_processors"],
+                "loaders": LOADERS[loaders](settings.TEMPLATE_LOADERS),
+            },
+        })
+
+    def measure(self, backend, name, context, request, fragments, repeat):
+        # первая отрисовка прогревает cached.Loader и, для warm, кеш карточек
+        backend.get_template(name).render(context, request)
+        timings = []
+        for _ in range(repeat):
+            if fragments == "cold":
+                cache.clear()
+            started = time.perf_counter()
+            backend.get_template(name).render(context, request)
+            timings.append(time.perf_counter() - started)
+        return timings
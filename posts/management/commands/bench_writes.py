@@ -0,0 +1,95 @@
+import json
+import random
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings
+
+from posts import benchmark
+from posts.models import Comment
+
+MODES = {
+    # режим: (OPTIONS соединения, COMMENT_BATCH_WAIT_MS)
+    "stock": ({"timeout": 5, "journal_mode": "delete", "synchronous": "full", "immediate_transactions": False}, 0),
+    "wal": ({"timeout": 20, "journal_mode": "wal", "synchronous": "normal", "immediate_transactions": True}, 0),
+    "wal+batch": ({"timeout": 20, "journal_mode": "wal", "synchronous": "normal", "immediate_transactions": True},
+                  None),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Комментарии из многих потоков сразу: устойчивые записи в секунду, задержки и доля ошибок "
+        "(database is locked) для SQLite как из коробки, с WAL и BEGIN IMMEDIATE и с пачками комментариев"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=sorted(MODES) + ["all"], default="all")
+        parser.add_argument("--threads", default="1,8,32", help="уровни одновременных писателей через запятую")
+        parser.add_argument("--requests", type=int, default=400, help="комментариев на каждый уровень")
+        parser.add_argument("--batch-wait", type=int, default=5, help="COMMENT_BATCH_WAIT_MS для wal+batch")
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--posts", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", metavar="PATH", help="куда записать JSON-отчёт")
+
+    def handle(self, *args, **options):
+        if connection.settings_dict["ENGINE"] != "yatube.sqlite3":
+            raise CommandError("Прогон рассчитан на DB_ENGINE=yatube.sqlite3")
+        levels = [int(level) for level in options["threads"].split(",") if level.strip()]
+        modes = list(MODES) if options["mode"] == "all" else [options["mode"]]
+        rng = random.Random(options["seed"])
+        report = {}
+        with benchmark.isolated():
+            dataset = benchmark.seed(users=options["users"], posts=options["posts"], groups=5,
+                                     follows=options["users"] * 5, comments=0, rng=rng)
+            for mode in modes:
+                db_options, batch_wait = MODES[mode]
+                batch_wait = options["batch_wait"] if batch_wait is None else batch_wait
+                with self.database(db_options), override_settings(COMMENT_BATCH_WAIT_MS=batch_wait):
+                    for level in levels:
+                        report.setdefault(mode, {})[str(level)] = self.measure(dataset, level, options, rng)
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as target:
+                json.dump(report, target, ensure_ascii=False, indent=2, sort_keys=True)
+        row = "%-10s %8s %10s %9s %9s %9s %7s %8s"
+        self.stdout.write(row % ("mode", "threads", "writes/s", "p50 ms", "p95 ms", "p99 ms", "errors", "error %"))
+        for mode, results in report.items():
+            for level, result in results.items():
+                stats = result["total"]
+                self.stdout.write(row % (
+                    mode, level, result["writes_per_second"], stats["latency_ms"]["p50"], stats["latency_ms"]["p95"],
+                    stats["latency_ms"]["p99"], stats["errors"], result["error_rate"],
+                ))
+
+    @contextmanager
+    def database(self, db_options):
+        """Соединения всех потоков открываются заново с db_options: словарь настроек у них общий."""
+        settings_dict = connection.settings_dict
+        previous = settings_dict["OPTIONS"]
+        connections.close_all()
+        settings_dict["OPTIONS"] = dict(previous, **db_options)
+        try:
+            yield
+        finally:
+            connections.close_all()
+            settings_dict["OPTIONS"] = previous
+
+    def measure(self, dataset, level, options, rng):
+        entries = list(benchmark.synthetic(dataset, {"comment": 1}, options["requests"] + level, rng))
+        before = Comment.objects.count()
+        # прогрев: сессии пользователей и первые соединения потоков
+        result = benchmark.run(entries, level, warmup=level)
+        stats = result["total"]
+        # успешный комментарий - редирект на пост
+        written = stats["statuses"].get("302", 0)
+        elapsed = stats["requests"] / stats["throughput_rps"] if stats["throughput_rps"] else 0
+        result.update(
+            written=written,
+            stored=Comment.objects.count() - before,
+            writes_per_second=round(written / elapsed, 2) if elapsed else None,
+            error_rate=round(100 * stats["errors"] / stats["requests"], 2) if stats["requests"] else None,
+        )
+        return result
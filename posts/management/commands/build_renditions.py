@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from posts import images
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = "Синхронно готовит нарезки картинок для постов, у которых их ещё нет"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="пересобрать и уже готовые")
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').exclude(image__isnull=True).only('id', 'image', 'renditions')
+        done = 0
+        for post in posts.iterator():
+            if options["all"] or post.renditions.get('source') != post.image.name:
+                images.build(post.pk, post.image.name)
+                done += 1
+        self.stdout.write(self.style.SUCCESS("Готово картинок: %s" % done))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from posts import bulk
+from posts.models import Comment, Group, Post
+
+# поля в файле и соответствующие им пути values_list()
+KINDS = {
+    "groups": (Group, [("slug", "slug"), ("title", "title"), ("description", "description")]),
+    "posts": (Post, [("id", "id"), ("author", "author__username"), ("group", "group__slug"), ("text", "text"),
+                     ("pub_date", "pub_date"), ("updated", "updated"), ("image", "image")]),
+    "comments": (Comment, [("id", "id"), ("post", "post_id"), ("author", "author__username"), ("text", "text"),
+                           ("created", "created")]),
+}
+
+
+class Command(BaseCommand):
+    help = "Потоково выгружает группы, посты или комментарии в JSONL или CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(KINDS))
+        parser.add_argument("--output", "-o", default="-", help="файл, по умолчанию stdout")
+        parser.add_argument("--format", choices=bulk.FORMATS, help="по умолчанию по расширению, иначе jsonl")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        model, columns = KINDS[options["kind"]]
+        fields = [name for name, _ in columns]
+        rows = model.objects.order_by("pk").values_list(*(path for _, path in columns)) \
+            .iterator(chunk_size=options["chunk_size"])
+        with bulk.open_stream(options["output"], "w", self.stdout) as stream:
+            count = bulk.write_rows(stream, bulk.detect_format(options["output"], options["format"]), fields, rows)
+        self.stderr.write("Выгружено строк: %s" % count)
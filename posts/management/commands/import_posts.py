@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand
+
+from posts import bulk
+from posts.models import Comment, Group, Post
+
+
+class Command(BaseCommand):
+    help = (
+        "Потоково загружает группы, посты или комментарии из JSONL или CSV большими пачками, "
+        "сохраняя id и даты, затем пересчитывает счётчики, поиск и ленты"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=["comments", "groups", "posts"])
+        parser.add_argument("path", help="файл или - для stdin")
+        parser.add_argument("--format", choices=bulk.FORMATS, help="по умолчанию по расширению, иначе jsonl")
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument("--create-users", action="store_true", help="создать недостающих авторов")
+        parser.add_argument("--no-rebuild", action="store_true",
+                            help="не пересчитывать производные данные (потом reconcile_counters и т.д.)")
+
+    def handle(self, *args, **options):
+        self.errors = 0
+        self.keys = bulk.NaturalKeys(create_users=options["create_users"])
+        self.namespaces, self.posts = set(), set()
+        fmt = bulk.detect_format(options["path"], options["format"])
+        # у групп естественный ключ - уникальный slug, его проверяет сама база
+        model, build, prepare, natural_key = {
+            "groups": (Group, self.build_group, None, None),
+            "posts": (Post, self.build_post, self.prepare, ("author_id", "pub_date", "text")),
+            "comments": (Comment, self.build_comment, self.prepare_comments,
+                         ("post_id", "author_id", "created", "text")),
+        }[options["kind"]]
+
+        with bulk.open_stream(options["path"], "r") as stream:
+            loaded, skipped = bulk.load(bulk.read_rows(stream, fmt), build, model, options["batch_size"],
+                                        self.report, prepare, natural_key)
+        bulk.reset_sequences(model)
+        if not options["no_rebuild"]:
+            bulk.finish_import(
+                self.namespaces, self.posts,
+                rebuild_search=model is Post, rebuild_timelines=model is Post,
+            )
+        self.stdout.write(self.style.SUCCESS(
+            "Обработано строк: %s (уже существующие пропущены), с ошибками: %s" % (loaded, skipped)
+        ))
+
+    def report(self, row, error):
+        self.errors += 1
+        if self.errors <= 20:
+            self.stderr.write("Пропущена строка %s: %s" % (row, error))
+
+    def prepare(self, chunk):
+        self.keys.ensure_users(row.get("author") for row in chunk)
+
+    def prepare_comments(self, chunk):
+        self.prepare(chunk)
+        ids = set()
+        for row in chunk:
+            try:
+                ids.add(bulk.parse_id(row.get("post")))
+            except bulk.BadRow:
+                pass
+        self.existing_posts = set(Post.objects.filter(pk__in=ids - {None}).values_list("pk", flat=True))
+
+    def build_group(self, row):
+        if not row.get("slug"):
+            raise bulk.BadRow("пустой slug")
+        return {"slug": row["slug"], "title": row.get("title") or "-пусто-", "description": row.get("description") or ""}
+
+    def build_post(self, row):
+        author_id = self.keys.user(row.get("author"))
+        group_id = self.keys.group(row.get("group"))
+        pub_date = bulk.parse_date(row.get("pub_date"))
+        self.namespaces.update(("index", "author:%s" % author_id))
+        if group_id:
+            self.namespaces.add("group:%s" % group_id)
+        return {
+            "id": bulk.parse_id(row.get("id")), "author_id": author_id, "group_id": group_id, "text": row["text"],
+            "pub_date": pub_date, "updated": bulk.parse_date(row["updated"]) if row.get("updated") else pub_date,
+            "image": row.get("image") or "",
+        }
+
+    def build_comment(self, row):
+        post_id = bulk.parse_id(row.get("post"))
+        if post_id not in self.existing_posts:
+            raise bulk.BadRow("нет поста %r" % row.get("post"))
+        self.namespaces.add("comments:%s" % post_id)
+        self.posts.add(post_id)
+        return {
+            "id": bulk.parse_id(row.get("id")), "post_id": post_id, "author_id": self.keys.user(row.get("author")),
+            "text": row.get("text") or "", "created": bulk.parse_date(row.get("created")),
+        }
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = "Перестраивает полнотекстовый индекс постов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            search.get_backend().rebuild(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS("Поисковый индекс перестроен"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import trending
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает часовые корзины популярного за последние 7 дней по постам и комментариям"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prune", action="store_true", help="только удалить устаревшие корзины")
+
+    def handle(self, *args, **options):
+        if options["prune"]:
+            deleted = trending.prune()
+            self.stdout.write(self.style.SUCCESS("Удалено корзин: %s" % deleted))
+            return
+        with transaction.atomic():
+            trending.rebuild()
+        self.stdout.write(self.style.SUCCESS("Популярное пересчитано"))
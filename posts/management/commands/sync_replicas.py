@@ -0,0 +1,41 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = ("Копирует основную базу SQLite в файлы-реплики из DB_REPLICAS: локальная замена "
+            "настоящей репликации. --lag повторяет копирование каждые N секунд")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lag", type=float, default=0,
+                            help="копировать в цикле раз в столько секунд, имитируя отставание реплик")
+
+    def handle(self, *args, **options):
+        if not settings.DB_REPLICAS:
+            raise CommandError("Реплики не настроены: задайте DB_REPLICAS")
+        if connections["default"].vendor != "sqlite":
+            raise CommandError("Для %s реплики наполняет сама СУБД" % connections["default"].vendor)
+        self.sync()
+        if options["lag"] > 0:
+            while True:
+                time.sleep(options["lag"])
+                self.sync()
+
+    def sync(self):
+        source = sqlite3.connect(connections["default"].settings_dict["NAME"])
+        try:
+            for alias in settings.DB_REPLICAS:
+                # backup() копирует согласованный снимок даже при идущей записи
+                target = sqlite3.connect(connections[alias].settings_dict["NAME"])
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                connections[alias].close()
+                self.stderr.write("%s <- default" % alias)
+        finally:
+            source.close()
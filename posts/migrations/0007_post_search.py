@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        from posts.search import stem_text
+        Post = apps.get_model('posts', 'Post')
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE posts_search USING fts5(body, tokenize='unicode61 remove_diacritics 2')"
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO posts_search (rowid, body) VALUES (%s, %s)',
+                [(post_id, stem_text(text)) for post_id, text in Post.objects.values_list('pk', 'text').iterator()],
+            )
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX posts_post_text_search ON posts_post USING GIN (to_tsvector('russian', text))"
+        )
+
+
+def drop_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS posts_search')
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS posts_post_text_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_post_updated'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -13,19 +13,93 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        # всё, что нужно post_item.html, одним запросом на страницу
+        return self.select_related('author', 'group')
+
+
 class Post(models.Model):
     text = models.TextField(default='-пусто-', verbose_name='Текст поста', help_text='Введите текст')
-    pub_date = models.DateTimeField("date published", auto_now_add=True, db_index=True)
-    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="posts")
-    group = models.ForeignKey(Group, on_delete=models.CASCADE, blank=True, null=True,
+    pub_date = models.DateTimeField("date published", auto_now_add=True)
+    updated = models.DateTimeField("date updated", auto_now=True)
+    # отдельные индексы по FK не нужны: их покрывают составные индексы ниже
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="posts", db_index=False)
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, blank=True, null=True, db_index=False,
                               verbose_name='Группа', help_text='Выберите группу для поста(необязательно)')
     image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    # адреса готовых нарезок картинки, заполняет posts.images
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        # ленты: вся, группы, автора - всегда по (-pub_date, -id)
+        indexes = [
+            models.Index(fields=["-pub_date", "-id"], name="post_pub_date"),
+            models.Index(fields=["group", "-pub_date", "-id"], name="post_group_pub_date"),
+            models.Index(fields=["author", "-pub_date", "-id"], name="post_author_pub_date"),
+        ]
 
     def __str__(self):
         return self.text
 
 class Comment(models.Model):
-    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="comments")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="comments", db_index=False)
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="comments")
     text = models.TextField(default='', verbose_name='Текст поста', help_text='Введите текст')
-    created = models.DateTimeField("date published", auto_now_add=True)
\ No newline at end of file
+    created = models.DateTimeField("date published", auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["post", "created", "id"], name="comment_post_created_id"),
+        ]
+
+
+class TimelineEntry(models.Model):
+    # материализованная лента подписок: строка на (подписчик, пост)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="timeline", db_index=False)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="timeline_entries")
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "post"], name="unique_timeline_entry"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-pub_date", "-post"], name="timeline_user_pub_date"),
+            models.Index(fields=["user", "author"], name="timeline_user_author"),
+        ]
+
+
+class GroupActivity(models.Model):
+    # посты и комментарии группы за час, начиная с bucket (posts.trending)
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name="activity", db_index=False)
+    bucket = models.DateTimeField()
+    posts = models.PositiveIntegerField(default=0)
+    comments = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["group", "bucket"], name="unique_group_activity"),
+        ]
+        indexes = [
+            models.Index(fields=["bucket", "group"], name="group_activity_bucket"),
+        ]
+
+
+class PostActivity(models.Model):
+    # комментарии к посту за час, начиная с bucket
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="activity", db_index=False)
+    bucket = models.DateTimeField()
+    comments = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["post", "bucket"], name="unique_post_activity"),
+        ]
+        indexes = [
+            models.Index(fields=["bucket", "post"], name="post_activity_bucket"),
+        ]
@@ -0,0 +1,167 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values, backwards=False):
+    raw = json.dumps({"v": values, "b": backwards}, default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return list(data["v"]), bool(data["b"])
+    except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError):
+        raise InvalidCursor(cursor)
+
+
+class KeysetPage:
+    """Страница ленты без номера: только соседние курсоры, без COUNT(*)."""
+
+    is_keyset = True
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return "<KeysetPage of %s items>" % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Курсорная пагинация по упорядоченному набору полей, по умолчанию
+    (pub_date, id). Каждая страница - один запрос по индексу с LIMIT
+    per_page + 1, поэтому тысячная страница стоит столько же, сколько первая.
+    Все поля ordering должны сортироваться в одну сторону.
+    """
+
+    def __init__(self, object_list, per_page, ordering=("-pub_date", "-id")):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = tuple(name.lstrip("-") for name in self.ordering)
+        self.descending = self.ordering[0].startswith("-")
+
+    def key(self, obj):
+        return tuple(getattr(obj, name) for name in self.fields)
+
+    def _to_python(self, values):
+        if len(values) != len(self.fields):
+            raise InvalidCursor(values)
+        opts = self.object_list.model._meta
+        try:
+            return tuple(
+                opts.get_field(name).to_python(value)
+                for name, value in zip(self.fields, values)
+            )
+        except (FieldDoesNotExist, ValidationError):
+            raise InvalidCursor(values)
+
+    def _beyond(self, values, backwards):
+        # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y)
+        lookup = "lt" if self.descending != backwards else "gt"
+        condition = Q()
+        for i, name in enumerate(self.fields):
+            term = Q(**{"%s__%s" % (name, lookup): values[i]})
+            for prev_name, prev_value in zip(self.fields[:i], values[:i]):
+                term &= Q(**{prev_name: prev_value})
+            condition |= term
+        return condition
+
+    def fetch(self, values, backwards, limit):
+        queryset = self.object_list
+        if values is not None:
+            queryset = queryset.filter(self._beyond(values, backwards))
+        ordering = self.ordering
+        if backwards:
+            ordering = tuple(
+                name[1:] if name.startswith("-") else "-" + name
+                for name in ordering
+            )
+        return list(queryset.order_by(*ordering)[:limit])
+
+    def get_page(self, cursor=None):
+        values, backwards = None, False
+        if cursor:
+            try:
+                raw_values, backwards = decode_cursor(cursor)
+                values = self._to_python(raw_values)
+            except InvalidCursor:
+                values, backwards = None, False
+
+        rows = self.fetch(values, backwards, self.per_page + 1)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            if not rows:
+                # курсор раньше первой записи - отдаём начало ленты
+                return self.get_page()
+            rows.reverse()
+            has_previous, has_next = has_more, True
+        else:
+            has_previous, has_next = values is not None and bool(rows), has_more
+
+        next_cursor = previous_cursor = None
+        if has_next and rows:
+            next_cursor = encode_cursor(list(self.key(rows[-1])))
+        if has_previous:
+            previous_cursor = encode_cursor(list(self.key(rows[0])), backwards=True)
+        return KeysetPage(rows, self, next_cursor, previous_cursor)
+
+
+class MergedKeysetPaginator(KeysetPaginator):
+    """
+    Слияние нескольких курсорных источников с одинаковым порядком ключей.
+    Каждый источник читается своим индексом, строки с одинаковым ключом
+    схлопываются.
+    """
+
+    def __init__(self, paginators, per_page):
+        first = paginators[0]
+        super().__init__(first.object_list, per_page, first.ordering)
+        self.paginators = paginators
+
+    def key(self, obj):
+        return obj.keyset_key
+
+    def _to_python(self, values):
+        return self.paginators[0]._to_python(values)
+
+    def fetch(self, values, backwards, limit):
+        merged = {}
+        for paginator in self.paginators:
+            for row in paginator.fetch(values, backwards, limit):
+                row.keyset_key = paginator.key(row)
+                merged.setdefault(row.keyset_key, row)
+        keys = sorted(merged, reverse=self.descending != backwards)[:limit]
+        return [merged[key] for key in keys]
@@ -0,0 +1,236 @@
+"""
+Полнотекстовый поиск по постам.
+
+По умолчанию индекс - виртуальная таблица SQLite FTS5 posts_search, в
+которой под rowid = id поста лежит текст, уже приведённый к основам слов
+(русская и английская морфология). На PostgreSQL используется
+to_tsvector('russian', text) с GIN-индексом; запрос строит ровно это
+выражение, а не SearchVector (тот оборачивает поле в COALESCE, и индекс
+не подходит). Бэкенд задаётся настройкой POSTS_SEARCH_BACKEND, иначе
+выбирается по движку базы. Индекс обновляется сигналами на сохранение и
+удаление поста.
+"""
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models import F, Func, Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Post
+from .pagination import InvalidCursor, KeysetPaginator
+
+try:
+    import snowballstemmer
+except ImportError:  # pragma: no cover
+    snowballstemmer = None
+
+Hit = namedtuple('Hit', 'id score')
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+_CYRILLIC = re.compile('[а-я]')
+_VOWELS = set('аеиоуыэюя')
+# окончания, которые срезает упрощённый стеммер, если нет snowballstemmer
+_RU_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'иях', 'ях', 'ах', 'ией',
+    'ешь', 'ишь', 'ете', 'ите', 'ила', 'ыла', 'ено', 'ает', 'яет', 'ают', 'яют', 'ует', 'уют',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю', 'ом', 'ем', 'ов', 'ев',
+    'ам', 'ям', 'ть', 'ла', 'ло', 'ли', 'ет', 'ют', 'ут', 'ит', 'ат', 'ят', 'им', 'ым', 'ию', 'ия',
+    'ии', 'ью', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+_EN_ENDINGS = ('ing', 'ed', 'es', 's')
+
+
+def _light_stem(word):
+    if _CYRILLIC.search(word):
+        # основу не укорачиваем до первой гласной включительно
+        first_vowel = next((i for i, char in enumerate(word) if char in _VOWELS), len(word))
+        for ending in _RU_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) > first_vowel:
+                return word[:-len(ending)]
+        return word
+    for ending in _EN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+if snowballstemmer is not None:
+    _ru = snowballstemmer.stemmer('russian')
+    _en = snowballstemmer.stemmer('english')
+
+    def stem(word):
+        return (_ru if _CYRILLIC.search(word) else _en).stemWord(word)
+else:
+    stem = _light_stem
+
+
+def tokens(text):
+    return [stem(word) for word in _WORD.findall(text.lower().replace('ё', 'е'))]
+
+
+def stem_text(text):
+    return ' '.join(tokens(text))
+
+
+class SearchPaginator(KeysetPaginator):
+    """Курсор по (score, id): чем меньше score, тем релевантнее."""
+
+    def __init__(self, backend, query, per_page, group=None, author=None):
+        self.backend = backend
+        self.query = query
+        self.group = group
+        self.author = author
+        self.per_page = int(per_page)
+        self.ordering = ('score', 'id')
+        self.fields = ('score', 'id')
+        self.descending = False
+
+    def _to_python(self, values):
+        try:
+            score, post_id = values
+            return float(score), int(post_id)
+        except (TypeError, ValueError):
+            raise InvalidCursor(values)
+
+    def fetch(self, values, backwards, limit):
+        return self.backend.fetch(self.query, values, backwards, limit, group=self.group, author=self.author)
+
+
+class SqliteBackend:
+    table = 'posts_search'
+
+    def match_expression(self, query):
+        terms = tokens(query)
+        if not terms:
+            return None
+        return ' '.join('"%s"*' % term.replace('"', '') for term in terms)
+
+    def index(self, post):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE rowid = %%s' % self.table, [post.pk])
+            cursor.execute('INSERT INTO %s (rowid, body) VALUES (%%s, %%s)' % self.table,
+                           [post.pk, stem_text(post.text)])
+
+    def remove(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE rowid = %%s' % self.table, [post_id])
+
+    def rebuild(self, batch_size=1000):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % self.table)
+            rows = Post.objects.order_by().values_list('pk', 'text').iterator(chunk_size=batch_size)
+            batch = []
+            for post_id, text in rows:
+                batch.append((post_id, stem_text(text)))
+                if len(batch) >= batch_size:
+                    cursor.executemany('INSERT INTO %s (rowid, body) VALUES (%%s, %%s)' % self.table, batch)
+                    batch = []
+            if batch:
+                cursor.executemany('INSERT INTO %s (rowid, body) VALUES (%%s, %%s)' % self.table, batch)
+
+    def filter(self, queryset, query):
+        match = self.match_expression(query)
+        if match is None:
+            return queryset.none()
+        return queryset.filter(pk__in=RawSQL(
+            'SELECT rowid FROM %s WHERE %s MATCH %%s' % (self.table, self.table), [match]
+        ))
+
+    def fetch(self, query, values, backwards, limit, group=None, author=None):
+        match = self.match_expression(query)
+        if match is None:
+            return []
+        score = 'bm25(%s)' % self.table
+        sql = [
+            'SELECT s.rowid, %s FROM %s s JOIN posts_post p ON p.id = s.rowid' % (score, self.table),
+            'WHERE %s MATCH %%s' % self.table,
+        ]
+        params = [match]
+        if group is not None:
+            sql.append('AND p.group_id = %s')
+            params.append(group.pk)
+        if author is not None:
+            sql.append('AND p.author_id = %s')
+            params.append(author.pk)
+        op, direction = ('<', 'DESC') if backwards else ('>', 'ASC')
+        if values is not None:
+            sql.append('AND (%s %s %%s OR (%s = %%s AND s.rowid %s %%s))' % (score, op, score, op))
+            params += [values[0], values[0], values[1]]
+        sql.append('ORDER BY 2 %s, 1 %s LIMIT %%s' % (direction, direction))
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(' '.join(sql), params)
+            return [Hit(post_id, score) for post_id, score in cursor.fetchall()]
+
+
+class PostgresBackend:
+    config = 'russian'
+
+    def _vector(self):
+        from django.contrib.postgres.search import SearchVectorField
+        # то же выражение, что в GIN-индексе миграции 0007, иначе он не используется
+        return Func(F('text'), function='to_tsvector', config=self.config,
+                    template="%(function)s('%(config)s'::regconfig, %(expressions)s)",
+                    output_field=SearchVectorField())
+
+    def _query(self, query):
+        from django.contrib.postgres.search import SearchQuery
+        return SearchQuery(query, config=self.config, search_type='plain')
+
+    def index(self, post):
+        # индекс - выражение над posts_post.text, его обновляет сама база
+        pass
+
+    def remove(self, post_id):
+        pass
+
+    def rebuild(self, batch_size=1000):
+        pass
+
+    def filter(self, queryset, query):
+        return queryset.annotate(search=self._vector()).filter(search=self._query(query))
+
+    def fetch(self, query, values, backwards, limit, group=None, author=None):
+        from django.contrib.postgres.search import SearchRank
+        queryset = self.filter(Post.objects.order_by(), query) \
+            .annotate(score=-SearchRank(F('search'), self._query(query)))
+        if group is not None:
+            queryset = queryset.filter(group=group)
+        if author is not None:
+            queryset = queryset.filter(author=author)
+        if values is not None:
+            if backwards:
+                queryset = queryset.filter(Q(score__lt=values[0]) | Q(score=values[0], id__lt=values[1]))
+            else:
+                queryset = queryset.filter(Q(score__gt=values[0]) | Q(score=values[0], id__gt=values[1]))
+        ordering = ('-score', '-id') if backwards else ('score', 'id')
+        return [Hit(post_id, score) for post_id, score in
+                queryset.order_by(*ordering).values_list('id', 'score')[:limit]]
+
+
+BACKENDS = {
+    'postgresql': 'posts.search.PostgresBackend',
+    'sqlite': 'posts.search.SqliteBackend',
+}
+
+
+def get_backend():
+    path = getattr(settings, 'POSTS_SEARCH_BACKEND', None)
+    if path is None:
+        path = BACKENDS.get(connection.vendor)
+        if path is None:
+            raise ImproperlyConfigured(
+                'Поиск по постам не умеет работать с базой %s, задайте POSTS_SEARCH_BACKEND' % connection.vendor
+            )
+    return import_string(path)()
+
+
+def search_page(query, cursor=None, per_page=10, group=None, author=None):
+    """Страница результатов; в object_list - id постов по убыванию релевантности."""
+    page = SearchPaginator(get_backend(), query, per_page, group=group, author=author).get_page(cursor)
+    page.object_list = [hit.id for hit in page]
+    return page
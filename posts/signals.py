@@ -0,0 +1,110 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from users import graph
+from users.models import Follow, Profile
+from yatube import auth
+from . import cache as feed_cache, counters, images, search, tasks, trending
+from .models import Comment, Post
+
+User = get_user_model()
+
+
+def post_feeds(post):
+    namespaces = ['index', 'author:%s' % post.author_id]
+    if post.group_id:
+        namespaces.append('group:%s' % post.group_id)
+    return namespaces
+
+
+def prune_after(bucket):
+    # первая запись нового часа: самые старые корзины больше не нужны ни одному окну
+    if bucket is not None:
+        tasks.prune_activity.enqueue(key='prune-activity:%s' % bucket.isoformat())
+
+
+@receiver(pre_save, sender=Post)
+def post_changing(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._stored_group_id = Post.objects.filter(pk=instance.pk).values_list('group_id', flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    feed_cache.forget_posts(instance.pk)
+    search.get_backend().index(instance)
+    if images.needs_build(instance):
+        # у каждой загрузки своё имя файла - и своя задача
+        tasks.build_renditions.enqueue(instance.pk, instance.image.name,
+                                       key='image:%s:%s' % (instance.pk, instance.image.name))
+    if created:
+        counters.post_added(instance)
+        prune_after(trending.post_added(instance))
+        feed_cache.bump(*post_feeds(instance))
+        # у автора могут быть тысячи подписчиков - разносит воркер
+        tasks.fan_out.enqueue(instance.pk, key='fan-out:%s' % instance.pk)
+        return
+    stored_group_id = getattr(instance, '_stored_group_id', instance.group_id)
+    if stored_group_id != instance.group_id:
+        prune_after(trending.post_moved(instance, stored_group_id))
+        feed_cache.bump(*('group:%s' % group_id for group_id in (stored_group_id, instance.group_id) if group_id))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.post_added(instance, -1)
+    trending.post_added(instance, -1)
+    feed_cache.forget_posts(instance.pk)
+    search.get_backend().remove(instance.pk)
+    images.forget(instance)
+    followers = graph.follower_ids(instance.author_id)
+    feed_cache.bump(*post_feeds(instance), *('follow:%s' % user_id for user_id in followers))
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.comment_added(instance)
+        prune_after(trending.comment_added(instance))
+        feed_cache.forget_posts(instance.post_id)
+        feed_cache.bump('comments:%s' % instance.post_id)
+        tasks.notify_comment.enqueue(instance.pk, key='comment-email:%s' % instance.pk)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.comment_added(instance, -1)
+    trending.comment_added(instance, -1)
+    feed_cache.forget_posts(instance.post_id)
+    feed_cache.bump('comments:%s' % instance.post_id)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.follow_added(instance)
+        feed_cache.bump(*graph.namespaces(instance))
+        tasks.notify_follow.enqueue(instance.user_id, instance.author_id,
+                                   key='follow-email:%s:%s' % (instance.user_id, instance.author_id))
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.follow_added(instance, -1)
+    feed_cache.bump(*graph.namespaces(instance))
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, raw=False, **kwargs):
+    # вход, смена пароля, блокировка: закешированный пользователь сессии устарел
+    auth.forget_user(instance.pk)
+    if created and not raw:
+        Profile.objects.get_or_create(user=instance)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    auth.forget_user(instance.pk)
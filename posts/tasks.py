@@ -0,0 +1,73 @@
+"""
+Фоновая работа после записи: разнос постов по лентам, наполнение ленты
+после подписки, нарезка картинок, письма авторам и чистка устаревших
+корзин популярного.
+Все задачи принимают id и переживают повторный запуск.
+"""
+from django.core.mail import send_mail
+from django.urls import reverse
+
+from tasks.queue import task
+from users.models import Follow
+from . import images, timeline, trending
+from .models import Comment, Post, User
+
+
+@task()
+def fan_out(post_id):
+    post = Post.objects.filter(pk=post_id).only('id', 'author_id', 'pub_date').first()
+    if post is not None:
+        timeline.fan_out(post)
+
+
+@task()
+def backfill(user_id, author_id):
+    # пока задача ждала, могли и отписаться
+    if Follow.objects.filter(user_id=user_id, author_id=author_id).exists():
+        timeline.backfill(User(pk=user_id), User(pk=author_id))
+
+
+@task()
+def refan(author_id):
+    timeline.refan(author_id)
+
+
+@task(max_attempts=3, retry_delay=30)
+def build_renditions(post_id, image_name):
+    # картинку могли заменить, а пост удалить, пока задача ждала
+    if Post.objects.filter(pk=post_id, image=image_name).exists():
+        images.build(post_id, image_name)
+
+
+@task()
+def prune_activity():
+    trending.prune()
+
+
+@task(max_attempts=3, retry_delay=60)
+def notify_comment(comment_id):
+    comment = Comment.objects.select_related('author', 'post__author').filter(pk=comment_id).first()
+    if comment is None or comment.author_id == comment.post.author_id or not comment.post.author.email:
+        return
+    post = comment.post
+    send_mail(
+        'Новый комментарий к вашему посту',
+        '%s пишет:\n\n%s\n\n%s' % (comment.author.username, comment.text,
+                                   reverse('post', args=(post.author.username, post.id))),
+        None,
+        [post.author.email],
+    )
+
+
+@task(max_attempts=3, retry_delay=60)
+def notify_follow(user_id, author_id):
+    users = User.objects.in_bulk([user_id, author_id])
+    if len(users) < 2 or not users[author_id].email:
+        return
+    follower = users[user_id]
+    send_mail(
+        'У вас новый подписчик',
+        'На вас подписался %s: %s' % (follower.username, reverse('profile', args=(follower.username,))),
+        None,
+        [users[author_id].email],
+    )
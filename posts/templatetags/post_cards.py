@@ -0,0 +1,67 @@
+"""
+Кеш карточек постов для лент.
+
+{% prefetch_cards page %} перед циклом достаёт готовые карточки всей
+страницы одним get_many, а {% card_cache post %} ... {% endcard_cache %} в
+post_item.html берёт карточку оттуда и ходит в кеш сам, только если
+предзагрузки не было. Ключи те же, что у {% cache 86400 post_card ... %}:
+id, время правки и число комментариев.
+"""
+from django import template
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.utils import make_template_fragment_key
+
+register = template.Library()
+
+CARD_TIMEOUT = 60 * 60 * 24
+_PREFETCHED = '_prefetched_cards'
+
+
+def _cache():
+    # как у {% cache %}: отдельный кеш для фрагментов, если он настроен
+    try:
+        return caches['template_fragments']
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def card_key(post):
+    return make_template_fragment_key('post_card', [post.id, post.updated.isoformat(), post.comments_count])
+
+
+@register.simple_tag(takes_context=True)
+def prefetch_cards(context, posts):
+    keys = {post.id: card_key(post) for post in posts or ()}
+    found = _cache().get_many(keys.values()) if keys else {}
+    # по id поста: ключ второй раз не считается, промах второй раз не ищется
+    context[_PREFETCHED] = {post_id: (key, found.get(key)) for post_id, key in keys.items()}
+    return ''
+
+
+class CardCacheNode(template.Node):
+    def __init__(self, nodelist, post):
+        self.nodelist = nodelist
+        self.post = post
+
+    def render(self, context):
+        post = self.post.resolve(context)
+        prefetched = (context.get(_PREFETCHED) or {}).get(post.id)
+        if prefetched is not None:
+            key, value = prefetched
+        else:
+            key = card_key(post)
+            value = _cache().get(key)
+        if value is None:
+            value = self.nodelist.render(context)
+            _cache().set(key, value, CARD_TIMEOUT)
+        return value
+
+
+@register.tag
+def card_cache(parser, token):
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError("'%s' ждёт один аргумент - пост" % bits[0])
+    nodelist = parser.parse(('endcard_cache',))
+    parser.delete_first_token()
+    return CardCacheNode(nodelist, parser.compile_filter(bits[1]))
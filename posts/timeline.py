@@ -0,0 +1,149 @@
+"""
+Лента подписок с разносом при записи (fan-out-on-write).
+
+Новый пост сразу раскладывается по TimelineEntry всех подписчиков автора,
+поэтому follow_index читает ленту одним диапазоном по индексу
+(user, -pub_date, -post). Посты авторов, у которых подписчиков больше
+TIMELINE_FANOUT_LIMIT, не раскладываются: их лента добирает при чтении.
+Когда после отписки автор опускается ниже порога, его посты за это время
+раскладываются заново (refan), иначе они пропали бы из лент подписчиков.
+Список таких авторов у пользователя кешируется, так что лента из кеша не
+стоит ни одного запроса.
+"""
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+
+from users.models import Follow, Profile
+from . import cache as feed_cache
+from .models import Post, TimelineEntry
+from .pagination import KeysetPaginator, MergedKeysetPaginator
+
+BATCH_SIZE = 500
+
+
+def fanout_limit():
+    return getattr(settings, 'TIMELINE_FANOUT_LIMIT', 1000)
+
+
+def backfill_limit():
+    return getattr(settings, 'TIMELINE_BACKFILL_LIMIT', 1000)
+
+
+def is_celebrity(author_id):
+    return Profile.objects.filter(user_id=author_id, followers_count__gte=fanout_limit()).exists()
+
+
+def celebrity_authors(user):
+    """
+    Кеш под версией подписок пользователя и общей 'celebrities', которую
+    меняет переход любого автора через TIMELINE_FANOUT_LIMIT.
+    """
+    key = 'celebrities:%s:%s' % (user.id, feed_cache.versions('following:%s' % user.id, 'celebrities'))
+    return feed_cache.single_flight(key, lambda: list(
+        Follow.objects.filter(user=user, author__profile__followers_count__gte=fanout_limit())
+        .values_list('author', flat=True).distinct()
+    ), feed_cache.timeout())
+
+
+def fan_out(post):
+    if is_celebrity(post.author_id):
+        return
+    followers = list(Follow.objects.filter(author_id=post.author_id).values_list('user_id', flat=True).distinct())
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(user_id=user_id, post_id=post.id, author_id=post.author_id, pub_date=post.pub_date)
+            for user_id in followers
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    feed_cache.bump(*('follow:%s' % user_id for user_id in followers))
+
+
+def backfill(user, author):
+    if is_celebrity(author.id):
+        return
+    posts = Post.objects.filter(author=author).order_by('-pub_date', '-id').values_list('id', 'pub_date')
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(user_id=user.id, post_id=post_id, author_id=author.id, pub_date=pub_date)
+            for post_id, pub_date in posts[:backfill_limit()]
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    feed_cache.bump('follow:%s' % user.id)
+
+
+def prune(user, author):
+    TimelineEntry.objects.filter(user=user, author=author).delete()
+    feed_cache.bump('follow:%s' % user.id)
+
+
+def _spread(author_id, followers):
+    posts = list(
+        Post.objects.filter(author_id=author_id).order_by('-pub_date', '-id')
+        .values_list('id', 'pub_date')[:backfill_limit()]
+    )
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(user_id=user_id, post_id=post_id, author_id=author_id, pub_date=pub_date)
+            for user_id in followers for post_id, pub_date in posts
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def refan(author_id):
+    """Раскладывает последние посты автора всем его подписчикам; уже разложенные пропускаются."""
+    if is_celebrity(author_id):
+        return
+    followers = list(Follow.objects.filter(author_id=author_id).values_list('user_id', flat=True).distinct())
+    _spread(author_id, followers)
+    feed_cache.bump(*('follow:%s' % user_id for user_id in followers))
+
+
+def rebuild():
+    """Пересобирает все ленты с нуля, например после массового импорта."""
+    TimelineEntry.objects.all().delete()
+    celebrities = Profile.objects.filter(followers_count__gte=fanout_limit()).values('user_id')
+    pairs = Follow.objects.exclude(author__in=celebrities).order_by('author_id') \
+        .values_list('user_id', 'author_id').distinct()
+    users = set()
+    for author_id, followers in groupby(pairs.iterator(), key=itemgetter(1)):
+        followers = [user_id for user_id, _ in followers]
+        users.update(followers)
+        _spread(author_id, followers)
+    feed_cache.bump(*('follow:%s' % user_id for user_id in users))
+
+
+def follow_feed(user, per_page):
+    """Пространства кеша ленты подписок и build(cursor) для feed_cache.feed_page."""
+    paginator = KeysetPaginator(
+        TimelineEntry.objects.filter(user=user).only('post_id', 'pub_date'),
+        per_page,
+        ordering=('-pub_date', '-post_id'),
+    )
+    celebrities = celebrity_authors(user)
+    namespaces = ['follow:%s' % user.id] + ['author:%s' % author_id for author_id in celebrities]
+    if celebrities:
+        paginator = MergedKeysetPaginator([
+            paginator,
+            KeysetPaginator(Post.objects.filter(author__in=celebrities).only('id', 'pub_date'), per_page),
+        ], per_page)
+
+    def build(cursor):
+        page = paginator.get_page(cursor)
+        page.object_list = [getattr(row, 'post_id', row.pk) for row in page]
+        return page
+
+    return namespaces, build
+
+
+def follow_feed_page(user, cursor, per_page):
+    """Страница ленты подписок; в object_list - id постов."""
+    namespaces, build = follow_feed(user, per_page)
+    return feed_cache.feed_page(namespaces, cursor, build)
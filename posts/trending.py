@@ -0,0 +1,186 @@
+"""
+Популярные группы и посты за скользящие 1 час, 24 часа и 7 дней.
+
+Сигналы раскладывают каждый пост и комментарий по часовым корзинам:
+GroupActivity (посты и комментарии группы за час) и PostActivity
+(комментарии к посту за час) - атомарным UPDATE ... SET x = x + 1, а
+первая запись часа создаёт строку. Страница суммирует корзины окна, то
+есть читает не больше строки на группу или пост за каждый час, а не все
+посты и комментарии. Самая старая корзина попадает в окно лишь частично,
+её вклад берётся пропорционально перекрытию, поэтому окно сдвигается
+плавно, а не скачком раз в час.
+
+Корзины старше самого длинного окна удаляет prune() (задача
+posts.tasks.prune_activity, раз в час); rebuild() пересчитывает всё
+заново, например после массового импорта.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, FloatField, Sum, Value, When
+from django.utils import timezone
+
+from . import cache as feed_cache
+from .models import Comment, Group, GroupActivity, Post, PostActivity
+
+BUCKET_SECONDS = 60 * 60
+WINDOWS = {'1h': 60 * 60, '24h': 60 * 60 * 24, '7d': 60 * 60 * 24 * 7}
+DEFAULT_WINDOW = '24h'
+# корзины, которые ещё может задеть самое длинное окно
+KEEP_SECONDS = max(WINDOWS.values()) + BUCKET_SECONDS
+
+
+def cache_timeout():
+    return getattr(settings, 'TRENDING_CACHE_TIMEOUT', 60)
+
+
+def bucket_of(moment):
+    stamp = moment.timestamp()
+    return datetime.fromtimestamp(stamp - stamp % BUCKET_SECONDS, tz=timezone.utc)
+
+
+def _expired(bucket):
+    return bucket < bucket_of(timezone.now() - timedelta(seconds=KEEP_SECONDS))
+
+
+def _add(model, bucket, field, delta, **lookup):
+    """Прибавляет delta к корзине; возвращает bucket, если строку пришлось создать."""
+    rows = model.objects.filter(bucket=bucket, **lookup)
+    if delta < 0:
+        # корзину могли уже удалить или пересчитать без этой записи
+        rows.filter(**{field + '__gte': -delta}).update(**{field: F(field) + delta})
+        return None
+    if rows.update(**{field: F(field) + delta}) or _expired(bucket):
+        return None
+    try:
+        with transaction.atomic():
+            model.objects.create(bucket=bucket, **lookup, **{field: delta})
+    except IntegrityError:
+        # параллельный запрос создал ту же корзину первым
+        rows.update(**{field: F(field) + delta})
+        return None
+    return bucket
+
+
+def post_added(post, delta=1):
+    if post.group_id:
+        return _add(GroupActivity, bucket_of(post.pub_date), 'posts', delta, group_id=post.group_id)
+    return None
+
+
+def comment_added(comment, delta=1):
+    bucket = bucket_of(comment.created)
+    started = _add(PostActivity, bucket, 'comments', delta, post_id=comment.post_id)
+    if Comment.post.is_cached(comment):
+        group_id = comment.post.group_id
+    else:
+        group_id = Post.objects.filter(pk=comment.post_id).values_list('group_id', flat=True).first()
+    if group_id:
+        started = _add(GroupActivity, bucket, 'comments', delta, group_id=group_id) or started
+    return started
+
+
+def post_moved(post, old_group_id):
+    """Пост сменил группу: его самого и комментарии к нему считаем в новой."""
+    moves = [(bucket_of(post.pub_date), 'posts', 1)] + [
+        (bucket, 'comments', comments)
+        for bucket, comments in PostActivity.objects.filter(post_id=post.pk).values_list('bucket', 'comments')
+    ]
+    started = None
+    for bucket, field, count in moves:
+        if old_group_id:
+            _add(GroupActivity, bucket, field, -count, group_id=old_group_id)
+        if post.group_id:
+            started = _add(GroupActivity, bucket, field, count, group_id=post.group_id) or started
+    return started
+
+
+def _window(window):
+    """(самая старая корзина окна, доля её часа внутри окна)."""
+    since = timezone.now() - timedelta(seconds=WINDOWS[window])
+    oldest = bucket_of(since)
+    return oldest, 1 - (since - oldest).total_seconds() / BUCKET_SECONDS
+
+
+def _weighted(field, oldest, share):
+    return Sum(Case(
+        When(bucket=oldest, then=F(field) * Value(share)),
+        default=F(field),
+        output_field=FloatField(),
+    ))
+
+
+def _hot_groups(window, limit):
+    oldest, share = _window(window)
+    rows = list(
+        GroupActivity.objects.filter(bucket__gte=oldest).values('group_id')
+        .annotate(post_count=_weighted('posts', oldest, share), comment_count=_weighted('comments', oldest, share))
+        .annotate(score=F('post_count') + F('comment_count'))
+        .filter(score__gte=0.5).order_by('-score', 'group_id')[:limit]
+    )
+    groups = Group.objects.in_bulk([row['group_id'] for row in rows])
+    return [
+        {'group': groups[row['group_id']], 'posts': round(row['post_count']), 'comments': round(row['comment_count'])}
+        for row in rows if row['group_id'] in groups
+    ]
+
+
+def _hot_posts(window, limit):
+    oldest, share = _window(window)
+    return [
+        (row['post_id'], round(row['comment_count'])) for row in
+        PostActivity.objects.filter(bucket__gte=oldest).values('post_id')
+        .annotate(comment_count=_weighted('comments', oldest, share))
+        .filter(comment_count__gte=0.5).order_by('-comment_count', '-post_id')[:limit]
+    ]
+
+
+def hot_groups(window=DEFAULT_WINDOW, limit=10):
+    """[{'group', 'posts', 'comments'}] по убыванию активности за окно."""
+    return feed_cache.single_flight(
+        'trending:groups:%s:%s' % (window, limit), lambda: _hot_groups(window, limit), cache_timeout()
+    )
+
+
+def hot_posts(window=DEFAULT_WINDOW, limit=10):
+    """[(пост, комментариев за окно)] по убыванию числа комментариев."""
+    counts = feed_cache.single_flight(
+        'trending:posts:%s:%s' % (window, limit), lambda: _hot_posts(window, limit), cache_timeout()
+    )
+    posts = {post.id: post for post in feed_cache.get_posts([post_id for post_id, _ in counts])}
+    return [(posts[post_id], comments) for post_id, comments in counts if post_id in posts]
+
+
+def prune():
+    oldest = bucket_of(timezone.now() - timedelta(seconds=KEEP_SECONDS))
+    deleted, _ = GroupActivity.objects.filter(bucket__lt=oldest).delete()
+    pruned, _ = PostActivity.objects.filter(bucket__lt=oldest).delete()
+    return deleted + pruned
+
+
+def rebuild():
+    since = bucket_of(timezone.now() - timedelta(seconds=KEEP_SECONDS))
+    group_posts, group_comments, post_comments = Counter(), Counter(), Counter()
+    for group_id, pub_date in Post.objects.filter(pub_date__gte=since, group__isnull=False) \
+            .values_list('group_id', 'pub_date').iterator():
+        group_posts[group_id, bucket_of(pub_date)] += 1
+    for post_id, group_id, created in Comment.objects.filter(created__gte=since) \
+            .values_list('post_id', 'post__group_id', 'created').iterator():
+        bucket = bucket_of(created)
+        post_comments[post_id, bucket] += 1
+        if group_id:
+            group_comments[group_id, bucket] += 1
+
+    GroupActivity.objects.all().delete()
+    PostActivity.objects.all().delete()
+    GroupActivity.objects.bulk_create((
+        GroupActivity(group_id=group_id, bucket=bucket, posts=group_posts[group_id, bucket],
+                      comments=group_comments[group_id, bucket])
+        for group_id, bucket in set(group_posts) | set(group_comments)
+    ), batch_size=1000)
+    PostActivity.objects.bulk_create((
+        PostActivity(post_id=post_id, bucket=bucket, comments=comments)
+        for (post_id, bucket), comments in post_comments.items()
+    ), batch_size=1000)
@@ -1,19 +1,35 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import api, async_views, views
+
+# ленты: под ASGI асинхронные, под WSGI обычные
+feeds = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
-    path("", views.index, name="index"),
-    path("group/<slug:slug>", views.group_posts, name="group"),
+    # JSON API - раньше маршрутов с <username>, иначе 'api/follow/' съест profile_follow
+    path("api/posts/", api.index, name="api_index"),
+    path("api/posts/<int:post_id>/", api.post_view, name="api_post"),
+    path("api/posts/<int:post_id>/comments/", api.post_comments, name="api_post_comments"),
+    path("api/groups/<slug:slug>/posts/", api.group_posts, name="api_group"),
+    path("api/users/<str:username>/posts/", api.profile, name="api_profile"),
+    path("api/follow/", api.follow_index, name="api_follow_index"),
+    path("api/trending/", api.trending_view, name="api_trending"),
+
+    path("", feeds.index, name="index"),
+    path("group/<slug:slug>", feeds.group_posts, name="group"),
     path("new/", views.new_post, name="new_post"),
+    path("search/", views.search_posts, name="search"),
+    path("trending/", views.trending_view, name="trending"),
 
-    path("follow/", views.follow_index, name="follow_index"),
+    path("follow/", feeds.follow_index, name="follow_index"),
     path("<str:username>/follow/", views.profile_follow, name="profile_follow"),
     path("<str:username>/unfollow/", views.profile_unfollow, name="profile_unfollow"),
 
 
     # Просмотр записи
-    path('<str:username>/<int:post_id>/', views.post_view, name='post'),
+    path('<str:username>/<int:post_id>/', feeds.post_view, name='post'),
+    path('<str:username>/<int:post_id>/comments/', views.post_comments, name='post_comments'),
     path(
         '<str:username>/<int:post_id>/edit/',
         views.post_edit,
@@ -21,5 +37,5 @@ urlpatterns = [
     ),
     path("<username>/<int:post_id>/comment/", views.add_comment, name="add_comment"),
     # Профайл пользователя
-    path('<str:username>/', views.profile, name='profile'),
+    path('<str:username>/', feeds.profile, name='profile'),
 ]
\ No newline at end of file
@@ -1,21 +1,24 @@
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
-from django.shortcuts import render, get_object_or_404, redirect
+from django.db import transaction
+from django.http import Http404, HttpResponse
+from django.shortcuts import render, redirect
 from django.urls import reverse
 
-from users.models import Follow
+from users import graph
+from yatube.db_router import replica_reads
+from . import batching, cache as feed_cache, identity, search, tasks, timeline, trending
 from .forms import PostForm, CommentForm
-from .models import Post, Group, User
-from django.core.paginator import Paginator
-from django.views.decorators.cache import cache_page
+from .models import Post
+from .pagination import KeysetPaginator
 
 
-@cache_page(20, key_prefix='index_page')
+@replica_reads
 def index(request):
-    post_list = Post.objects. order_by('-pub_date').all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    paginator = KeysetPaginator(Post.objects.only('id', 'pub_date'), 10)
+    page = feed_cache.feed_page(
+        ['index'], request.GET.get('cursor'),
+        lambda cursor: feed_cache.post_ids_page(paginator, cursor)
+    )
     return render(
         request,
         "index.html",
@@ -23,27 +26,59 @@ def index(request):
     )
 
 
+@replica_reads
 def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    post_list = Post.objects.filter(group=group).order_by('-pub_date').all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    group = identity.get_group(request, slug)
+    paginator = KeysetPaginator(Post.objects.filter(group=group).only('id', 'pub_date'), 10)
+    page = feed_cache.feed_page(
+        ['group:%s' % group.id], request.GET.get('cursor'),
+        lambda cursor: feed_cache.post_ids_page(paginator, cursor)
+    )
     return render(
         request,
         "group.html",
         {"group": group, "page": page, "paginator": paginator})
 
 
+@replica_reads
+def search_posts(request):
+    query = request.GET.get('q', '').strip()
+    group = identity.get_group(request, request.GET['group']) if request.GET.get('group') else None
+    author = identity.get_user(request, request.GET['author']) if request.GET.get('author') else None
+    page = None
+    if query:
+        page = search.search_page(query, request.GET.get('cursor'), 10, group=group, author=author)
+        page.object_list = feed_cache.get_posts(page.object_list)
+    return render(
+        request,
+        "search.html",
+        {"query": query, "group": group, "author": author, "page": page}
+    )
+
+
+@replica_reads
+def trending_view(request):
+    window = request.GET.get('window')
+    if window not in trending.WINDOWS:
+        window = trending.DEFAULT_WINDOW
+    hot = trending.hot_posts(window)
+    return render(
+        request,
+        "trending.html",
+        {"window": window, "windows": list(trending.WINDOWS), "groups": trending.hot_groups(window),
+         "hot": hot, "posts": [post for post, _ in hot]}
+    )
+
+
 @login_required
 def new_post(request):
-    if request.user not in User.objects.all():
-        return redirect('index')
     if request.method == 'POST':
         form = PostForm(request.POST, files=request.FILES or None)
         if form.is_valid():
             form.instance.author = request.user
-            form.save()
+            # пост и всё, что пишут сигналы, - одним коротким коммитом
+            with transaction.atomic():
+                form.save()
             return redirect('index')
         return render(request, 'new_post.html', {'form': form, 'title': 'Новый пост'})
     form = PostForm()
@@ -55,55 +90,73 @@ def new_post(request):
                   })
 
 
+@replica_reads
 def profile(request, username):
-    user = get_object_or_404(User, username=username)
-    user_posts = Post.objects.filter(author=user).order_by('-pub_date')
+    user = identity.get_user(request, username)
     name = user.first_name + ' ' + user.last_name
 
-    number_of_user_posts = user_posts.count()
-    paginator = Paginator(user_posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    number_of_user_posts = user.profile.posts_count
+    paginator = KeysetPaginator(Post.objects.filter(author=user).only('id', 'pub_date'), 10)
+    page = feed_cache.feed_page(
+        ['author:%s' % user.id], request.GET.get('cursor'),
+        lambda cursor: feed_cache.post_ids_page(paginator, cursor)
+    )
 
-    following=False
-    if user != request.user:
-        follow = Follow.objects.filter(author=user, user=request.user)
-        if follow:
-            following = True
-        else:
-            following = False
+    following = graph.is_following(request.user, user.id)
 
-    try:
-        last_post = user_posts[0]
-    except IndexError:
-        return render(request, 'profile.html', {'name': name, 'username': username, 'number_of_user_posts': 0})
+    if not page.object_list:
+        return render(request, 'profile.html', {'name': name, 'username': username, 'number_of_user_posts': 0,
+                                                'following': following, 'profile': user.profile})
+    last_post = page[0]
 
     return render(
         request,
         'profile.html',
         {"following": following, 'name': name, 'username': username, 'number_of_user_posts': number_of_user_posts,
-         'page': page, "paginator": paginator, 'last_post': last_post, 'last_post.pub_date': last_post.pub_date}
+         'page': page, "paginator": paginator, 'last_post': last_post, 'last_post.pub_date': last_post.pub_date,
+         'profile': user.profile}
     )
 
 
+@replica_reads
 def post_view(request, username, post_id):
-    user = get_object_or_404(User, username=username)
-    user_posts = Post.objects.filter(author=user, id=post_id)
+    user = identity.get_user(request, username)
+    posts = feed_cache.get_posts([post_id])
+    if not posts or posts[0].author_id != user.id:
+        raise Http404
+    post = posts[0]
     name = user.first_name + ' ' + user.last_name
-    post = user_posts[0]
     form = CommentForm()
-    items = post.comments.all()
+    order = comments_order(request)
+    items = feed_cache.comments_page(post.id, request.GET.get('comments'), order == 'new')
     return render(
         request,
         'post.html',
         {'name': name, 'username': username, 'post': post, 'last_post.pub_date': post.pub_date,
-         'last_post.id': post.id, 'number_of_user_posts': Post.objects.filter(author=user).count(),
-         'form': form, 'items': items})
+         'last_post.id': post.id, 'number_of_user_posts': user.profile.posts_count,
+         'form': form, 'items': items, 'order': order, 'profile': user.profile})
+
+
+def comments_order(request):
+    return 'new' if request.GET.get('order') == 'new' else 'old'
+
+
+@replica_reads
+def post_comments(request, username, post_id):
+    """Следующая страница комментариев HTML-фрагментом для кнопки "Показать ещё"."""
+    user = identity.get_user(request, username)
+    posts = feed_cache.get_posts([post_id])
+    if not posts or posts[0].author_id != user.id:
+        raise Http404
+    order = comments_order(request)
+    items = feed_cache.comments_page(post_id, request.GET.get('comments'), order == 'new')
+    return render(request, 'comment_list.html',
+                  {'username': username, 'post': posts[0], 'items': items, 'order': order})
 
 
 @login_required
 def post_edit(request, username, post_id):
-    user = User.objects.filter(username=username).first()
+    user = identity.get_user(request, username)
     if user.id != request.user.id:
         return HttpResponse('Unauthorized', status=401)
 
@@ -146,40 +199,44 @@ def server_error(request):
 
 @login_required
 def add_comment(request, username, post_id):
-    post = get_object_or_404(Post, pk=post_id, author__username=username)
+    author = identity.get_user(request, username)
+    posts = feed_cache.get_posts([post_id])
+    if not posts or posts[0].author_id != author.id:
+        raise Http404
+    post = posts[0]
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
         comment.post = post
         comment.author = request.user
-        comment.save()
+        batching.save(comment)
         return redirect("post", username=username, post_id=post_id)
     return render(request, "post.html", {"form": form})
 
 
+@replica_reads
 @login_required
 def follow_index(request):
-    following = User.objects.get(pk=request.user.id).follower.all().values_list('author')
-    post_list = Post.objects.filter(author__in=following).order_by('-pub_date')
-    paginator = Paginator(post_list, 5)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request, "follow.html", {"index": False, "follow_index": True, "page": page, "paginator": paginator})
+    page = timeline.follow_feed_page(request.user, request.GET.get('cursor'), 5)
+    return render(request, "follow.html", {"index": False, "follow_index": True, "page": page,
+                                           "paginator": page.paginator,
+                                           "suggestions": graph.suggestions(request.user)})
 
 @login_required
 def profile_follow(request, username):
     #if request.method != 'POST':
     #    return redirect('profile', username=username)
-    tofollowUser = get_object_or_404(User, username=username)
-    follower = Follow.objects.create(author=tofollowUser, user=request.user)
-    follower.save()
+    tofollowUser = identity.get_user(request, username)
+    follower, created = graph.follow(request.user, tofollowUser)
+    if created:
+        tasks.backfill.enqueue(request.user.id, tofollowUser.id, key='backfill:%s' % follower.pk)
     return redirect('profile', username=username)
 
 @login_required
 def profile_unfollow(request, username):
     #if request.method != 'POST':
     #    return redirect('profile', username=username)
-    tofollowUser = get_object_or_404(User, username=username)
-    follower = Follow.objects.filter(author=tofollowUser, user=request.user)
-    follower.delete()
+    tofollowUser = identity.get_user(request, username)
+    if graph.unfollow(request.user, tofollowUser):
+        timeline.prune(request.user, tofollowUser)
     return redirect('profile', username=username)
\ No newline at end of file
@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from tasks import queue
+
+
+class Command(BaseCommand):
+    help = "Воркер очереди задач: выполняет задачи из базы, пока его не остановят"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="выполнить всё, что пора, и выйти")
+        parser.add_argument("--batch-size", type=int, default=20)
+        parser.add_argument("--poll", type=float, default=1.0, help="пауза в секундах, когда очередь пуста")
+        parser.add_argument("--lease", type=int, default=300,
+                            help="через сколько секунд задачу упавшего воркера заберёт другой")
+
+    def handle(self, *args, **options):
+        total_done = total_failed = 0
+        purge_interval = getattr(settings, "TASKS_PURGE_INTERVAL", 60 * 60)
+        purged_at = None
+        try:
+            while True:
+                close_old_connections()
+                # воркер живёт неделями: чистим не только при старте
+                if purged_at is None or time.monotonic() - purged_at >= purge_interval:
+                    self.purge()
+                    purged_at = time.monotonic()
+                done, failed = queue.run_batch(options["batch_size"], options["lease"])
+                total_done += done
+                total_failed += failed
+                if done or failed:
+                    continue
+                if options["once"]:
+                    break
+                time.sleep(options["poll"])
+        except KeyboardInterrupt:
+            pass
+        self.stderr.write("Выполнено: %s, с ошибкой: %s" % (total_done, total_failed))
+
+    def purge(self):
+        purged = queue.purge(
+            getattr(settings, "TASKS_KEEP_DONE_SECONDS", 7 * 24 * 60 * 60),
+            getattr(settings, "TASKS_KEEP_FAILED_SECONDS", 30 * 24 * 60 * 60),
+        )
+        if purged:
+            self.stderr.write("Удалено старых задач: %s" % purged)
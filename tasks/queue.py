@@ -0,0 +1,148 @@
+"""
+Очередь фоновых задач в базе.
+
+    @task(max_attempts=3)
+    def notify(comment_id): ...
+
+    notify.enqueue(comment.id, key='comment-email:%s' % comment.id)
+
+enqueue() пишет строку Task в той же транзакции, что и сам запрос: если
+запрос откатится, задача тоже пропадёт, а воркер (manage.py run_tasks)
+увидит её только после коммита. С ключом задача ставится один раз, даже
+если enqueue() позовут повторно. Воркер забирает задачи условным UPDATE,
+поэтому их можно запускать несколько; каждая задача выполняется в своей
+транзакции вместе с отметкой о выполнении, упавшая повторяется с
+экспоненциальной задержкой до max_attempts раз. Задача может выполниться
+больше одного раза (например, если воркер умер после письма), поэтому
+обработчики должны быть идемпотентными.
+
+С TASKS_EAGER (по умолчанию при DEBUG) задачи выполняются сразу, прямо в
+enqueue(): для разработки и тестов без воркера.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# задержка повтора не растёт дальше часа
+MAX_RETRY_DELAY = 60 * 60
+
+_registry = {}
+
+
+def task(name=None, max_attempts=5, retry_delay=10):
+    """Регистрирует функцию как задачу и добавляет ей .enqueue(*args, key=None, delay=0)."""
+    def decorate(func):
+        func.task_name = name or '%s.%s' % (func.__module__, func.__name__)
+        func.max_attempts = max_attempts
+        func.retry_delay = retry_delay
+        func.enqueue = lambda *args, key=None, delay=0: enqueue(func, args, key, delay)
+        _registry[func.task_name] = func
+        return func
+
+    return decorate
+
+
+def get_task(name):
+    return _registry.get(name)
+
+
+def eager():
+    return getattr(settings, 'TASKS_EAGER', False)
+
+
+def enqueue(func, args, key=None, delay=0):
+    """Аргументы должны сериализоваться в JSON: id, а не объекты моделей."""
+    if eager():
+        try:
+            # своя точка сохранения: упавшая задача не ломает транзакцию запроса
+            with transaction.atomic():
+                func(*args)
+        except Exception:
+            logger.exception('Задача %s%s не выполнилась', func.task_name, tuple(args))
+        return
+    Task.objects.bulk_create([Task(
+        name=func.task_name, args=list(args), key=key, max_attempts=func.max_attempts,
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )], ignore_conflicts=True)
+
+
+def _due(now):
+    # RUNNING с истёкшей арендой - воркер умер посреди задачи
+    return Q(status=Task.QUEUED) | Q(status=Task.RUNNING, locked_until__lt=now)
+
+
+def claim(limit, lease):
+    """Забирает до limit задач, которым пора выполняться, на lease секунд."""
+    now = timezone.now()
+    candidates = list(
+        Task.objects.filter(_due(now), run_after__lte=now).order_by('run_after', 'id').values_list('id', flat=True)[:limit]
+    )
+    claimed = [
+        task_id for task_id in candidates
+        # другой воркер мог успеть раньше - тогда UPDATE не найдёт строку
+        if Task.objects.filter(_due(now), pk=task_id).update(
+            status=Task.RUNNING, locked_until=now + timedelta(seconds=lease), attempts=F('attempts') + 1,
+            updated=now,
+        )
+    ]
+    return list(Task.objects.filter(pk__in=claimed).order_by('run_after', 'id'))
+
+
+def execute(job):
+    """Выполняет захваченную задачу; True, если успешно."""
+    func = get_task(job.name)
+    try:
+        if func is None:
+            raise LookupError('Неизвестная задача %s' % job.name)
+        with transaction.atomic():
+            func(*job.args)
+            Task.objects.filter(pk=job.pk).update(status=Task.DONE, locked_until=None, last_error='',
+                                                  updated=timezone.now())
+        return True
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if func is not None and job.attempts < job.max_attempts:
+            delay = min(func.retry_delay * 2 ** (job.attempts - 1), MAX_RETRY_DELAY)
+            logger.warning('Задача %s (%s) упала, попытка %s из %s, повтор через %s с\n%s',
+                           job.name, job.pk, job.attempts, job.max_attempts, delay, error)
+            Task.objects.filter(pk=job.pk).update(status=Task.QUEUED, locked_until=None, last_error=error,
+                                                  run_after=now + timedelta(seconds=delay), updated=now)
+        else:
+            logger.error('Задача %s (%s) не выполнена после %s попыток\n%s', job.name, job.pk, job.attempts, error)
+            Task.objects.filter(pk=job.pk).update(status=Task.FAILED, locked_until=None, last_error=error,
+                                                  updated=now)
+        return False
+
+
+def run_batch(limit=20, lease=300):
+    """Одна порция задач; возвращает (выполнено, упало)."""
+    done = failed = 0
+    for job in claim(limit, lease):
+        if execute(job):
+            done += 1
+        else:
+            failed += 1
+    return done, failed
+
+
+def purge(older_than, failed_older_than=None):
+    """
+    Удаляет выполненные задачи старше older_than секунд и упавшие - старше
+    failed_older_than (None - не трогает); их ключи снова свободны.
+    """
+    now = timezone.now()
+    expired = Q(status=Task.DONE, updated__lt=now - timedelta(seconds=older_than))
+    if failed_older_than is not None:
+        expired |= Q(status=Task.FAILED, updated__lt=now - timedelta(seconds=failed_older_than))
+    deleted, _ = Task.objects.filter(expired).delete()
+    return deleted
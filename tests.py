@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 import pytest
 from django.test import Client
 from django.urls import reverse
@@ -174,7 +174,73 @@ class TestingCache(TestCase):
             {"text": "test_text 2"}
         )
         response2 = self.client.get(reverse('index'))
-        self.assertNotContains(response2, 'test_text 2')
+        self.assertContains(response2, 'test_text 2')
+
+    def test_cached_index_does_not_query_posts(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        Post.objects.create(text="test_text 1", author=self.user)
+        self.client.get(reverse('index'))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, "test_text 1")
+        self.assertFalse(any("posts_post" in q["sql"] for q in ctx.captured_queries))
+
+    def test_edit_and_comment_show_up_immediately(self):
+        post = Post.objects.create(text="test_text 1", author=self.user)
+        post_url = reverse('post', args=(self.user.username, post.id))
+        self.client.get(reverse('index'))
+        self.client.get(post_url)
+
+        post.text = "test_text edited"
+        post.save()
+        Comment.objects.create(post=post, author=self.user, text="test_comment")
+        self.assertContains(self.client.get(reverse('index')), "test_text edited")
+        response = self.client.get(post_url)
+        self.assertContains(response, "test_comment")
+        self.assertContains(response, "1 комментариев")
+
+    def test_cached_card_keeps_edit_link_per_user(self):
+        post = Post.objects.create(text="test_text 1", author=self.user)
+        edit_url = reverse('post_edit', args=(self.user.username, post.id))
+        anonymous = Client()
+        self.assertNotContains(anonymous.get(reverse('index')), edit_url)
+        self.client.login(username="yaloh", password="loshik123")
+        self.assertContains(self.client.get(reverse('index')), edit_url)
+        self.assertNotContains(anonymous.get(reverse('index')), edit_url)
+
+
+class TestingCacheSerializers(TestCase):
+    def test__memcached_serde_compresses_large_values(self):
+        from yatube.cache import COMPRESS_MIN_LENGTH, CompressedSerde
+        serde = CompressedSerde()
+        # целые - обычным числом, иначе memcached не сможет incr/decr
+        self.assertEqual(serde.serialize("k", 42), (b"42", CompressedSerde.FLAG_INT))
+        self.assertEqual(serde.deserialize("k", b"42", CompressedSerde.FLAG_INT), 42)
+
+        small = {"text": "коротко"}
+        data, flags = serde.serialize("k", small)
+        self.assertEqual(data[:1], b"\x00")
+        self.assertEqual(serde.deserialize("k", data, flags), small)
+
+        large = ["строка ленты"] * COMPRESS_MIN_LENGTH
+        data, flags = serde.serialize("k", large)
+        self.assertEqual(data[:1], b"\x01")
+        self.assertLess(len(data), COMPRESS_MIN_LENGTH)
+        self.assertEqual(serde.deserialize("k", data, flags), large)
+
+    def test__file_cache_round_trip_is_compressed(self):
+        import os
+        import pickle
+        import tempfile
+        from django.core.cache.backends.filebased import FileBasedCache
+        with tempfile.TemporaryDirectory() as location:
+            cache = FileBasedCache(location, {})
+            page = "<li>карточка поста</li>" * 2000
+            cache.set("page", page)
+            self.assertEqual(cache.get("page"), page)
+            [name] = [name for name in os.listdir(location) if name.endswith(".djcache")]
+            self.assertLess(os.path.getsize(os.path.join(location, name)), len(pickle.dumps(page)) / 10)
 
 
 @pytest.mark.django_db(transaction=True)
@@ -251,3 +317,1523 @@ class TestingFollowing(TestCase):
         response = self.client.get(f'/loh/{post_id}/')
         html = response.content.decode()
         assert created_comment.text in html
+
+
+@pytest.mark.django_db(transaction=True)
+class TestingKeysetPagination(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="yaloh",
+            password="loshik123"
+        )
+        self.group = Group.objects.create(slug="test_group")
+        for i in range(25):
+            Post.objects.create(text=f"post {i}", author=self.user, group=self.group)
+        self.expected = list(
+            Post.objects.filter(group=self.group).order_by('-pub_date', '-id').values_list('id', flat=True)
+        )
+
+    def get_page(self, cursor=None):
+        data = {"cursor": cursor} if cursor else {}
+        response = self.client.get(reverse("group", args=(self.group.slug,)), data)
+        self.assertEqual(response.status_code, 200)
+        return response.context["page"]
+
+    def test__cursors_walk_whole_feed_both_ways(self):
+        seen = []
+        pages = []
+        page = self.get_page()
+        self.assertFalse(page.has_previous())
+        while True:
+            pages.append(page)
+            seen += [post.id for post in page]
+            if not page.has_next():
+                break
+            page = self.get_page(page.next_cursor)
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(len(pages), 3)
+
+        back = self.get_page(pages[-1].previous_cursor)
+        self.assertEqual([post.id for post in back], [post.id for post in pages[-2]])
+        self.assertTrue(back.has_next())
+
+    def test__no_count_query(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            page = self.get_page()
+            self.get_page(page.next_cursor)
+        self.assertFalse(any(q["sql"].startswith("SELECT COUNT(*)") for q in ctx.captured_queries))
+
+    def test__broken_cursor_returns_first_page(self):
+        page = self.get_page("not-a-cursor")
+        self.assertEqual([post.id for post in page], self.expected[:10])
+
+
+@pytest.mark.django_db(transaction=True)
+class TestingFeedQueries(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="yaloh",
+            password="loshik123"
+        )
+        self.author = User.objects.create_user(
+            username="loh",
+            password="loshped123"
+        )
+        self.group = Group.objects.create(slug="test_group")
+        Follow.objects.create(user=self.user, author=self.author)
+        self.client.login(username="yaloh", password="loshik123")
+        self.urls = [
+            reverse("index"),
+            reverse("group", args=(self.group.slug,)),
+            reverse("profile", args=(self.author.username,)),
+            reverse("follow_index"),
+        ]
+
+    def add_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(text=f"post {i}", author=self.author, group=self.group)
+            Comment.objects.create(post=post, author=self.user, text="comment")
+
+    def count_queries(self, url):
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test__feed_page_query_count_does_not_depend_on_page_size(self):
+        self.add_posts(1)
+        small = {url: self.count_queries(url) for url in self.urls}
+        self.add_posts(9)
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), small[url])
+                self.assertLessEqual(small[url], 8)
+
+
+@pytest.mark.django_db(transaction=True)
+class TestingTimeline(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="yaloh",
+            password="loshik123"
+        )
+        self.author = User.objects.create_user(
+            username="loh",
+            password="loshped123"
+        )
+        self.client.login(username="yaloh", password="loshik123")
+
+    def follow_feed_texts(self):
+        response = self.client.get(reverse("follow_index"))
+        return [post.text for post in response.context["page"]]
+
+    def test__follow_backfills__unfollow_prunes(self):
+        from posts.models import TimelineEntry
+        Post.objects.create(text="old post", author=self.author)
+        self.client.get(reverse("profile_follow", args=(self.author.username,)))
+        self.assertEqual(self.follow_feed_texts(), ["old post"])
+
+        Post.objects.create(text="new post", author=self.author)
+        self.assertEqual(TimelineEntry.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(self.follow_feed_texts(), ["new post", "old post"])
+
+        self.client.get(reverse("profile_unfollow", args=(self.author.username,)))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+        self.assertEqual(self.follow_feed_texts(), [])
+
+    def test__popular_author_is_read_on_request(self):
+        from django.test import override_settings
+        from posts.models import TimelineEntry
+        Follow.objects.create(user=self.user, author=self.author)
+        with override_settings(TIMELINE_FANOUT_LIMIT=1):
+            Post.objects.create(text="celebrity post", author=self.author)
+            self.assertFalse(TimelineEntry.objects.exists())
+            self.assertEqual(self.follow_feed_texts(), ["celebrity post"])
+
+    def test__cached_follow_page_skips_graph_queries(self):
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        cache.clear()
+        Follow.objects.create(user=self.user, author=self.author)
+        Post.objects.create(text="пост", author=self.author)
+        self.client.get(reverse("follow_index"))
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.follow_feed_texts(), ["пост"])
+        tables = ("users_follow", "users_profile", "users_suggestion", "posts_timelineentry")
+        self.assertEqual([query["sql"] for query in ctx.captured_queries
+                          if any(table in query["sql"] for table in tables)], [])
+
+    def test__crossing_fanout_limit_keeps_posts_in_feed(self):
+        from django.test import override_settings
+        from posts.models import TimelineEntry
+        other = User.objects.create_user(username="drugoy", password="loshik123")
+        with override_settings(TIMELINE_FANOUT_LIMIT=2):
+            Follow.objects.create(user=self.user, author=self.author)
+            Post.objects.create(text="before", author=self.author)
+            # второй подписчик: автор выше порога, посты добираются при чтении
+            Follow.objects.create(user=other, author=self.author)
+            Post.objects.create(text="celebrity post", author=self.author)
+            self.assertEqual(TimelineEntry.objects.filter(user=self.user).count(), 1)
+            self.assertEqual(self.follow_feed_texts(), ["celebrity post", "before"])
+
+            # отписка опускает автора ниже порога: пропущенный пост доразложен
+            Follow.objects.filter(user=other, author=self.author).delete()
+            self.assertEqual(TimelineEntry.objects.filter(user=self.user).count(), 2)
+            self.assertEqual(self.follow_feed_texts(), ["celebrity post", "before"])
+
+
+@pytest.mark.django_db(transaction=True)
+class TestingCounters(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="yaloh", password="loshik123")
+        self.author = User.objects.create_user(username="loh", password="loshped123")
+
+    def assert_counts(self):
+        from users.models import Profile
+        author = Profile.objects.get(user=self.author)
+        user = Profile.objects.get(user=self.user)
+        self.assertEqual(author.posts_count, Post.objects.filter(author=self.author).count())
+        self.assertEqual(author.followers_count, Follow.objects.filter(author=self.author).count())
+        self.assertEqual(user.following_count, Follow.objects.filter(user=self.user).count())
+        for post in Post.objects.all():
+            self.assertEqual(post.comments_count, post.comments.count())
+
+    def test__counters_follow_writes(self):
+        post = Post.objects.create(text="post", author=self.author)
+        Post.objects.create(text="post 2", author=self.author)
+        comment = Comment.objects.create(post=post, author=self.user, text="comment")
+        Comment.objects.create(post=post, author=self.author, text="comment 2")
+        Follow.objects.create(user=self.user, author=self.author)
+        self.assert_counts()
+
+        comment.delete()
+        Follow.objects.all().delete()
+        Post.objects.filter(text="post 2").delete()
+        self.assert_counts()
+
+    def test__reconcile_fixes_drift(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from users.models import Profile
+        post = Post.objects.create(text="post", author=self.author)
+        Comment.objects.create(post=post, author=self.user, text="comment")
+        Follow.objects.create(user=self.user, author=self.author)
+        Post.objects.update(comments_count=42)
+        Profile.objects.update(posts_count=0, followers_count=7, following_count=7)
+        Profile.objects.filter(user=self.user).delete()
+        call_command("reconcile_counters", stdout=StringIO())
+        self.assert_counts()
+
+    def test__profile_and_post_pages_do_not_aggregate(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        post = Post.objects.create(text="post", author=self.author)
+        for url in (reverse("profile", args=(self.author.username,)),
+                    reverse("post", args=(self.author.username, post.id))):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertContains(response, "Записей: 1")
+            self.assertFalse(any("COUNT(" in q["sql"] for q in ctx.captured_queries))
+
+
+class TestingSingleFlight(TestCase):
+    def test__concurrent_misses_compute_once(self):
+        import threading
+        import time
+        from django.core.cache import cache
+        from posts.cache import single_flight
+        cache.delete("single_flight_test")
+        calls = []
+
+        def build():
+            calls.append(1)
+            time.sleep(0.2)
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(single_flight("single_flight_test", build, 60)))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["value"] * 8)
+        self.assertEqual(len(calls), 1)
+
+
+@pytest.mark.django_db(transaction=True)
+class TestingIdentityMap(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="yaloh", password="loshik123")
+        self.post = Post.objects.create(text="post", author=self.user)
+        self.client.login(username="yaloh", password="loshik123")
+
+    def user_queries(self, method, url, data=None):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            getattr(self.client, method)(url, data or {})
+        return [q["sql"] for q in ctx.captured_queries if 'FROM "auth_user"' in q["sql"]]
+
+    def test__own_pages_load_user_once(self):
+        urls = [
+            ("get", reverse("profile", args=(self.user.username,))),
+            ("get", reverse("post", args=(self.user.username, self.post.id))),
+            ("get", reverse("post_edit", args=(self.user.username, self.post.id))),
+            ("post", reverse("add_comment", args=(self.user.username, self.post.id)), {"text": "comment"}),
+        ]
+        for method, url, *data in urls:
+            with self.subTest(url=url):
+                # после первого запроса пользователь сессии приходит из кеша (yatube.auth)
+                self.assertLessEqual(len(self.user_queries(method, url, *data)), 1)
+
+    def test__new_post_does_not_scan_users(self):
+        for sql in self.user_queries("get", reverse("new_post")):
+            self.assertIn("WHERE", sql)
+
+
+@pytest.mark.django_db(transaction=True)
+class TestingSearch(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="yaloh", password="loshik123")
+        self.group = Group.objects.create(slug="cats")
+
+    def found(self, query, **params):
+        response = self.client.get(reverse("search"), {"q": query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [post.text for post in response.context["page"]]
+
+    def test__stemmed_match_filters_and_sync(self):
+        post = Post.objects.create(text="Кошки любят молоко", author=self.user, group=self.group)
+        Post.objects.create(text="Собака спит", author=self.user)
+        self.assertEqual(self.found("кошка"), ["Кошки любят молоко"])
+        self.assertEqual(self.found("молоком", group="cats"), ["Кошки любят молоко"])
+        self.assertEqual(self.found("спит", group="cats"), [])
+
+        post.text = "Коты любят рыбу"
+        post.save()
+        self.assertEqual(self.found("молоко"), [])
+        self.assertEqual(self.found("рыба"), ["Коты любят рыбу"])
+        post.delete()
+        self.assertEqual(self.found("рыба"), [])
+
+    def test__ranked_cursor_pages(self):
+        for i in range(15):
+            Post.objects.create(text="кот " * (i + 1) + f"номер{i}", author=self.user)
+        response = self.client.get(reverse("search"), {"q": "кот"})
+        first = response.context["page"]
+        self.assertEqual(len(first), 10)
+        second = self.client.get(reverse("search"), {"q": "кот", "cursor": first.next_cursor}).context["page"]
+        self.assertEqual(len(second), 5)
+        ids = [post.id for post in first] + [post.id for post in second]
+        self.assertEqual(sorted(ids), sorted(Post.objects.values_list("id", flat=True)))
+
+    def test__unknown_database_vendor_is_refused(self):
+        from unittest import mock
+        from django.core.exceptions import ImproperlyConfigured
+        from django.test import override_settings
+        from posts import search
+        with mock.patch.object(search.connection, "vendor", "mysql"):
+            with self.assertRaises(ImproperlyConfigured):
+                search.get_backend()
+            with override_settings(POSTS_SEARCH_BACKEND="posts.search.SqliteBackend"):
+                self.assertIsInstance(search.get_backend(), search.SqliteBackend)
+
+    def test__admin_search_uses_index(self):
+        from django.contrib.admin.sites import site
+        Post.objects.create(text="Кошки любят молоко", author=self.user)
+        Post.objects.create(text="Собака спит", author=self.user)
+        queryset, _ = site._registry[Post].get_search_results(None, Post.objects.all(), "кошками")
+        self.assertEqual([post.text for post in queryset], ["Кошки любят молоко"])
+
+
+@pytest.mark.django_db(transaction=True)
+class TestingImagePipeline(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        self.media = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media.name)
+        self.settings_override.enable()
+        self.client = Client()
+        self.user = User.objects.create_user(username="yaloh", password="loshik123")
+        self.client.login(username="yaloh", password="loshik123")
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media.cleanup()
+
+    def upload(self, color="red"):
+        import io
+        from PIL import Image
+        image = Image.new("RGB", (1200, 800), color)
+        exif = Image.Exif()
+        exif[0x010F] = "Camera maker"
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", exif=exif)
+        return SimpleUploadedFile("photo.jpg", buffer.getvalue(), content_type="image/jpeg")
+
+    def new_post(self):
+        self.client.post(reverse("new_post"), {"text": "with image", "image": self.upload()})
+        return Post.objects.get(text="with image")
+
+    def media_path(self, url):
+        import os
+        return os.path.join(self.media.name, url[len("/media/"):])
+
+    def test__renditions_are_built_without_metadata(self):
+        from django.test import override_settings
+        from PIL import Image
+        with override_settings(TASKS_EAGER=True):
+            post = self.new_post()
+        post.refresh_from_db()
+        card = post.renditions["card"]
+        self.assertRegex(card["jpeg"], r"^/media/renditions/%s/card-[0-9a-f]{12}\.jpeg$" % post.id)
+        with Image.open(self.media_path(card["jpeg"])) as rendition:
+            self.assertEqual(rendition.size, (960, 339))
+            self.assertEqual(len(rendition.getexif()), 0)
+        self.assertContains(self.client.get(reverse("index")), card["jpeg"])
+
+    def test__new_image_gets_new_urls_and_old_files_go(self):
+        import os
+        from django.test import override_settings
+        with override_settings(TASKS_EAGER=True):
+            post = self.new_post()
+            post.refresh_from_db()
+            old = post.renditions
+            self.client.post(reverse("post_edit", args=("yaloh", post.id)),
+                             {"text": "with image", "image": self.upload("blue")})
+            post.refresh_from_db()
+        self.assertNotEqual(post.renditions["card"]["jpeg"], old["card"]["jpeg"])
+        self.assertTrue(os.path.exists(self.media_path(post.renditions["card"]["jpeg"])))
+        self.assertFalse(os.path.exists(self.media_path(old["card"]["jpeg"])))
+
+        post_dir = os.path.join(self.media.name, "renditions", str(post.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertEqual(os.listdir(post_dir), [])
+
+    def test__placeholder_until_ready(self):
+        from django.test import override_settings
+        from tasks import queue
+        from tasks.models import Task
+        # без воркера нарезка гарантированно ещё не готова
+        with override_settings(TASKS_EAGER=False):
+            post = self.new_post()
+        task = Task.objects.get(name="posts.tasks.build_renditions")
+        self.assertEqual(task.key, "image:%s:%s" % (post.id, post.image.name))
+        post.refresh_from_db()
+        self.assertEqual(post.renditions, {})
+        self.assertContains(self.client.get(reverse("index")), "data:image/svg+xml")
+
+        # заодно выполнится и разнос поста по лентам
+        self.assertEqual(queue.run_batch()[1], 0)
+        post.refresh_from_db()
+        self.assertContains(self.client.get(reverse("index")), post.renditions["card"]["jpeg"])
+
+
+@pytest.mark.django_db(transaction=True)
+class TestingQueryPlans(TestCase):
+    """
+    EXPLAIN QUERY PLAN для каждого запроса горячих страниц: ни полного
+    прохода по таблицам приложений, ни сортировки во временном B-дереве.
+    """
+    TABLES = ("posts_post", "posts_comment", "posts_timelineentry", "users_follow", "users_profile")
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client = Client()
+        self.users = [
+            User.objects.create_user(username=f"user{i}", password="loshik123") for i in range(5)
+        ]
+        self.groups = [Group.objects.create(slug=f"group{i}", description="") for i in range(3)]
+        for user in self.users:
+            for author in self.users:
+                if user != author:
+                    Follow.objects.create(user=user, author=author)
+        for i in range(40):
+            post = Post.objects.create(
+                text=f"post {i}", author=self.users[i % 5], group=self.groups[i % 3] if i % 4 else None
+            )
+            Comment.objects.create(post=post, author=self.users[(i + 1) % 5], text="comment")
+        self.client.login(username="user0", password="loshik123")
+
+    def plans(self, method, url, data=None):
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, data or {})
+        self.assertLess(response.status_code, 400)
+        with connection.cursor() as cursor:
+            for query in ctx.captured_queries:
+                sql = query["sql"]
+                if not sql.startswith("SELECT") or not any(table in sql for table in self.TABLES):
+                    continue
+                cursor.execute("EXPLAIN QUERY PLAN " + sql)
+                yield sql, [row[-1] for row in cursor.fetchall()]
+
+    def assert_indexed(self, method, url, data=None):
+        for sql, plan in self.plans(method, url, data):
+            for step in plan:
+                with self.subTest(url=url, sql=sql, step=step):
+                    self.assertNotIn("TEMP B-TREE", step)
+                    if step.startswith("SCAN") and "USING" not in step:
+                        self.assertFalse(any(f"SCAN {table}" in step for table in self.TABLES))
+
+    def test__feeds_use_indexes(self):
+        author = self.users[1]
+        post = Post.objects.filter(author=author).first()
+        self.assert_indexed("get", reverse("index"))
+        self.assert_indexed("get", reverse("group", args=(self.groups[0].slug,)))
+        self.assert_indexed("get", reverse("profile", args=(author.username,)))
+        self.assert_indexed("get", reverse("post", args=(author.username, post.id)))
+        self.assert_indexed("get", reverse("post", args=(author.username, post.id)), {"order": "new"})
+        self.assert_indexed("get", reverse("follow_index"))
+
+    def test__deep_pages_use_indexes(self):
+        page = self.client.get(reverse("index")).context["page"]
+        self.assert_indexed("get", reverse("index"), {"cursor": page.next_cursor})
+        page = self.client.get(reverse("follow_index")).context["page"]
+        self.assert_indexed("get", reverse("follow_index"), {"cursor": page.next_cursor})
+
+    def test__writes_use_indexes(self):
+        author = self.users[1]
+        post = Post.objects.filter(author=author).first()
+        self.assert_indexed("post", reverse("add_comment", args=(author.username, post.id)), {"text": "new"})
+        self.assert_indexed("get", reverse("profile_unfollow", args=(author.username,)))
+        self.assert_indexed("get", reverse("profile_follow", args=(author.username,)))
+        self.assert_indexed("post", reverse("new_post"), {"text": "new post"})
+
+
+class TestingBenchmark(TestCase):
+    def setUp(self):
+        import random
+        from django.core.cache import cache
+        from posts import benchmark
+        cache.clear()
+        self.rng = random.Random(1)
+        self.dataset = benchmark.seed(users=6, posts=40, groups=2, follows=15, comments=30, rng=self.rng)
+
+    def test__seed_keeps_derived_data_consistent(self):
+        from posts.models import TimelineEntry
+        from users.models import Profile
+        self.assertEqual(Post.objects.count(), 40)
+        self.assertEqual(Profile.objects.count(), 6)
+        post = Post.objects.order_by("-comments_count").first()
+        self.assertEqual(post.comments_count, post.comments.count())
+        self.assertTrue(TimelineEntry.objects.exists())
+
+    def test__synthetic_run_reports_every_endpoint(self):
+        from posts import benchmark
+        entries = benchmark.synthetic(self.dataset, benchmark.DEFAULT_MIX, 120, self.rng)
+        report = benchmark.run(entries)
+        self.assertEqual(report["total"]["requests"], 120)
+        self.assertEqual(report["total"]["errors"], 0)
+        self.assertEqual(set(report["endpoints"]), set(benchmark.DEFAULT_MIX))
+        self.assertEqual(report["endpoints"]["comment"]["statuses"], {"302": report["endpoints"]["comment"]["requests"]})
+        self.assertGreater(report["endpoints"]["follow"]["queries"]["mean"], 0)
+
+    def test__percentile_is_nearest_rank(self):
+        from posts.benchmark import percentile
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertIsNone(percentile([], 50))
+
+
+class TestingMetrics(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from yatube.metrics import registry
+        cache.clear()
+        registry.reset()
+        self.client = Client()
+        self.user = User.objects.create_user(username="yaloh", password="loshik123")
+        Post.objects.create(text="first post", author=self.user)
+
+    def test__metrics_require_token_or_staff(self):
+        from django.test import override_settings
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        with override_settings(METRICS_TOKEN="secret"):
+            response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer nope").status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 200)
+
+    def test__request_is_measured_per_view(self):
+        from yatube.metrics import registry
+        self.client.get(reverse("index"))
+        self.client.get(reverse("index"))
+        self.assertEqual(registry.duration.series[("index", "GET", "2xx")][2], 2)
+        self.assertEqual(registry.template_time.series[("index",)][2], 2)
+        # первый раз лента строится из базы, второй - целиком из кеша
+        counts, total, _ = registry.queries.series[("index",)]
+        self.assertGreater(total, 0)
+        self.assertEqual(counts[0], 1)
+        self.assertGreater(registry.cache.series[("index", "hit")], 0)
+        self.assertGreater(registry.cache.series[("index", "miss")], 0)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        body = self.client.get(reverse("metrics")).content.decode()
+        self.assertIn('yatube_request_duration_seconds_count{view="index",method="GET",status="2xx"} 2', body)
+        self.assertIn('yatube_db_queries_per_request_bucket{view="index",le="+Inf"} 2', body)
+
+    def test__slow_requests_are_traced(self):
+        from django.test import override_settings
+        with override_settings(METRICS_SLOW_REQUEST_MS=0):
+            with self.assertLogs("yatube.metrics", "WARNING") as logs:
+                Client().get(reverse("profile", args=(self.user.username,)))
+        self.assertIn("Медленный запрос GET /yaloh/ (profile, 200)", logs.output[0])
+        self.assertIn("SELECT", logs.output[0])
+
+
+class TestingBulkTransfer(TestCase):
+    def setUp(self):
+        import datetime
+        from django.core.cache import cache
+        from django.utils import timezone
+        cache.clear()
+        self.author = User.objects.create_user(username="loh", password="loshped123")
+        self.reader = User.objects.create_user(username="yaloh", password="loshik123")
+        self.group = Group.objects.create(title="Группа", slug="group", description="о группе")
+        self.date = timezone.now() - datetime.timedelta(days=400)
+        self.post = Post.objects.create(text="старый пост про котов", author=self.author, group=self.group)
+        Post.objects.filter(pk=self.post.pk).update(pub_date=self.date)
+        Comment.objects.create(post=self.post, author=self.reader, text="мяу")
+        Follow.objects.create(user=self.reader, author=self.author)
+
+    def export(self, command, *args):
+        from io import StringIO
+        from django.core.management import call_command
+        out = StringIO()
+        call_command(command, *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def load(self, command, data, *args, suffix=".jsonl"):
+        import os
+        import tempfile
+        from io import StringIO
+        from django.core.management import call_command
+        with tempfile.NamedTemporaryFile("w", suffix=suffix, delete=False, encoding="utf-8") as source:
+            source.write(data)
+        self.addCleanup(os.unlink, source.name)
+        call_command(command, *args, source.name, stdout=StringIO(), stderr=StringIO())
+
+    def test__roundtrip_keeps_ids_dates_and_derived_data(self):
+        from posts import search
+        from posts.models import TimelineEntry
+        from users.models import Profile
+        groups = self.export("export_posts", "groups")
+        posts = self.export("export_posts", "posts", "--format", "csv")
+        comments = self.export("export_posts", "comments")
+        follows = self.export("export_follows")
+        Post.objects.all().delete()
+        Group.objects.all().delete()
+        Follow.objects.all().delete()
+        User.objects.filter(username="yaloh").delete()
+
+        self.load("import_posts", groups, "groups")
+        self.load("import_posts", posts, "posts", suffix=".csv")
+        self.load("import_follows", follows, "--create-users")
+        self.load("import_posts", comments, "comments")
+
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.pub_date, self.date)
+        self.assertEqual(post.group.slug, "group")
+        self.assertEqual(post.comments_count, 1)
+        reader = User.objects.get(username="yaloh")
+        self.assertEqual(Profile.objects.get(user=reader).following_count, 1)
+        self.assertEqual(Profile.objects.get(user=self.author).posts_count, 1)
+        self.assertTrue(TimelineEntry.objects.filter(user=reader, post=post).exists())
+        self.assertEqual(list(search.get_backend().filter(Post.objects.all(), "коты")), [post])
+        self.assertContains(self.client.get(reverse("index")), "старый пост про котов")
+
+    def test__bad_rows_are_skipped_and_reimport_is_idempotent(self):
+        posts = self.export("export_posts", "posts")
+        self.load("import_posts", posts, "posts")
+        self.assertEqual(Post.objects.count(), 1)
+        self.load("import_posts", '{"post": 999, "author": "yaloh", "text": "x"}\n'
+                                  '{"post": %s, "author": "nobody", "text": "x"}\n'
+                                  '{"post": %s, "author": "yaloh", "text": "ok"}\n' % (self.post.pk, self.post.pk),
+                  "comments")
+        self.assertEqual(list(Comment.objects.order_by("id").values_list("text", flat=True)), ["мяу", "ok"])
+        self.assertEqual(Post.objects.get(pk=self.post.pk).comments_count, 2)
+
+    def test__reimport_without_ids_adds_nothing(self):
+        import json
+        posts = [json.loads(line) for line in self.export("export_posts", "posts").splitlines()]
+        comments = [json.loads(line) for line in self.export("export_posts", "comments").splitlines()]
+        for row in posts + comments:
+            row.pop("id")
+        new_post = dict(posts[0], text="пост из файла")
+        data = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in posts + [new_post, new_post])
+        for _ in range(2):
+            self.load("import_posts", data, "posts")
+            self.assertEqual(Post.objects.count(), 2)
+        data = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in comments)
+        self.load("import_posts", data, "comments")
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).comments_count, 1)
+
+
+class TestingAsyncViews(TransactionTestCase):
+    # пул потоков async-view ходит в базу своими соединениями, им нужны закоммиченные данные
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(username="yaloh", password="loshik123")
+        self.author = User.objects.create_user(username="loh", password="loshped123")
+        self.group = Group.objects.create(title="Группа", slug="group", description="")
+        Follow.objects.create(user=self.user, author=self.author)
+        self.post = Post.objects.create(text="асинхронный пост", author=self.author, group=self.group)
+
+    def call(self, view, path, *args, user=None):
+        from asgiref.sync import async_to_sync
+        from django.contrib.auth.models import AnonymousUser
+        from django.test import AsyncRequestFactory
+        request = AsyncRequestFactory().get(path)
+        request.user = user or AnonymousUser()
+        return async_to_sync(view)(request, *args)
+
+    def test__feeds_render_like_sync_views(self):
+        from posts import async_views
+        for response in (
+            self.call(async_views.index, "/"),
+            self.call(async_views.group_posts, "/group/group", "group"),
+            self.call(async_views.profile, "/loh/", "loh"),
+            self.call(async_views.post_view, f"/loh/{self.post.id}/", "loh", self.post.id),
+            self.call(async_views.follow_index, "/follow/", user=self.user),
+        ):
+            self.assertContains(response, "асинхронный пост")
+
+    def test__follow_index_shows_suggestions(self):
+        from posts import async_views
+        from users import graph
+        friend = User.objects.create_user(username="drug", password="loshik123")
+        Follow.objects.create(user=self.author, author=friend)
+        graph.build_suggestions()
+        response = self.call(async_views.follow_index, "/follow/", user=self.user)
+        self.assertContains(response, "@drug")
+
+    def test__errors_and_login(self):
+        from django.http import Http404
+        from posts import async_views
+        with self.assertRaises(Http404):
+            self.call(async_views.post_view, f"/yaloh/{self.post.id}/", "yaloh", self.post.id)
+        response = self.call(async_views.follow_index, "/follow/")
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith("/auth/login/"))
+
+
+class TestingJsonApi(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username="yaloh", password="loshik123")
+        self.author = User.objects.create_user(username="loh", password="loshped123")
+        self.group = Group.objects.create(title="Группа", slug="group", description="")
+        Follow.objects.create(user=self.user, author=self.author)
+        self.post = Post.objects.create(text="пост для api", author=self.author, group=self.group)
+
+    def test__feeds_and_fields(self):
+        for url in ("/api/posts/", "/api/groups/group/posts/", "/api/users/loh/posts/"):
+            data = self.client.get(url).json()
+            self.assertEqual(data["results"][0]["text"], "пост для api")
+            self.assertEqual(data["results"][0]["group"], "group")
+            self.assertIn("next_cursor", data)
+        data = self.client.get("/api/posts/", {"fields": "id,author"}).json()
+        self.assertEqual(data["results"], [{"id": self.post.id, "author": "loh"}])
+        self.assertEqual(self.client.get("/api/posts/", {"fields": "id,password"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/groups/nope/posts/").status_code, 404)
+
+    def test__follow_feed_needs_login(self):
+        self.assertEqual(self.client.get("/api/follow/").status_code, 401)
+        self.client.login(username="yaloh", password="loshik123")
+        response = self.client.get("/api/follow/")
+        self.assertEqual(response.json()["results"][0]["id"], self.post.id)
+        self.assertIn("private", response["Cache-Control"])
+
+    def test__not_modified_without_queries(self):
+        response = self.client.get("/api/posts/")
+        etag = response["ETag"]
+        # по секундам две правки подряд не различить - только ETag
+        self.assertNotIn("Last-Modified", response)
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/posts/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # другой набор полей - другое представление
+        self.assertEqual(self.client.get("/api/posts/", {"fields": "id"}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        Comment.objects.create(post=self.post, author=self.user, text="новый комментарий")
+        response = self.client.get("/api/posts/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][0]["comments_count"], 1)
+
+    def test__post_detail(self):
+        url = f"/api/posts/{self.post.id}/"
+        response = self.client.get(url)
+        self.assertEqual(response.json()["comments"]["results"], [])
+        etag = response["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.post.text = "исправленный пост"
+        self.post.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["text"], "исправленный пост")
+        self.assertEqual(self.client.get("/api/posts/999999/").status_code, 404)
+
+    def test__missing_posts_leave_no_cache_keys(self):
+        from django.core.cache import cache
+        from posts import cache as feed_cache
+        for url in ("/api/posts/999999/", "/api/posts/999999/comments/"):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(cache.get_many([feed_cache._version_key(namespace)
+                                         for namespace in ("post:999999", "comments:999999")]), {})
+
+
+class TestingCommentPages(TestCase):
+    def setUp(self):
+        import datetime
+        from django.core.cache import cache
+        from django.utils import timezone
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username="loh", password="loshped123")
+        self.readers = [User.objects.create_user(username=f"reader{i}", password="loshik123") for i in range(5)]
+        self.post = Post.objects.create(text="популярный пост", author=self.author)
+        started = timezone.now() - datetime.timedelta(days=1)
+        for i in range(25):
+            comment = Comment.objects.create(post=self.post, author=self.readers[i % 5], text=f"комментарий {i}")
+            Comment.objects.filter(pk=comment.pk).update(created=started + datetime.timedelta(minutes=i))
+        cache.clear()
+        self.url = reverse("post", args=("loh", self.post.id))
+
+    def texts(self, items):
+        return [item.text for item in items]
+
+    def test__first_page_and_load_more(self):
+        from django.core.cache import cache
+        response = self.client.get(self.url)
+        items = response.context["items"]
+        self.assertEqual(self.texts(items), [f"комментарий {i}" for i in range(20)])
+        self.assertContains(response, "Показать ещё")
+        cache.clear()
+        # авторы приходят вместе с комментариями: запросов не больше, чем при одном комментарии
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("post_comments", args=("loh", self.post.id)),
+                                       {"comments": items.next_cursor})
+        self.assertEqual(self.texts(response.context["items"]), [f"комментарий {i}" for i in range(20, 25)])
+        self.assertNotContains(response, "Показать ещё")
+        self.assertNotContains(response, "<html")
+
+    def test__newest_first(self):
+        items = self.client.get(self.url, {"order": "new"}).context["items"]
+        self.assertEqual(self.texts(items), [f"комментарий {i}" for i in range(24, 4, -1)])
+        items = self.client.get(self.url, {"order": "new", "comments": items.next_cursor}).context["items"]
+        self.assertEqual(self.texts(items), [f"комментарий {i}" for i in range(4, -1, -1)])
+
+    def test__new_comment_shows_up(self):
+        self.client.get(self.url, {"order": "new"})
+        Comment.objects.create(post=self.post, author=self.author, text="свежий")
+        items = self.client.get(self.url, {"order": "new"}).context["items"]
+        self.assertEqual(items[0].text, "свежий")
+
+    def test__json_pages(self):
+        data = self.client.get(f"/api/posts/{self.post.id}/").json()["comments"]
+        self.assertEqual(len(data["results"]), 20)
+        data = self.client.get(f"/api/posts/{self.post.id}/comments/", {"cursor": data["next_cursor"]}).json()
+        self.assertEqual([item["text"] for item in data["results"]], [f"комментарий {i}" for i in range(20, 25)])
+        self.assertIsNone(data["next_cursor"])
+        self.assertEqual(self.client.get("/api/posts/999999/comments/").status_code, 404)
+
+
+class TestingReplicaRouting(TestCase):
+    def setUp(self):
+        from django.test import RequestFactory
+        self.factory = RequestFactory()
+
+    def route(self, request, view_func, write=False):
+        from django.contrib.sessions.models import Session
+        from django.http import HttpResponse
+        from yatube.db_router import ReplicaMiddleware, ReplicaRouter, reads_from_replica
+        router = ReplicaRouter()
+        seen = {}
+
+        def get_response(request):
+            middleware.process_view(request, view_func, (), {})
+            seen["replica"] = reads_from_replica()
+            seen["read"] = router.db_for_read(Post)
+            seen["session"] = router.db_for_read(Session)
+            if write:
+                seen["write"] = router.db_for_write(Comment)
+                seen["after_write"] = router.db_for_read(Post)
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(get_response)
+        response = middleware(request)
+        return seen, response
+
+    def test__reads_and_writes(self):
+        from django.test import override_settings
+        from posts import views
+        with override_settings(DB_REPLICAS=["replica1"]):
+            seen, response = self.route(self.factory.get("/"), views.index)
+            self.assertEqual(seen["read"], "replica1")
+            self.assertTrue(seen["replica"])
+            self.assertEqual(seen["session"], "default")
+            self.assertNotIn("db_primary_until", response.cookies)
+
+            seen, _ = self.route(self.factory.get("/new/"), views.new_post)
+            self.assertEqual(seen["read"], "default")
+            seen, _ = self.route(self.factory.post("/"), views.index)
+            self.assertEqual(seen["read"], "default")
+
+            seen, response = self.route(self.factory.get("/loh/follow/"), views.profile_follow, write=True)
+            self.assertEqual((seen["write"], seen["after_write"]), ("default", "default"))
+            cookie = response.cookies["db_primary_until"]
+
+            # автор какое-то время читает свои записи из основной базы
+            request = self.factory.get("/")
+            request.COOKIES["db_primary_until"] = cookie.value
+            seen, _ = self.route(request, views.index)
+            self.assertEqual(seen["read"], "default")
+            request.COOKIES["db_primary_until"] = "0"
+            seen, _ = self.route(request, views.index)
+            self.assertEqual(seen["read"], "replica1")
+
+    def test__without_replicas_everything_is_primary(self):
+        from posts import views
+        seen, response = self.route(self.factory.get("/"), views.index, write=True)
+        self.assertEqual((seen["read"], seen["write"]), ("default", "default"))
+        self.assertFalse(seen["replica"])
+        self.assertNotIn("db_primary_until", response.cookies)
+
+    def test__replica_reads_are_cached_briefly(self):
+        from unittest import mock
+        from django.test import override_settings
+        from posts import cache as feed_cache
+        with override_settings(FEED_CACHE_TIMEOUT=3600, DB_REPLICA_STICKY_SECONDS=5):
+            self.assertEqual(feed_cache.timeout(), 3600)
+            with mock.patch("yatube.db_router.reads_from_replica", return_value=True):
+                self.assertEqual(feed_cache.timeout(), 5)
+
+
+class TestingTaskQueue(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username="yaloh", password="loshik123", email="yaloh@example.com")
+        self.author = User.objects.create_user(username="loh", password="loshped123", email="loh@example.com")
+
+    def run_worker(self):
+        from io import StringIO
+        from django.core.management import call_command
+        call_command("run_tasks", "--once", stderr=StringIO())
+
+    def test__requests_enqueue_and_worker_runs(self):
+        from django.core import mail
+        from django.test import override_settings
+        from posts.models import TimelineEntry
+        from tasks.models import Task
+        with override_settings(TASKS_EAGER=False):
+            self.client.login(username="yaloh", password="loshik123")
+            self.client.get(reverse("profile_follow", args=("loh",)))
+            self.client.login(username="loh", password="loshped123")
+            self.client.post(reverse("new_post"), {"text": "пост для подписчиков"})
+            post = Post.objects.get(text="пост для подписчиков")
+            self.client.login(username="yaloh", password="loshik123")
+            self.client.post(reverse("add_comment", args=("loh", post.id)), {"text": "отличный пост"})
+            # запросы только поставили задачи
+            self.assertEqual(set(Task.objects.values_list("name", flat=True)), {
+                "posts.tasks.backfill", "posts.tasks.notify_follow", "posts.tasks.fan_out",
+                "posts.tasks.notify_comment", "posts.tasks.prune_activity",
+            })
+            self.assertFalse(TimelineEntry.objects.exists())
+            self.assertEqual(len(mail.outbox), 0)
+            self.run_worker()
+        self.assertEqual(set(Task.objects.values_list("status", flat=True)), {Task.DONE})
+        self.assertTrue(TimelineEntry.objects.filter(user=self.user, post=post).exists())
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ["loh@example.com", "loh@example.com"])
+        response = self.client.get(reverse("follow_index"))
+        self.assertContains(response, "пост для подписчиков")
+
+    def test__failing_eager_task_keeps_caller_transaction(self):
+        from django.db import transaction
+        from django.test import override_settings
+        from tasks import queue
+
+        @queue.task(name="tests.broken_insert")
+        def broken_insert():
+            Group.objects.create(title="дубль", slug="twice")
+            Group.objects.create(title="дубль", slug="twice")
+
+        with override_settings(TASKS_EAGER=True), transaction.atomic():
+            Post.objects.create(text="до задачи", author=self.user)
+            with self.assertLogs("tasks.queue", "ERROR"):
+                broken_insert.enqueue()
+            Post.objects.create(text="после задачи", author=self.user)
+        self.assertEqual(Post.objects.filter(text__in=["до задачи", "после задачи"]).count(), 2)
+        self.assertFalse(Group.objects.filter(slug="twice").exists())
+
+    def test__worker_purges_old_done_and_failed_tasks(self):
+        import datetime
+        from unittest import mock
+        from django.test import override_settings
+        from django.utils import timezone
+        from posts import tasks
+        from tasks import queue
+        from tasks.models import Task
+        old = timezone.now() - datetime.timedelta(days=60)
+        Task.objects.create(name="posts.tasks.prune_activity", key="done", status=Task.DONE)
+        Task.objects.create(name="posts.tasks.prune_activity", key="failed", status=Task.FAILED)
+        Task.objects.create(name="posts.tasks.prune_activity", key="fresh-failed", status=Task.FAILED)
+        Task.objects.filter(key__in=["done", "failed"]).update(updated=old)
+        self.assertEqual(queue.purge(7 * 24 * 60 * 60, 30 * 24 * 60 * 60), 2)
+        self.assertEqual(list(Task.objects.values_list("key", flat=True)), ["fresh-failed"])
+        # ключ упавшей задачи снова свободен
+        with override_settings(TASKS_EAGER=False):
+            tasks.prune_activity.enqueue(key="failed")
+        self.assertTrue(Task.objects.filter(key="failed", status=Task.QUEUED).exists())
+
+        # чистка идёт и по ходу работы, а не только при старте
+        with override_settings(TASKS_PURGE_INTERVAL=0), \
+                mock.patch.object(queue, "purge", wraps=queue.purge) as purge:
+            self.run_worker()
+        self.assertEqual(purge.call_count, 2)
+
+    def test__idempotency_key(self):
+        from django.test import override_settings
+        from posts import tasks
+        from tasks.models import Task
+        with override_settings(TASKS_EAGER=False):
+            tasks.notify_follow.enqueue(self.user.id, self.author.id, key="follow-email:1:2")
+            tasks.notify_follow.enqueue(self.user.id, self.author.id, key="follow-email:1:2")
+        self.assertEqual(Task.objects.count(), 1)
+
+    def test__retries_then_fails(self):
+        from django.test import override_settings
+        from django.utils import timezone
+        from tasks import queue
+        from tasks.models import Task
+        calls = []
+
+        @queue.task(name="tests.flaky", max_attempts=2, retry_delay=30)
+        def flaky(value):
+            calls.append(value)
+            Task.objects.create(name="tests.side_effect")
+            raise RuntimeError("сбой")
+
+        with override_settings(TASKS_EAGER=False):
+            flaky.enqueue(7)
+        job = Task.objects.get(name="tests.flaky")
+        self.assertEqual(queue.run_batch(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Task.QUEUED, 1))
+        self.assertIn("RuntimeError", job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+        # работа упавшей задачи откатилась вместе с ней
+        self.assertFalse(Task.objects.filter(name="tests.side_effect").exists())
+        self.assertEqual(queue.run_batch(), (0, 0))
+        Task.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertEqual(queue.run_batch(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Task.FAILED, 2))
+        self.assertEqual(calls, [7, 7])
+
+    def test__abandoned_task_is_reclaimed(self):
+        import datetime
+        from django.utils import timezone
+        from tasks import queue
+        from tasks.models import Task
+        Task.objects.create(name="posts.tasks.fan_out", args=[0], status=Task.RUNNING, attempts=1,
+                            locked_until=timezone.now() - datetime.timedelta(seconds=1))
+        Task.objects.create(name="posts.tasks.fan_out", args=[0], status=Task.RUNNING, attempts=1,
+                            locked_until=timezone.now() + datetime.timedelta(minutes=5))
+        self.assertEqual(queue.run_batch(), (1, 0))
+
+
+class TestingAssets(TestCase):
+    def setUp(self):
+        import os
+        import shutil
+        import tempfile
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.source = os.path.join(self.root, "source")
+        self.static = os.path.join(self.root, "static")
+        self.media = os.path.join(self.root, "media")
+        os.makedirs(os.path.join(self.source, "css"))
+        os.makedirs(os.path.join(self.media, "posts"))
+        with open(os.path.join(self.source, "css", "site.css"), "w") as css:
+            css.write("body { color: black; }\n" * 100)
+        self.image = bytes(range(256)) * 40
+        with open(os.path.join(self.media, "posts", "cat.png"), "wb") as image:
+            image.write(self.image)
+
+    def settings(self):
+        from django.test import override_settings
+        return override_settings(
+            STATICFILES_DIRS=[self.source], STATIC_ROOT=self.static, MEDIA_ROOT=self.media, SERVE_ASSETS=True,
+            STATICFILES_STORAGE="yatube.assets.CompressedManifestStaticFilesStorage",
+        )
+
+    def get(self, path, **headers):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from yatube.assets import AssetMiddleware
+        middleware = AssetMiddleware(lambda request: HttpResponse("приложение"))
+        return middleware(RequestFactory().get(path, **headers))
+
+    def body(self, response):
+        return b"".join(response.streaming_content) if response.streaming else response.content
+
+    def test__collectstatic_hashes_and_compresses(self):
+        import gzip
+        import os
+        from io import StringIO
+        from django.contrib.staticfiles.storage import staticfiles_storage
+        from django.core.management import call_command
+        with self.settings():
+            call_command("collectstatic", "--noinput", stdout=StringIO())
+            hashed = staticfiles_storage.stored_name("css/site.css")
+            self.assertRegex(hashed, r"^css/site\.[0-9a-f]{12}\.css$")
+            with open(os.path.join(self.static, hashed + ".gz"), "rb") as compressed:
+                self.assertEqual(gzip.decompress(compressed.read()), b"body { color: black; }\n" * 100)
+
+            response = self.get("/static/" + hashed, HTTP_ACCEPT_ENCODING="gzip, deflate")
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+            self.assertEqual(response["Content-Type"], "text/css")
+            self.assertEqual(gzip.decompress(self.body(response)), b"body { color: black; }\n" * 100)
+            self.assertNotIn("Content-Encoding", self.get("/static/" + hashed))
+            # q=0 - кодировка явно запрещена, * - любая не названная
+            for header in ("gzip;q=0, deflate", "br;q=0, gzip; q=0", "*;q=0, identity"):
+                self.assertNotIn("Content-Encoding", self.get("/static/" + hashed, HTTP_ACCEPT_ENCODING=header))
+            self.assertEqual(self.get("/static/" + hashed, HTTP_ACCEPT_ENCODING="br;q=0, *")["Content-Encoding"],
+                             "gzip")
+            # без хеша в имени - короткий кеш
+            self.assertEqual(self.get("/static/css/site.css")["Cache-Control"], "public, max-age=60")
+
+    def test__hashed_renditions_are_immutable(self):
+        import os
+        from django.conf import settings
+        os.makedirs(os.path.join(self.media, "renditions", "7"))
+        for name in ("card-0123456789ab.jpeg", "card.jpeg"):
+            with open(os.path.join(self.media, "renditions", "7", name), "wb") as image:
+                image.write(self.image)
+        with self.settings():
+            self.assertIn("immutable", self.get("/media/renditions/7/card-0123456789ab.jpeg")["Cache-Control"])
+            self.assertNotIn("immutable", self.get("/media/renditions/7/card.jpeg")["Cache-Control"])
+            self.assertEqual(self.get("/media/posts/cat.png")["Cache-Control"],
+                             "public, max-age=%s" % settings.MEDIA_MAX_AGE)
+
+    def test__media_ranges_and_revalidation(self):
+        with self.settings():
+            response = self.get("/media/posts/cat.png")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.body(response), self.image)
+            self.assertEqual(response["Accept-Ranges"], "bytes")
+            etag = response["ETag"]
+            self.assertEqual(self.get("/media/posts/cat.png", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+            response = self.get("/media/posts/cat.png", HTTP_RANGE="bytes=100-199")
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response["Content-Range"], "bytes 100-199/%s" % len(self.image))
+            self.assertEqual(self.body(response), self.image[100:200])
+            response = self.get("/media/posts/cat.png", HTTP_RANGE="bytes=-10")
+            self.assertEqual(self.body(response), self.image[-10:])
+            response = self.get("/media/posts/cat.png", HTTP_RANGE="bytes=100-", HTTP_IF_RANGE='"stale"')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.get("/media/posts/cat.png", HTTP_RANGE="bytes=99999-").status_code, 416)
+
+            self.assertEqual(self.get("/media/../static/css/site.css").status_code, 404)
+            self.assertEqual(self.get("/media/posts/").status_code, 404)
+            self.assertEqual(self.body(self.get("/about/")), "приложение".encode())
+
+
+class TestingPostCards(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.author = User.objects.create_user(username="loh", password="loshped123")
+        self.posts = [Post.objects.create(text=f"карточка {i}", author=self.author) for i in range(3)]
+
+    def render(self):
+        from django.template import Context, Template
+        template = Template(
+            "{% load post_cards %}{% prefetch_cards posts %}"
+            "{% for post in posts %}{% card_cache post %}[{{ post.text }}]{% endcard_cache %}{% endfor %}"
+        )
+        return template.render(Context({"posts": self.posts}))
+
+    def test__cards_come_from_one_batch(self):
+        from unittest import mock
+        from django.core.cache import caches
+        cache = caches["default"]
+        self.assertEqual(self.render(), "[карточка 0][карточка 1][карточка 2]")
+        self.posts[0].text = "не видно, пока ключ тот же"
+        self.posts[1].comments_count = 5
+        self.posts[1].text = "новый комментарий"
+        spy = mock.Mock(wraps=cache)
+        with mock.patch("posts.templatetags.post_cards._cache", return_value=spy):
+            self.assertEqual(self.render(), "[карточка 0][новый комментарий][карточка 2]")
+        # одно чтение на страницу, по одному ключу в кеш не ходим
+        self.assertEqual(spy.get_many.call_count, 1)
+        self.assertEqual(spy.get.call_count, 0)
+
+    def test__feed_pages_render_cards(self):
+        response = Client().get(reverse("index"))
+        for post in self.posts:
+            self.assertContains(response, post.text)
+
+    def test__bench_templates_measures_each_feed(self):
+        import random
+        from posts import benchmark
+        from posts.management.commands.bench_templates import TEMPLATES, Command
+        benchmark.seed(users=6, posts=40, groups=2, follows=15, comments=30, rng=random.Random(1))
+        command = Command()
+        request = command.request()
+        contexts = command.contexts(request.user, 5)
+        backend = command.backend("cached")
+        for name in TEMPLATES:
+            self.assertEqual(len(command.measure(backend, name, contexts[name], request, "warm", 2)), 2)
+
+
+class TestingTrending(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.author = User.objects.create_user(username="loh", password="loshped123")
+        self.quiet = Group.objects.create(title="Тихая", slug="quiet")
+        self.busy = Group.objects.create(title="Шумная", slug="busy")
+
+    def ago(self, **delta):
+        import datetime
+        from django.utils import timezone
+        return timezone.now() - datetime.timedelta(**delta)
+
+    def backdate(self, model, instance, field, moment):
+        # auto_now_add не даёт задать время при создании; корзины пересчитываем так же, как после импорта
+        from posts import trending
+        model.objects.filter(pk=instance.pk).update(**{field: moment})
+        trending.rebuild()
+
+    def test__counts_follow_inserts_and_deletes(self):
+        from posts import trending
+        from posts.models import GroupActivity, PostActivity
+        post = Post.objects.create(text="обсуждают", author=self.author, group=self.busy)
+        Post.objects.create(text="ещё", author=self.author, group=self.busy)
+        Post.objects.create(text="тут тихо", author=self.author, group=self.quiet)
+        comments = [Comment.objects.create(post=post, author=self.author, text=str(i)) for i in range(3)]
+        self.assertEqual(GroupActivity.objects.get(group=self.busy).posts, 2)
+        self.assertEqual(GroupActivity.objects.get(group=self.busy).comments, 3)
+        self.assertEqual(PostActivity.objects.get(post=post).comments, 3)
+
+        comments[0].delete()
+        rows = trending._hot_groups("1h", 10)
+        self.assertEqual([(row["group"], row["posts"], row["comments"]) for row in rows],
+                         [(self.busy, 2, 2), (self.quiet, 1, 0)])
+        self.assertEqual(trending._hot_posts("1h", 10), [(post.id, 2)])
+
+        # пост ушёл в другую группу вместе со своими комментариями
+        post.group = self.quiet
+        post.save()
+        self.assertEqual([(row["group"], row["posts"], row["comments"]) for row in trending._hot_groups("1h", 10)],
+                         [(self.quiet, 2, 2), (self.busy, 1, 0)])
+        before = list(GroupActivity.objects.order_by("id").values_list("group", "posts", "comments"))
+        trending.rebuild()
+        self.assertEqual(list(GroupActivity.objects.order_by("group").values_list("group", "posts", "comments")),
+                         sorted(before))
+
+    def test__windows_slide_over_buckets(self):
+        from posts import trending
+        from posts.models import PostActivity
+        old = Post.objects.create(text="вчерашний", author=self.author, group=self.quiet)
+        fresh = Post.objects.create(text="сегодняшний", author=self.author, group=self.busy)
+        for _ in range(3):
+            self.backdate(Comment, Comment.objects.create(post=old, author=self.author), "created",
+                          self.ago(hours=5))
+        Comment.objects.create(post=fresh, author=self.author)
+        self.backdate(Post, old, "pub_date", self.ago(days=2))
+
+        self.assertEqual(trending._hot_posts("1h", 10), [(fresh.id, 1)])
+        self.assertEqual(trending._hot_posts("24h", 10), [(old.id, 3), (fresh.id, 1)])
+        self.assertEqual([row["group"] for row in trending._hot_groups("24h", 10)], [self.quiet, self.busy])
+        self.assertEqual(trending._hot_groups("7d", 10)[0]["posts"], 1)
+        # страница читает корзины, а не посты с комментариями
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            trending._hot_posts("7d", 10)
+        self.assertIn("posts_postactivity", ctx.captured_queries[0]["sql"])
+        self.assertNotIn("posts_comment", ctx.captured_queries[0]["sql"])
+
+        PostActivity.objects.create(post=old, bucket=trending.bucket_of(self.ago(days=9)), comments=7)
+        trending.prune()
+        self.assertFalse(PostActivity.objects.filter(comments=7).exists())
+
+    def test__pages(self):
+        post = Post.objects.create(text="горячий пост", author=self.author, group=self.busy)
+        Comment.objects.create(post=post, author=self.author, text="первый")
+        response = Client().get(reverse("trending"), {"window": "1h"})
+        self.assertContains(response, "Шумная")
+        self.assertContains(response, "горячий пост")
+        self.assertEqual(Client().get(reverse("trending"), {"window": "year"}).context["window"], "24h")
+
+        data = Client().get(reverse("api_trending"), {"window": "7d", "fields": "id"}).json()
+        self.assertEqual(data["groups"], [{"slug": "busy", "title": "Шумная", "posts": 1, "comments": 1}])
+        self.assertEqual(data["posts"], [{"id": post.id, "window_comments": 1}])
+        self.assertEqual(Client().get(reverse("api_trending"), {"window": "year"}).status_code, 400)
+
+
+class TestingAuthFastPath(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(username="yaloh", password="loshik123")
+
+    def auth_queries(self, client):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(client.get(reverse("index")).status_code, 200)
+        return [query["sql"] for query in ctx.captured_queries
+                if "django_session" in query["sql"] or '"auth_user"' in query["sql"]]
+
+    def test__anonymous_index_skips_session_and_user(self):
+        self.assertEqual(self.auth_queries(Client()), [])
+
+    def test__logged_in_user_comes_from_cache(self):
+        from django.test import override_settings
+        with override_settings(SESSION_ENGINE="django.contrib.sessions.backends.cached_db"):
+            client = Client()
+            client.login(username="yaloh", password="loshik123")
+            self.auth_queries(client)
+            self.assertEqual(self.auth_queries(client), [])
+            self.assertContains(client.get(reverse("index")), "yaloh")
+
+            # смена пароля сбрасывает кеш и разлогинивает старую сессию
+            self.user.set_password("new-password")
+            self.user.save()
+            self.assertTrue(any('"auth_user"' in sql for sql in self.auth_queries(client)))
+            self.assertNotContains(client.get(reverse("index")), "Пользователь: yaloh")
+
+    def test__signed_cookie_sessions(self):
+        from django.test import override_settings
+        with override_settings(SESSION_ENGINE="django.contrib.sessions.backends.signed_cookies"):
+            client = Client()
+            self.assertTrue(client.login(username="yaloh", password="loshik123"))
+            self.auth_queries(client)
+            self.assertEqual(self.auth_queries(client), [])
+            self.assertContains(client.get(reverse("index")), "Пользователь: yaloh")
+            self.assertEqual(client.get(reverse("follow_index")).status_code, 200)
+
+    def test__sessions_from_plain_model_backend_survive(self):
+        from django.contrib.auth import BACKEND_SESSION_KEY
+        client = Client()
+        client.force_login(self.user, backend="django.contrib.auth.backends.ModelBackend")
+        self.assertEqual(client.session[BACKEND_SESSION_KEY], "django.contrib.auth.backends.ModelBackend")
+        self.assertContains(client.get(reverse("index")), "Пользователь: yaloh")
+        self.assertFalse(Client().login(username="yaloh", password="wrong"))
+
+    def test__bench_sessions_measures_auth_queries(self):
+        from django.core.management import CommandError, call_command
+        from posts import benchmark
+        from posts.management.commands.bench_sessions import Command
+        benchmark.seed(users=4, posts=20, groups=2, follows=6, comments=10)
+        command = Command()
+        result = command.measure(command.client(User.objects.get(username="bench_0")), reverse("index"), 2)
+        self.assertEqual(result["status"], 200)
+        self.assertEqual((result["session_queries"], result["user_queries"]), (1, 0))
+        result = command.measure(command.client(None), reverse("index"), 2)
+        self.assertEqual((result["session_queries"], result["user_queries"]), (0, 0))
+        with self.assertRaises(CommandError):
+            call_command("bench_sessions", "--engines", "file")
+
+
+class TestingFollowGraph(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.users = {name: User.objects.create_user(username=name, password="pass12345") for name in "abcde"}
+        self.client = Client()
+        self.client.login(username="a", password="pass12345")
+
+    def follow(self, user, author):
+        Follow.objects.create(user=self.users[user], author=self.users[author])
+
+    def follow_queries(self, url):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        return response, [q["sql"] for q in ctx.captured_queries if '"users_follow"' in q["sql"]]
+
+    def test__follow_is_idempotent_and_not_self(self):
+        for _ in range(2):
+            self.client.get(reverse("profile_follow", args=("b",)))
+        self.client.get(reverse("profile_follow", args=("a",)))
+        self.assertEqual(list(Follow.objects.values_list("user__username", "author__username")), [("a", "b")])
+        from users.models import Profile
+        self.assertEqual(Profile.objects.get(user=self.users["b"]).followers_count, 1)
+        for _ in range(2):
+            self.assertIn(self.client.get(reverse("profile_unfollow", args=("b",))).status_code, (301, 302))
+        self.assertFalse(Follow.objects.exists())
+
+    def test__following_check_comes_from_cached_set(self):
+        url = reverse("profile", args=("b",))
+        self.follow_queries(url)
+        response, queries = self.follow_queries(url)
+        self.assertEqual(queries, [])
+        self.assertFalse(response.context["following"])
+        self.client.get(reverse("profile_follow", args=("b",)))
+        response, _ = self.follow_queries(url)
+        self.assertTrue(response.context["following"])
+        self.client.get(reverse("profile_unfollow", args=("b",)))
+        self.assertFalse(self.client.get(url).context["following"])
+
+    def test__suggestions_from_friends_of_friends(self):
+        from users import graph
+        from users.models import Suggestion
+        for user, author in ("ab", "ae", "bc", "bd", "ec", "ba", "eb"):
+            self.follow(user, author)
+        with self.assertNumQueries(4):
+            # удаление, GROUP BY по графу, подписки пачки, вставка
+            graph.build_suggestions()
+        self.assertEqual(
+            [(s.candidate.username, s.mutual) for s in graph.suggestions(self.users["a"])], [("c", 2), ("d", 1)]
+        )
+        self.assertFalse(Suggestion.objects.filter(user=self.users["a"], candidate=self.users["a"]).exists())
+        self.assertFalse(Suggestion.objects.filter(user=self.users["a"], candidate=self.users["b"]).exists())
+        self.assertContains(self.client.get(reverse("follow_index")), "общих подписок: 2")
+
+        self.client.get(reverse("profile_follow", args=("c",)))
+        self.assertEqual([s.candidate.username for s in graph.suggestions(self.users["a"])], ["d"])
+
+    def test__import_skips_self_follows(self):
+        import os
+        import tempfile
+        from io import StringIO
+        from django.core.management import call_command
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "follows.jsonl")
+            with open(path, "w", encoding="utf-8") as target:
+                target.write('{"user": "c", "author": "c"}\n{"user": "c", "author": "d"}\n')
+            call_command("import_follows", path, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(list(Follow.objects.values_list("user__username", "author__username")), [("c", "d")])
+        from users import graph
+        self.assertEqual(graph.follower_ids(self.users["d"].id), {self.users["c"].id})
+
+
+@pytest.mark.django_db(transaction=True)
+class TestingWritePath(TransactionTestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(username="yaloh", password="loshik123")
+        self.post = Post.objects.create(text="пост", author=self.user)
+
+    def test__sqlite_connection_is_tuned(self):
+        from django.db import connection, transaction
+        from django.test.utils import CaptureQueriesContext
+        self.assertEqual(connection.settings_dict["ENGINE"], "yatube.sqlite3")
+        self.assertTrue(connection.immediate_transactions)
+        self.assertEqual(connection.journal_mode, "wal")
+        with CaptureQueriesContext(connection) as ctx:
+            with transaction.atomic():
+                Comment.objects.create(post=self.post, author=self.user, text="сразу с блокировкой")
+        self.assertEqual(ctx.captured_queries[0]["sql"], "BEGIN IMMEDIATE")
+
+    def test__comment_batches(self):
+        import threading
+        from django.test import override_settings
+        from posts import batching
+        with override_settings(COMMENT_BATCH_WAIT_MS=200):
+            writer = batching.get_writer()
+            errors = []
+
+            def comment(post_id, text):
+                try:
+                    batching.save(Comment(post_id=post_id, author_id=self.user.id, text=text))
+                except Exception as error:
+                    errors.append(error)
+
+            def burst(*targets):
+                threads = [threading.Thread(target=comment, args=target) for target in targets]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            burst(*((self.post.id, str(i)) for i in range(8)))
+            self.assertEqual(Comment.objects.filter(post=self.post).count(), 8)
+            self.assertEqual(Post.objects.get(pk=self.post.pk).comments_count, 8)
+            self.assertLess(writer.batches, 8)
+            # битый комментарий не утягивает за собой остальные из пачки
+            burst((self.post.id, "ещё"), (self.post.id + 100, "к несуществующему посту"))
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(Comment.objects.filter(post=self.post).count(), 9)
+
+    def test__batch_survives_failed_begin(self):
+        from concurrent.futures import Future
+        from unittest import mock
+        from django.db import OperationalError, transaction
+        from posts import batching
+        real_atomic = transaction.atomic
+        calls = []
+
+        def atomic(*args, **kwargs):
+            # первый atomic - BEGIN всей пачки - упирается в чужую блокировку
+            calls.append(1)
+            if len(calls) == 1:
+                raise OperationalError("database is locked")
+            return real_atomic(*args, **kwargs)
+
+        writer = batching.Writer(0, 10)
+        batch = [(Comment(post_id=self.post.id, author_id=self.user.id, text=str(i)), Future()) for i in range(3)]
+        batch.append((Comment(post_id=self.post.id + 100, author_id=self.user.id, text="битый"), Future()))
+        with mock.patch.object(batching.transaction, "atomic", atomic):
+            writer.write(batch)
+        self.assertTrue(all(future.done() for _, future in batch))
+        self.assertEqual([future.exception() is None for _, future in batch], [True, True, True, False])
+        self.assertEqual(Comment.objects.filter(post=self.post).count(), 3)
+
+        # неожиданная ошибка не убивает поток и не оставляет запрос ждать
+        with mock.patch.object(writer, "write", side_effect=RuntimeError("boom")):
+            future = writer.submit(Comment(post_id=self.post.id, author_id=self.user.id, text="потерянный"))
+            with self.assertRaises(RuntimeError):
+                future.result(5)
+        self.assertTrue(writer.thread.is_alive())
+
+    def test__add_comment_through_batch_writer(self):
+        from django.test import override_settings
+        client = Client()
+        client.login(username="yaloh", password="loshik123")
+        with override_settings(COMMENT_BATCH_WAIT_MS=5):
+            response = client.post(reverse("add_comment", args=("yaloh", self.post.id)), {"text": "пачкой"})
+        self.assertRedirects(response, reverse("post", args=("yaloh", self.post.id)))
+        self.assertContains(client.get(reverse("post", args=("yaloh", self.post.id))), "пачкой")
@@ -0,0 +1,106 @@
+"""
+Граф подписок.
+
+follow() и unfollow() идемпотентны: повторный клик не создаёт вторую
+строку (её запрещает и unique_follow), а отписка от того, на кого не
+подписан, ничего не делает. Множества id подписок и подписчиков лежат в
+кеше под версиями 'following:<user_id>' и 'followers:<author_id>', которые
+меняют сигналы Follow, поэтому «подписан ли я» на профиле - проверка в
+множестве, а не запрос. Подсказки «возможно, вы знакомы» (на кого
+подписаны ваши подписки) считает одним проходом по всему графу
+build_suggestions() (manage.py build_suggestions), страница только читает
+готовые строки Suggestion - из кеша под версиями 'following:<user_id>' и
+'suggestions' (её меняет пересчёт).
+"""
+from itertools import groupby
+from operator import itemgetter
+
+from django.db.models import Count, Exists, F, OuterRef
+
+from posts import cache as feed_cache
+from .models import Follow, Suggestion
+
+SUGGESTIONS_PER_USER = 20
+BATCH_SIZE = 500
+
+
+def namespaces(follow):
+    return ['follow:%s' % follow.user_id, 'following:%s' % follow.user_id, 'followers:%s' % follow.author_id]
+
+
+def _id_set(namespace, queryset):
+    key = '%s:%s' % (namespace, feed_cache.versions(namespace))
+    return feed_cache.single_flight(key, lambda: frozenset(queryset), feed_cache.timeout())
+
+
+def following_ids(user_id):
+    return _id_set('following:%s' % user_id, Follow.objects.filter(user_id=user_id).values_list('author_id', flat=True))
+
+
+def follower_ids(author_id):
+    return _id_set('followers:%s' % author_id, Follow.objects.filter(author_id=author_id).values_list('user_id', flat=True))
+
+
+def is_following(user, author_id):
+    return user.is_authenticated and user.pk != author_id and author_id in following_ids(user.pk)
+
+
+def follow(user, author):
+    """(подписка или None, создана ли сейчас); на себя подписаться нельзя."""
+    if user.pk == author.pk:
+        return None, False
+    return Follow.objects.get_or_create(user=user, author=author)
+
+
+def unfollow(user, author):
+    deleted, _ = Follow.objects.filter(user=user, author=author).delete()
+    return bool(deleted)
+
+
+def suggestions(user, limit=5):
+    """Готовые подсказки без тех, на кого пользователь подписался после пересчёта."""
+    key = 'suggestions:%s:%s:%s' % (user.pk, limit, feed_cache.versions('following:%s' % user.pk, 'suggestions'))
+    return feed_cache.single_flight(key, lambda: list(
+        Suggestion.objects.filter(user=user)
+        .exclude(Exists(Follow.objects.filter(user=user, author=OuterRef('candidate'))))
+        .select_related('candidate').order_by('-mutual', 'candidate_id')[:limit]
+    ), feed_cache.timeout())
+
+
+def _flush(groups, per_user):
+    following = set(Follow.objects.filter(user_id__in=[user_id for user_id, _ in groups])
+                    .values_list('user_id', 'author_id'))
+    Suggestion.objects.bulk_create(
+        (
+            Suggestion(user_id=user_id, candidate_id=candidate_id, mutual=mutual)
+            for user_id, rows in groups
+            for candidate_id, mutual in [
+                (candidate_id, mutual) for candidate_id, mutual in rows
+                if candidate_id != user_id and (user_id, candidate_id) not in following
+            ][:per_user]
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+
+def build_suggestions(per_user=SUGGESTIONS_PER_USER):
+    """
+    Пересчитывает подсказки всех пользователей: для каждой пары (A, C) -
+    сколько подписок A подписаны на C. Один GROUP BY по самосоединению
+    Follow, строки идут по A, уже отсортированные по убыванию.
+    """
+    Suggestion.objects.all().delete()
+    # Follow B -> C, к нему все A -> B
+    pairs = Follow.objects.filter(user__following__isnull=False) \
+        .values(follower=F('user__following__user'), candidate=F('author')) \
+        .annotate(mutual=Count('pk')).order_by('follower', '-mutual', 'candidate') \
+        .values_list('follower', 'candidate', 'mutual')
+    groups = []
+    for user_id, rows in groupby(pairs.iterator(), key=itemgetter(0)):
+        groups.append((user_id, [(candidate_id, mutual) for _, candidate_id, mutual in rows]))
+        if len(groups) >= BATCH_SIZE:
+            _flush(groups, per_user)
+            groups = []
+    if groups:
+        _flush(groups, per_user)
+    feed_cache.bump('suggestions')
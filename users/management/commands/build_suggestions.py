@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from users import graph
+from users.models import Suggestion
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает подсказки «возможно, вы знакомы»: на кого подписаны подписки пользователя"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--per-user", type=int, default=graph.SUGGESTIONS_PER_USER,
+                            help="сколько подсказок хранить на пользователя")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            graph.build_suggestions(options["per_user"])
+        self.stdout.write(self.style.SUCCESS("Подсказок: %s" % Suggestion.objects.count()))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from posts import bulk
+from users.models import Follow
+
+
+class Command(BaseCommand):
+    help = "Потоково выгружает подписки (user, author по username) в JSONL или CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", "-o", default="-", help="файл, по умолчанию stdout")
+        parser.add_argument("--format", choices=bulk.FORMATS, help="по умолчанию по расширению, иначе jsonl")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rows = Follow.objects.order_by("pk").values_list("user__username", "author__username") \
+            .iterator(chunk_size=options["chunk_size"])
+        with bulk.open_stream(options["output"], "w", self.stdout) as stream:
+            count = bulk.write_rows(stream, bulk.detect_format(options["output"], options["format"]),
+                                    ["user", "author"], rows)
+        self.stderr.write("Выгружено строк: %s" % count)
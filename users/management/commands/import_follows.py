@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from posts import bulk
+from users.models import Follow
+
+
+class Command(BaseCommand):
+    help = "Потоково загружает подписки из JSONL или CSV, затем пересчитывает счётчики и ленты"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="файл или - для stdin")
+        parser.add_argument("--format", choices=bulk.FORMATS, help="по умолчанию по расширению, иначе jsonl")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--create-users", action="store_true", help="создать недостающих пользователей")
+        parser.add_argument("--no-rebuild", action="store_true",
+                            help="не пересчитывать счётчики и ленты (потом reconcile_counters)")
+
+    def handle(self, *args, **options):
+        self.errors = 0
+        self.keys = bulk.NaturalKeys(create_users=options["create_users"])
+        self.namespaces = set()
+        with bulk.open_stream(options["path"], "r") as stream:
+            loaded, skipped = bulk.load(
+                bulk.read_rows(stream, bulk.detect_format(options["path"], options["format"])),
+                self.build, Follow, options["batch_size"], self.report, self.prepare,
+            )
+        if not options["no_rebuild"]:
+            bulk.finish_import(self.namespaces, rebuild_timelines=True)
+        self.stdout.write(self.style.SUCCESS(
+            "Обработано строк: %s (уже существующие пропущены), с ошибками: %s" % (loaded, skipped)
+        ))
+
+    def report(self, row, error):
+        self.errors += 1
+        if self.errors <= 20:
+            self.stderr.write("Пропущена строка %s: %s" % (row, error))
+
+    def prepare(self, chunk):
+        self.keys.ensure_users(name for row in chunk for name in (row.get("user"), row.get("author")))
+
+    def build(self, row):
+        user_id, author_id = self.keys.user(row.get("user")), self.keys.user(row.get("author"))
+        if user_id == author_id:
+            raise bulk.BadRow("подписка на себя")
+        self.namespaces.update(("follow:%s" % user_id, "following:%s" % user_id, "followers:%s" % author_id))
+        return {"user_id": user_id, "author_id": author_id}
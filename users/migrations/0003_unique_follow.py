@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, IntegerField, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_follows(apps, schema_editor):
+    Follow = apps.get_model('users', 'Follow')
+    Profile = apps.get_model('users', 'Profile')
+    keep = Follow.objects.values('user', 'author').annotate(first=Min('id')).values('first')
+    if not Follow.objects.exclude(id__in=keep).delete()[0]:
+        return
+
+    def count(field):
+        counted = Follow.objects.filter(**{field: OuterRef('user_id')}).order_by().values(field) \
+            .annotate(count=Count('pk')).values('count')
+        return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+    Profile.objects.update(followers_count=count('author'), following_count=count('user'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('users', '0002_profile'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_follows, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='follow',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='follower', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='unique_follow'),
+        ),
+    ]
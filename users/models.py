@@ -4,5 +4,35 @@ from posts.models import User
 
 
 class Follow(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="follower")
-    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="following")
\ No newline at end of file
+    # поиск по user покрывает уникальный индекс (user, author)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="follower", db_index=False)
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="following")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "author"], name="unique_follow"),
+        ]
+
+
+class Profile(models.Model):
+    # счётчики ведутся сигналами, сверяются командой reconcile_counters
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+
+
+class Suggestion(models.Model):
+    # «возможно, вы знакомы»: пересчитывает manage.py build_suggestions (users.graph)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="suggestions", db_index=False)
+    candidate = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    # сколько подписок user подписаны на candidate
+    mutual = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "candidate"], name="unique_suggestion"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-mutual", "candidate"], name="suggestion_user_mutual"),
+        ]
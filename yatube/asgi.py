@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+# под ASGI ленты отдают асинхронные view, см. posts/async_views.py
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
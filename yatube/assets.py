@@ -0,0 +1,248 @@
+"""
+Статика и медиа без отдельного веб-сервера.
+
+CompressedManifestStaticFilesStorage - ManifestStaticFilesStorage, который
+при collectstatic рядом с каждым файлом с хешем в имени кладёт сжатые
+копии: .gz всегда, .br - если установлен brotli. Сжимаются только те, что
+от этого заметно уменьшаются.
+
+AssetMiddleware отдаёт STATIC_URL из STATIC_ROOT и MEDIA_URL из MEDIA_ROOT
+прямо из процесса (SERVE_ASSETS), когда перед приложением нет CDN или
+nginx. Для статики выбирается готовая сжатая копия по Accept-Encoding, а
+файлы с хешем в имени кешируются браузером на год как immutable. Медиа
+отдаются с ETag и поддержкой Range: картинку можно докачать с места
+обрыва. Нарезки картинок (posts/images.py) несут хеш оригинала в имени и
+тоже кешируются как immutable, остальные медиа - на MEDIA_MAX_AGE.
+"""
+import asyncio
+import gzip
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('.css', '.js', '.mjs', '.map', '.svg', '.txt', '.html', '.json', '.xml', '.ico', '.ttf', '.eot')
+# меньше этого сжатие не окупает лишний заголовок и файл
+COMPRESS_MIN_SIZE = 256
+# сжатая копия нужна, только если она хотя бы на 5% меньше
+COMPRESS_MAX_RATIO = 0.95
+IMMUTABLE = 'public, max-age=31536000, immutable'
+CHUNK_SIZE = 64 * 1024
+
+_range = re.compile(r'^bytes=(\d*)-(\d*)$')
+# renditions/<post_id>/<name>-<хеш оригинала>.<ext>
+_hashed_media = re.compile(r'^renditions/\d+/\w+-[0-9a-f]{12}\.\w+$')
+
+
+def _compress(path):
+    with open(path, 'rb') as source:
+        data = source.read()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return []
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    written = []
+    for suffix, compressed in variants:
+        if len(compressed) <= len(data) * COMPRESS_MAX_RATIO:
+            with open(path + suffix, 'wb') as target:
+                target.write(compressed)
+            written.append(path + suffix)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if not dry_run and hashed_name and not isinstance(processed, Exception) \
+                    and hashed_name.endswith(COMPRESSIBLE):
+                _compress(self.path(hashed_name))
+            yield name, hashed_name, processed
+
+
+def _hashed_names():
+    hashed_files = getattr(staticfiles_storage, 'hashed_files', None)
+    return set(hashed_files.values()) if hashed_files else set()
+
+
+def _parse_range(header, size):
+    """(start, end) включительно, None - отдать целиком, ValueError - диапазон вне файла."""
+    match = _range.match(header.strip())
+    if match is None:
+        # несколько диапазонов сразу не поддерживаем - отдаём файл целиком, это допустимо
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as source:
+        source.seek(start)
+        while length > 0:
+            chunk = source.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+def _accepted_encodings(header):
+    """Accept-Encoding -> {кодировка: q}; q=0 - клиент её явно не принимает."""
+    accepted = {}
+    for item in header.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+    return accepted
+
+
+class AssetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SERVE_ASSETS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # иначе под ASGI вся цепочка за этим middleware стала бы синхронной
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        self.media_max_age = settings.MEDIA_MAX_AGE
+        # URL вида https://cdn... раздаёт не приложение
+        self.roots = [
+            (url, str(root), kind)
+            for url, root, kind in ((settings.STATIC_URL, settings.STATIC_ROOT, 'static'),
+                                    (settings.MEDIA_URL, settings.MEDIA_ROOT, 'media'))
+            if url and root and url.startswith('/')
+        ]
+        self.immutable = _hashed_names()
+
+    def __call__(self, request):
+        found = self.match(request)
+        if found is not None:
+            response = self.serve(request, *found)
+            return self._ready(response) if asyncio.iscoroutinefunction(self.get_response) else response
+        return self.get_response(request)
+
+    async def _ready(self, response):
+        return response
+
+    def match(self, request):
+        if request.method in ('GET', 'HEAD'):
+            for url, root, kind in self.roots:
+                if request.path_info.startswith(url):
+                    return root, request.path_info[len(url):], kind
+        return None
+
+    def serve(self, request, root, name, kind):
+        try:
+            path = safe_join(root, name)
+            info = os.stat(path)
+        except (SuspiciousFileOperation, OSError, ValueError):
+            return HttpResponse(status=404)
+        if not stat.S_ISREG(info.st_mode):
+            return HttpResponse(status=404)
+
+        content_type, _ = mimetypes.guess_type(path)
+        content_type = content_type or 'application/octet-stream'
+        if kind == 'static':
+            cache_control = IMMUTABLE if name in self.immutable else 'public, max-age=60'
+        elif _hashed_media.match(name):
+            cache_control = IMMUTABLE
+        else:
+            cache_control = 'public, max-age=%s' % self.media_max_age
+
+        encoding = None
+        if kind == 'static' and 'HTTP_RANGE' not in request.META:
+            path, info, encoding = self.pick_encoding(request, path, info)
+        etag = quote_etag('%x-%x%s' % (info.st_mtime_ns, info.st_size, '-' + encoding if encoding else ''))
+        last_modified = int(info.st_mtime)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = self.file_response(request, path, info.st_size, content_type, etag, last_modified)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = cache_control
+        response['Accept-Ranges'] = 'bytes'
+        if kind == 'static':
+            response['Vary'] = 'Accept-Encoding'
+        if encoding:
+            response['Content-Encoding'] = encoding
+        return response
+
+    def pick_encoding(self, request, path, info):
+        accepted = _accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if accepted.get(encoding, accepted.get('*', 0)) > 0:
+                try:
+                    compressed = os.stat(path + suffix)
+                except OSError:
+                    continue
+                return path + suffix, compressed, encoding
+        return path, info, None
+
+    def file_response(self, request, path, size, content_type, etag, last_modified):
+        byte_range = None
+        if 'HTTP_RANGE' in request.META and self.range_applies(request, etag, last_modified):
+            try:
+                byte_range = _parse_range(request.META['HTTP_RANGE'], size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */%s' % size
+                return response
+        if byte_range is None:
+            if request.method == 'HEAD':
+                response = HttpResponse(content_type=content_type)
+            else:
+                response = FileResponse(open(path, 'rb'), content_type=content_type)
+            response['Content-Length'] = size
+            return response
+        start, end = byte_range
+        length = end - start + 1
+        body = () if request.method == 'HEAD' else _read_range(path, start, length)
+        response = StreamingHttpResponse(body, status=206, content_type=content_type)
+        response['Content-Length'] = length
+        response['Content-Range'] = 'bytes %s-%s/%s' % (start, end, size)
+        return response
+
+    def range_applies(self, request, etag, last_modified):
+        # If-Range: докачка, только если файл не поменялся с прошлого раза
+        condition = request.META.get('HTTP_IF_RANGE')
+        if not condition:
+            return True
+        if condition.startswith(('"', 'W/')):
+            return condition == etag
+        moment = parse_http_date_safe(condition)
+        return moment is not None and moment >= last_modified
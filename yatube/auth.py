@@ -0,0 +1,51 @@
+"""
+Пользователь запроса без обращения к базе.
+
+request.user и так ленивый: AuthenticationMiddleware кладёт
+SimpleLazyObject, и анонимный запрос без cookie сессии не трогает ни
+хранилище сессий, ни таблицу пользователей. Залогиненный же на каждой
+странице (шапка показывает имя) платил двумя запросами: за сессию и за
+пользователя. Сессию убирает SESSION_BACKEND (cached_db, cache или
+signed_cookies, см. settings), пользователя - CachedModelBackend
+(AUTH_USER_CACHE, нужен общий для воркеров кеш): он берёт объект из кеша
+под 'auth-user:<id>', а сигналы сбрасывают запись при сохранении и
+удалении пользователя, в том числе при смене пароля и входе (last_login).
+Правки мимо save(), например QuerySet.update(), видны не позже чем через
+AUTH_USER_CACHE_TIMEOUT секунд. Сессии, выданные раньше через
+ModelBackend, продолжают работать через него же.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import PermissionDenied
+from django.core.cache import cache
+
+
+def _key(user_id):
+    return 'auth-user:%s' % user_id
+
+
+def timeout():
+    return getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 300)
+
+
+def forget_user(user_id):
+    cache.delete(_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user = super().authenticate(request, username=username, password=password, **kwargs)
+        if user is None and password is not None:
+            # ModelBackend следом проверил бы тот же пароль ещё раз
+            raise PermissionDenied
+        return user
+
+    def get_user(self, user_id):
+        key = _key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, user, timeout())
+        return user if self.user_can_authenticate(user) else None
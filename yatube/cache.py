@@ -0,0 +1,52 @@
+"""
+Сжатие крупных записей для memcached.
+
+FileBasedCache сжимает записи сам, для memcached сериализация
+подменяется: pickle, а если результат длиннее COMPRESS_MIN_LENGTH - zlib.
+"""
+import pickle
+import zlib
+
+from django.core.cache.backends.memcached import PyMemcacheCache
+
+COMPRESS_MIN_LENGTH = 1024
+COMPRESS_LEVEL = 6
+
+_RAW = b'\x00'
+_ZLIB = b'\x01'
+
+
+def dumps(value):
+    data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    if len(data) >= COMPRESS_MIN_LENGTH:
+        return _ZLIB + zlib.compress(data, COMPRESS_LEVEL)
+    return _RAW + data
+
+
+def loads(data):
+    if data[:1] == _ZLIB:
+        return pickle.loads(zlib.decompress(data[1:]))
+    return pickle.loads(data[1:])
+
+
+class CompressedSerde:
+    """serde для pymemcache: целые - флаг 1, остальное - сжатый pickle."""
+
+    FLAG_INT = 1
+    FLAG_PICKLE = 2
+
+    def serialize(self, key, value):
+        if type(value) is int:
+            return str(value).encode(), self.FLAG_INT
+        return dumps(value), self.FLAG_PICKLE
+
+    def deserialize(self, key, value, flags):
+        if flags == self.FLAG_INT:
+            return int(value)
+        return loads(value)
+
+
+class CompressedPyMemcacheCache(PyMemcacheCache):
+    def __init__(self, server, params):
+        super().__init__(server, params)
+        self._options = {**self._options, 'serde': CompressedSerde()}
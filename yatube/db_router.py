@@ -0,0 +1,142 @@
+"""
+Чтение с реплик, запись в основную базу.
+
+Реплики - все псевдонимы DATABASES, кроме 'default' (settings.DB_REPLICAS).
+На реплику уходит только чтение из view, помеченных @replica_reads, и
+только в GET/HEAD; всё остальное, включая сессии, читается из основной
+базы. Запись всегда идёт в 'default', после неё до конца запроса чтение
+тоже идёт туда, а браузер получает cookie, по которой следующие
+DB_REPLICA_STICKY_SECONDS секунд его запросы не ходят на реплики: автор
+сразу видит свой пост, комментарий или подписку, даже если реплика
+отстаёт. То, что кеш лент получил с реплики, живёт в нём не дольше того же
+окна (posts/cache.py), так что отставшая страница не закрепляется под
+новой версией.
+
+Состояние запроса живёт в contextvar, который заводит ReplicaMiddleware:
+потоки пула async-view получают его копию вместе с контекстом.
+"""
+import asyncio
+import contextvars
+import random
+import time
+
+from django.conf import settings
+
+STICKY_COOKIE = 'db_primary_until'
+# в эти приложения пишут почти на каждом запросе - читаем их только из основной базы
+PRIMARY_APPS = {'sessions'}
+
+_state = contextvars.ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+    __slots__ = ('replicas_allowed', 'wrote', 'alias')
+
+    def __init__(self):
+        self.replicas_allowed = False
+        self.wrote = False
+        self.alias = None
+
+
+def replica_reads(view):
+    """View только читает: её запросы можно отдать реплике."""
+    view.replica_reads = True
+    return view
+
+
+def replicas():
+    return getattr(settings, 'DB_REPLICAS', [])
+
+
+def mark_written():
+    """Запись этого запроса сделал другой поток (posts.batching)."""
+    state = _state.get()
+    if state is not None:
+        state.wrote = True
+
+
+def reads_from_replica():
+    """Чтение в текущем запросе может вернуть отставшие данные."""
+    state = _state.get()
+    return state is not None and state.replicas_allowed and not state.wrote and bool(replicas())
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.replicas_allowed or state.wrote or model._meta.app_label in PRIMARY_APPS:
+            return 'default'
+        if state.alias is None:
+            # одна реплика на весь запрос: страница не смешивает данные разной свежести
+            aliases = replicas()
+            state.alias = random.choice(aliases) if aliases else 'default'
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None and model._meta.app_label not in PRIMARY_APPS:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплики - копии основной базы, связи между ними законны
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # схема приходит на реплики репликацией (локально - manage.py sync_replicas)
+        return db == 'default'
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, 'DB_REPLICA_STICKY_SECONDS', 10)
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(response, state)
+
+    async def __acall__(self, request):
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(response, state)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _state.get()
+        if state is None or not replicas():
+            return None
+        state.replicas_allowed = (
+            getattr(view_func, 'replica_reads', False)
+            and request.method in ('GET', 'HEAD')
+            and not self.sticky(request)
+        )
+        return None
+
+    def sticky(self, request):
+        try:
+            return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def finish(self, response, state):
+        if state.wrote and replicas():
+            until = time.time() + self.sticky_seconds
+            response.set_cookie(STICKY_COOKIE, '%.3f' % until, max_age=self.sticky_seconds,
+                                httponly=True, samesite='Lax')
+        return response
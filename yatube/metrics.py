@@ -0,0 +1,329 @@
+"""
+Лёгкие метрики запросов без debug_toolbar.
+
+MetricsMiddleware на каждый запрос заводит счётчики в contextvar: время
+ответа, число и время SQL-запросов (execute_wrapper, без debug-курсора),
+попадания и промахи кеша и время отрисовки шаблонов. По окончании
+запроса они складываются в гистограммы процесса с меткой view - именем
+маршрута. /metrics/ отдаёт их в текстовом формате Prometheus; доступ по
+заголовку Authorization: Bearer <METRICS_TOKEN> или для staff.
+
+Медленные запросы (дольше METRICS_SLOW_REQUEST_MS) с вероятностью
+METRICS_TRACE_SAMPLE_RATE пишутся в лог yatube.metrics вместе со
+списком SQL и временем каждого.
+
+Гистограммы у каждого процесса свои: при нескольких воркерах
+Prometheus должен опрашивать каждый из них. Цену самих метрик можно
+измерить: manage.py bench с METRICS_ENABLED=0 и с METRICS_ENABLED=1.
+"""
+import asyncio
+import bisect
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates
+from django.utils.crypto import constant_time_compare
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# сколько SQL держать для трассировки медленного запроса
+TRACE_MAX_QUERIES = 200
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+_MISS = object()
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, labels):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.labels = labels
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def expose(self):
+        yield '# HELP %s %s' % (self.name, self.help_text)
+        yield '# TYPE %s histogram' % self.name
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            pairs = _labels(self.labels, labels)
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                yield '%s_bucket{%s,le="%s"} %s' % (self.name, pairs, bound, cumulative)
+            yield '%s_sum{%s} %s' % (self.name, pairs, round(total, 6))
+            yield '%s_count{%s} %s' % (self.name, pairs, count)
+
+
+class CounterMetric:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.series = Counter()
+
+    def inc(self, labels, value=1):
+        self.series[labels] += value
+
+    def expose(self):
+        yield '# HELP %s %s' % (self.name, self.help_text)
+        yield '# TYPE %s counter' % self.name
+        for labels, value in sorted(self.series.items()):
+            yield '%s{%s} %s' % (self.name, _labels(self.labels, labels), value)
+
+
+def _labels(names, values):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+                    for name, value in zip(names, values))
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.duration = Histogram('yatube_request_duration_seconds', 'Время ответа',
+                                      DURATION_BUCKETS, ('view', 'method', 'status'))
+            self.queries = Histogram('yatube_db_queries_per_request', 'SQL-запросов на запрос',
+                                     QUERY_BUCKETS, ('view',))
+            self.db_time = Histogram('yatube_db_duration_seconds', 'Время в базе за запрос',
+                                     DURATION_BUCKETS, ('view',))
+            self.template_time = Histogram('yatube_template_render_seconds', 'Время отрисовки шаблонов за запрос',
+                                           DURATION_BUCKETS, ('view',))
+            self.cache = CounterMetric('yatube_cache_requests_total', 'Чтения кеша', ('view', 'result'))
+            self.slow = CounterMetric('yatube_slow_requests_total', 'Запросы дольше METRICS_SLOW_REQUEST_MS',
+                                      ('view',))
+
+    def record(self, stats, method, status):
+        labels = (stats.view,)
+        with self.lock:
+            self.duration.observe((stats.view, method, '%sxx' % (status // 100)), stats.duration)
+            self.queries.observe(labels, stats.query_count)
+            self.db_time.observe(labels, stats.query_time)
+            self.template_time.observe(labels, stats.template_time)
+            if stats.cache_hits:
+                self.cache.inc((stats.view, 'hit'), stats.cache_hits)
+            if stats.cache_misses:
+                self.cache.inc((stats.view, 'miss'), stats.cache_misses)
+            if stats.slow:
+                self.slow.inc(labels)
+
+    def expose(self):
+        with self.lock:
+            lines = []
+            for metric in (self.duration, self.queries, self.db_time, self.template_time, self.cache, self.slow):
+                lines.extend(metric.expose())
+        lines.append('# TYPE yatube_process_start_time_seconds gauge')
+        lines.append('yatube_process_start_time_seconds{pid="%s"} %s' % (os.getpid(), round(_started, 3)))
+        return '\n'.join(lines) + '\n'
+
+
+_started = time.time()
+registry = Registry()
+
+
+class RequestStats:
+    __slots__ = ('view', 'started', 'duration', 'query_count', 'query_time', 'queries',
+                 'template_time', 'cache_hits', 'cache_misses', 'slow')
+
+    def __init__(self):
+        self.view = 'unresolved'
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.query_count = 0
+        self.query_time = 0.0
+        self.queries = []
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.slow = False
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if stats is not None:
+            elapsed = time.perf_counter() - started
+            stats.query_count += 1
+            stats.query_time += elapsed
+            if len(stats.queries) < TRACE_MAX_QUERIES:
+                stats.queries.append((elapsed, sql))
+
+
+def install_execute_wrapper(connection, **kwargs):
+    """Обёртка стоит на соединении постоянно: потоки пула у async-view заводят свои."""
+    if _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_wrapper)
+
+
+connection_created.connect(install_execute_wrapper)
+
+
+def instrument_cache(cache):
+    """
+    Подменяет get/get_many у класса кеша так, чтобы они считали попадания:
+    объекты кеша свои в каждом потоке, а класс общий.
+    """
+    cls = type(cache)
+    if cls.__dict__.get('_metrics_instrumented'):
+        return
+    get, get_many = cls.get, cls.get_many
+
+    def counted_get(self, key, default=None, version=None):
+        stats = _current.get()
+        if stats is None:
+            return get(self, key, default, version)
+        token = _current.set(None)
+        try:
+            value = get(self, key, _MISS, version)
+        finally:
+            _current.reset(token)
+        if value is _MISS:
+            stats.cache_misses += 1
+            return default
+        stats.cache_hits += 1
+        return value
+
+    def counted_get_many(self, keys, version=None):
+        stats = _current.get()
+        if stats is None:
+            return get_many(self, keys, version)
+        keys = list(keys)
+        # BaseCache.get_many ходит через get - без этого посчитали бы дважды
+        token = _current.set(None)
+        try:
+            found = get_many(self, keys, version)
+        finally:
+            _current.reset(token)
+        stats.cache_hits += len(found)
+        stats.cache_misses += len(keys) - len(found)
+        return found
+
+    cls.get, cls.get_many = counted_get, counted_get_many
+    cls._metrics_instrumented = True
+
+
+class _TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return self.template.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - started
+
+
+class InstrumentedTemplates(DjangoTemplates):
+    """Бэкенд DjangoTemplates, который засекает время render() шаблона страницы."""
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_seconds = getattr(settings, 'METRICS_SLOW_REQUEST_MS', 500) / 1000
+        self.sample_rate = getattr(settings, 'METRICS_TRACE_SAMPLE_RATE', 1.0)
+        for alias in settings.CACHES:
+            instrument_cache(caches[alias])
+        for connection in connections.all():
+            install_execute_wrapper(connection)
+        if asyncio.iscoroutinefunction(get_response):
+            # как в MiddlewareMixin: под ASGI цепочка остаётся асинхронной
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, stats)
+        return response
+
+    def finish(self, request, response, stats):
+        stats.duration = time.perf_counter() - stats.started
+        if request.resolver_match is not None:
+            stats.view = request.resolver_match.view_name or request.resolver_match._func_path
+        stats.slow = stats.duration >= self.slow_seconds
+        registry.record(stats, request.method, response.status_code)
+        if stats.slow and random.random() < self.sample_rate:
+            self.log_trace(request, response, stats)
+
+    def log_trace(self, request, response, stats):
+        repeated = Counter(sql for _, sql in stats.queries)
+        lines = ['%.1f ms  %s' % (elapsed * 1000, sql)
+                 for elapsed, sql in sorted(stats.queries, key=lambda query: query[0], reverse=True)[:20]]
+        logger.warning(
+            'Медленный запрос %s %s (%s, %s): %.1f ms, SQL %s за %.1f ms, шаблоны %.1f ms, кеш %s/%s, '
+            'повторов SQL %s\n%s',
+            request.method, request.get_full_path(), stats.view, response.status_code, stats.duration * 1000,
+            stats.query_count, stats.query_time * 1000, stats.template_time * 1000,
+            stats.cache_hits, stats.cache_hits + stats.cache_misses,
+            sum(count - 1 for count in repeated.values()), '\n'.join(lines),
+        )
+
+
+def metrics_view(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    allowed = (token and constant_time_compare(header, 'Bearer %s' % token)) or \
+        (request.user.is_authenticated and request.user.is_staff)
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,6 +1,7 @@
 
 import os
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -20,11 +21,92 @@ SECRET_KEY = os.getenv('SECRET_KEY')
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+# Кеш выбирается переменной окружения CACHE_BACKEND:
+#   locmem    - у каждого процесса свой (по умолчанию, разработка и тесты);
+#   file      - общий для всех воркеров на одной машине, записи сжаты zlib;
+#   memcached - общий сетевой (pymemcache), записи длиннее 1 КБ сжимаются.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': {
+            'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+            'file': 'django.core.cache.backends.filebased.FileBasedCache',
+            'memcached': 'yatube.cache.CompressedPyMemcacheCache',
+        }[CACHE_BACKEND],
+        'LOCATION': os.getenv('CACHE_LOCATION', {
+            'locmem': 'yatube',
+            'file': os.path.join(BASE_DIR, 'cache'),
+            'memcached': '127.0.0.1:11211',
+        }[CACHE_BACKEND]),
+        'KEY_PREFIX': os.getenv('CACHE_KEY_PREFIX', 'yatube'),
+        'VERSION': int(os.getenv('CACHE_VERSION', 1)),
+        'OPTIONS': {
+            'locmem': {'MAX_ENTRIES': 10000},
+            'file': {'MAX_ENTRIES': 100000},
+            'memcached': {'no_delay': True},
+        }[CACHE_BACKEND],
     }
 }
+# сколько живут страницы лент и посты в кеше; свежесть обеспечивают версии
+FEED_CACHE_TIMEOUT = int(os.getenv('FEED_CACHE_TIMEOUT', 60 * 60 * 24))
+# популярное (posts.trending) версий не имеет: пересчитывается не чаще раза в столько секунд
+TRENDING_CACHE_TIMEOUT = int(os.getenv('TRENDING_CACHE_TIMEOUT', 60))
+
+# Асинхронные версии лент (posts.async_views); yatube/asgi.py включает их сам
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', '0') == '1'
+
+# Метрики запросов (yatube.metrics), /metrics/ в формате Prometheus. Без
+# METRICS_TOKEN страница доступна только staff.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_SLOW_REQUEST_MS = int(os.getenv('METRICS_SLOW_REQUEST_MS', 500))
+METRICS_TRACE_SAMPLE_RATE = float(os.getenv('METRICS_TRACE_SAMPLE_RATE', 1))
+
+# Фоновые задачи (tasks/queue.py) выполняет manage.py run_tasks; с
+# TASKS_EAGER они выполняются сразу, без воркера (по умолчанию при DEBUG)
+TASKS_EAGER = (os.getenv('TASKS_EAGER') or ('1' if DEBUG else '0')) == '1'
+TASKS_KEEP_DONE_SECONDS = int(os.getenv('TASKS_KEEP_DONE_SECONDS', 7 * 24 * 60 * 60))
+# упавшие хранятся дольше, чтобы их успели разобрать; потом ключ снова свободен
+TASKS_KEEP_FAILED_SECONDS = int(os.getenv('TASKS_KEEP_FAILED_SECONDS', 30 * 24 * 60 * 60))
+# как часто воркер чистит старые задачи
+TASKS_PURGE_INTERVAL = int(os.getenv('TASKS_PURGE_INTERVAL', 60 * 60))
+
+# Комментарии пачками (posts/batching.py): поток-писатель ждёт до
+# COMMENT_BATCH_WAIT_MS мс и пишет накопившееся одной транзакцией; 0 - выключено
+COMMENT_BATCH_WAIT_MS = int(os.getenv('COMMENT_BATCH_WAIT_MS', 0))
+COMMENT_BATCH_SIZE = int(os.getenv('COMMENT_BATCH_SIZE', 50))
+
+# Сессии (SESSION_BACKEND):
+#   db             - таблица django_session, запрос на каждую страницу залогиненного
+#                    (по умолчанию, если кеш не общий);
+#   cached_db      - кеш поверх таблицы, база только при промахе (по умолчанию без DEBUG с общим кешем);
+#   cache          - только кеш;
+#   signed_cookies - подписанная cookie, на сервере ничего не хранится; выход не
+#                    отзывает уже выданную cookie, поэтому SESSION_COOKIE_AGE стоит держать коротким.
+# cached_db, cache и кеш пользователя (AUTH_USER_CACHE) требуют кеша, общего
+# для всех воркеров: с locmem выход, смена пароля или блокировка сбросили бы
+# запись только в том процессе, который их обработал. Без DEBUG такое
+# сочетание не запустится.
+SHARED_CACHE = CACHE_BACKEND == 'memcached'
+SESSION_BACKEND = os.getenv('SESSION_BACKEND') or ('cached_db' if SHARED_CACHE and not DEBUG else 'db')
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}[SESSION_BACKEND]
+# пользователь сессии берётся из кеша (yatube.auth); ModelBackend остаётся в
+# списке, иначе выданные до этого сессии (_auth_user_backend) разлогинятся
+AUTH_USER_CACHE = (os.getenv('AUTH_USER_CACHE') or ('1' if SHARED_CACHE or DEBUG else '0')) == '1'
+if not (SHARED_CACHE or DEBUG) and (AUTH_USER_CACHE or SESSION_BACKEND in ('cached_db', 'cache')):
+    raise ImproperlyConfigured(
+        'Кеш сессий или пользователя (SESSION_BACKEND=cached_db/cache, AUTH_USER_CACHE=1) с '
+        'CACHE_BACKEND=%s: нужен общий кеш, memcached' % CACHE_BACKEND
+    )
+AUTHENTICATION_BACKENDS = ['django.contrib.auth.backends.ModelBackend']
+if AUTH_USER_CACHE:
+    AUTHENTICATION_BACKENDS.insert(0, 'yatube.auth.CachedModelBackend')
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv('AUTH_USER_CACHE_TIMEOUT', 300))
 
 ALLOWED_HOSTS = [
         "*",]
@@ -35,6 +117,7 @@ ALLOWED_HOSTS = [
 INSTALLED_APPS = [
     'users',
     'posts',
+    'tasks',
     'django.contrib.sites',
     'django.contrib.flatpages',
     'django.contrib.admin',
@@ -48,6 +131,11 @@ INSTALLED_APPS = [
 
 SITE_ID = 1
 MIDDLEWARE = [
+    # статика и медиа отдаются до всей остальной цепочки (SERVE_ASSETS)
+    'yatube.assets.AssetMiddleware',
+    # первым после статики, чтобы в замер попали все остальные
+    'yatube.metrics.MetricsMiddleware',
+    'yatube.db_router.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,12 +148,22 @@ MIDDLEWARE = [
 ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+# TEMPLATE_CACHE: шаблоны разбираются один раз на процесс (cached.Loader), а
+# не при каждой отрисовке и каждом include; правки шаблонов видны только
+# после перезапуска. По умолчанию - когда DEBUG выключен.
+TEMPLATE_CACHE = (os.getenv('TEMPLATE_CACHE') or ('0' if DEBUG else '1')) == '1'
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, который засекает время отрисовки для yatube.metrics
+        'BACKEND': 'yatube.metrics.InstrumentedTemplates',
         'DIRS': [TEMPLATES_DIR],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)] if TEMPLATE_CACHE
+            else TEMPLATE_LOADERS,
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -82,12 +180,43 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': str(os.path.join(BASE_DIR, "db.sqlite3")),
-    }
+# Основная база и реплики только для чтения (yatube/db_router.py). DB_REPLICAS -
+# через запятую: для SQLite имена файлов (локальная замена реплик, их
+# наполняет manage.py sync_replicas), для серверных СУБД - хосты реплик.
+# Соединения живут DB_CONN_MAX_AGE секунд и переиспользуются запросами
+# (0 - закрывать после каждого). Пула соединений в Django нет: за пулером
+# в режиме транзакций (pgbouncer) нужен DB_DISABLE_SERVER_SIDE_CURSORS=1.
+# yatube.sqlite3 - SQLite под одновременную запись (WAL, ожидание блокировки
+# DB_SQLITE_TIMEOUT секунд, транзакции с BEGIN IMMEDIATE), см. yatube/sqlite3/base.py.
+DB_ENGINE = os.getenv('DB_ENGINE', 'yatube.sqlite3')
+_database = {
+    'ENGINE': DB_ENGINE,
+    'NAME': os.getenv('DB_NAME') or str(os.path.join(BASE_DIR, "db.sqlite3")),
+    'USER': os.getenv('DB_USER', ''),
+    'PASSWORD': os.getenv('DB_PASSWORD', ''),
+    'HOST': os.getenv('DB_HOST', ''),
+    'PORT': os.getenv('DB_PORT', ''),
+    'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+    'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_DISABLE_SERVER_SIDE_CURSORS', '0') == '1',
+    'OPTIONS': {
+        'timeout': float(os.getenv('DB_SQLITE_TIMEOUT', 20)),
+        'journal_mode': os.getenv('DB_SQLITE_JOURNAL_MODE', 'wal'),
+        'synchronous': os.getenv('DB_SQLITE_SYNCHRONOUS', 'normal'),
+        'immediate_transactions': os.getenv('DB_SQLITE_IMMEDIATE', '1') == '1',
+    } if DB_ENGINE == 'yatube.sqlite3' else {},
 }
+DATABASES = {'default': _database}
+for _number, _location in enumerate(filter(None, os.getenv('DB_REPLICAS', '').split(',')), 1):
+    DATABASES['replica%s' % _number] = dict(
+        _database,
+        **({'NAME': _location.strip()} if DB_ENGINE.endswith('sqlite3') else {'HOST': _location.strip()}),
+        # в тестах реплики смотрят в тестовую основную базу
+        TEST={'MIRROR': 'default'},
+    )
+DB_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['yatube.db_router.ReplicaRouter']
+# сколько секунд после записи браузер автора читает только из основной базы
+DB_REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', 10))
 
 
 # Password validation
@@ -158,4 +287,15 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Боевой режим статики (yatube/assets.py), по умолчанию - когда DEBUG выключен:
+# STATIC_MANIFEST - имена с хешем и сжатые .gz/.br копии при collectstatic,
+# SERVE_ASSETS - отдавать статику и медиа из самого приложения, если нет CDN.
+STATIC_MANIFEST = (os.getenv('STATIC_MANIFEST') or ('0' if DEBUG else '1')) == '1'
+if STATIC_MANIFEST:
+    STATICFILES_STORAGE = 'yatube.assets.CompressedManifestStaticFilesStorage'
+SERVE_ASSETS = (os.getenv('SERVE_ASSETS') or ('0' if DEBUG else '1')) == '1'
+# нарезки картинок с хешем в имени кешируются навсегда; оригиналы storage не
+# перезаписывает (занятое имя получает суффикс), поэтому и их кеш долгий
+MEDIA_MAX_AGE = int(os.getenv('MEDIA_MAX_AGE', 7 * 24 * 60 * 60))
\ No newline at end of file
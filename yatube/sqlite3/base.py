@@ -0,0 +1,42 @@
+"""
+SQLite, настроенный на конкурентную запись.
+
+journal_mode=WAL: читатели не ждут писателя и наоборот; synchronous=NORMAL
+в WAL не теряет целостность, а fsync делает только на контрольной точке.
+timeout (из OPTIONS, секунды) - сколько писатель ждёт блокировку, прежде
+чем получить "database is locked". Транзакции (transaction.atomic)
+начинаются с BEGIN IMMEDIATE: блокировка на запись берётся сразу, а не при
+первом INSERT, поэтому транзакция, которая сначала читает, а потом пишет,
+встаёт в очередь через busy timeout, а не падает мгновенно, когда между её
+чтением и записью успел закоммитить кто-то другой.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+JOURNAL_MODES = ('delete', 'truncate', 'persist', 'memory', 'wal', 'off')
+SYNCHRONOUS = ('off', 'normal', 'full', 'extra')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        # свои ключи OPTIONS в sqlite3.connect() не передаются
+        self.journal_mode = params.pop('journal_mode', 'wal').lower()
+        self.synchronous = params.pop('synchronous', 'normal').lower()
+        self.immediate_transactions = params.pop('immediate_transactions', True)
+        if self.journal_mode not in JOURNAL_MODES or self.synchronous not in SYNCHRONOUS:
+            raise ImproperlyConfigured('Неизвестный journal_mode или synchronous для SQLite')
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        # у базы в памяти (тесты) журнал всегда memory, PRAGMA просто промолчит
+        conn.execute('PRAGMA journal_mode = %s' % self.journal_mode)
+        conn.execute('PRAGMA synchronous = %s' % self.synchronous)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.immediate_transactions:
+            self.cursor().execute('BEGIN IMMEDIATE')
+        else:
+            super()._start_transaction_under_autocommit()
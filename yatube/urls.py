@@ -3,6 +3,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from posts import views
+from yatube import metrics
 import debug_toolbar
 from django.contrib.flatpages import views as vws
 from django.conf.urls import handler404, handler500
@@ -13,6 +14,8 @@ handler500 = "posts.views.server_error" # noqa
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("about/", include('django.contrib.flatpages.urls')),
+    # до posts.urls, иначе адрес съест профиль пользователя
+    path("metrics/", metrics.metrics_view, name="metrics"),
     path("", include("posts.urls")),
 
     path("auth/", include("users.urls")),